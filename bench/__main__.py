@@ -0,0 +1,115 @@
+"""Benchmark suite of the API.
+
+    python -m bench seed --users 200 --days 30 --truncate
+    python -m bench run --base-url http://127.0.0.1:8000 --concurrency 32 --output results.json
+    python -m bench compare baseline.json results.json --threshold 10
+    python -m bench serialization --points 10000
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import asyncpg
+
+from bench.context import load_context
+from bench.report import compare
+from bench.runner import run_benchmark
+from bench.scenarios import SCENARIOS
+from bench.serialization import measure
+from src.config import app_config
+from src.db.database import driver_dsn
+from src.db.migration import add_seed_arguments, seed_from_args
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    scenarios = [
+        scenario for scenario in SCENARIOS
+        if (not args.only or scenario.name in args.only) and (not args.tags or set(scenario.tags) & set(args.tags))
+    ]
+    connection = await asyncpg.connect(driver_dsn(app_config.dns))
+    try:
+        ctx = await load_context(connection, max_users=args.users, seed=args.seed)
+        endpoints = await run_benchmark(args.base_url, scenarios, ctx, connection, requests=args.requests,
+                                        concurrency=args.concurrency, warmup=args.warmup, timeout=args.timeout)
+    finally:
+        await connection.close()
+
+    return {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "users": len(ctx.users),
+            "seed": args.seed,
+        },
+        "endpoints": endpoints,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Seed, load test and compare API benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="bulk load generated dataset")
+    add_seed_arguments(seed_parser)
+
+    run_parser = commands.add_parser("run", help="drive every endpoint and write JSON results")
+    run_parser.add_argument("--base-url", default=f"http://{app_config.web_host}:{app_config.web_port}")
+    run_parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    run_parser.add_argument("--requests", type=int, default=1_000, help="measured requests per endpoint")
+    run_parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per endpoint")
+    run_parser.add_argument("--users", type=int, default=100, help="seeded users to spread requests over")
+    run_parser.add_argument("--seed", type=int, default=0, help="seed of request parameters")
+    run_parser.add_argument("--timeout", type=float, default=30.0)
+    run_parser.add_argument("--only", action="append", help="run only given endpoint, e.g. 'GET /sites'")
+    run_parser.add_argument("--tags", action="append", help="run only endpoints of given tag, e.g. metrics, write")
+    run_parser.add_argument("--output", help="JSON result file, printed to stdout by default")
+
+    compare_parser = commands.add_parser("compare", help="diff two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+
+    serialization_parser = commands.add_parser("serialization", help="time-series response serialization cost in process")
+    serialization_parser.add_argument("--points", type=int, default=10_000, help="points of the time series")
+    serialization_parser.add_argument("--repeat", type=int, default=20, help="measured runs per serializer")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        asyncio.run(seed_from_args(args))
+    elif args.command == "run":
+        results = json.dumps(asyncio.run(run(args)), indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, "w") as output:
+                output.write(results + "\n")
+        else:
+            print(results)
+    elif args.command == "serialization":
+        print(json.dumps(measure(args.points, args.repeat), indent=2))
+    else:
+        with open(args.base) as base, open(args.new) as new:
+            lines, regressions = compare(json.load(base), json.load(new), args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
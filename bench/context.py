@@ -0,0 +1,105 @@
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import asyncpg
+import jwt
+
+from src.config import app_config
+
+SELECT_USERS = """
+    SELECT u.id, u.access_level FROM users u
+    WHERE EXISTS (SELECT 1 FROM sites s JOIN devices d ON d.site_id = s.id WHERE s.user_id = u.id)
+    ORDER BY u.access_level = 'technical' DESC, u.id
+    LIMIT $1
+"""
+SELECT_DEVICES = """
+    SELECT s.user_id, s.id, d.id, d.name, d.type FROM sites s JOIN devices d ON d.site_id = s.id
+    WHERE s.user_id = ANY($1::uuid[])
+"""
+SELECT_SUBSCRIPTIONS = """
+    SELECT s.user_id, sub.id FROM subscriptions sub
+    JOIN devices d ON d.id = sub.device_id JOIN sites s ON s.id = d.site_id
+    WHERE s.user_id = ANY($1::uuid[])
+"""
+SELECT_DISPOSABLE_DEVICES = """
+    SELECT s.user_id, d.id FROM devices d JOIN sites s ON s.id = d.site_id
+    WHERE d.name LIKE 'bench-%' AND s.user_id = ANY($1::uuid[])
+"""
+SELECT_METRIC_TYPES = "SELECT DISTINCT device_id, metric_type FROM subscriptions WHERE device_id = ANY($1::uuid[])"
+
+
+@dataclass
+class BenchDevice:
+    id: uuid.UUID
+    site_id: uuid.UUID
+    name: str
+    type: str
+    metric_types: list[str] = field(default_factory=list)
+
+
+@dataclass
+class BenchUser:
+    id: uuid.UUID
+    access_level: str
+    token: str
+    sites: list[uuid.UUID] = field(default_factory=list)
+    devices: list[BenchDevice] = field(default_factory=list)
+    subscriptions: list[uuid.UUID] = field(default_factory=list)
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+@dataclass
+class BenchContext:
+    """Seeded users with signed tokens and ids of everything they own"""
+    users: list[BenchUser]
+    rng: random.Random
+    # (owner, device_id) of devices created by the benchmark itself, safe to delete
+    disposable_devices: list[tuple[BenchUser, uuid.UUID]] = field(default_factory=list)
+
+    def user(self, technical: bool = True) -> BenchUser:
+        users = [user for user in self.users if (user.access_level == "technical") == technical] or self.users
+        return self.rng.choice(users)
+
+    def device(self, user: BenchUser) -> BenchDevice:
+        return self.rng.choice(user.devices)
+
+
+def issue_token(user_id: uuid.UUID, access_level: str, lifetime_seconds: int) -> str:
+    claims = {"user_id": str(user_id), "access_level": access_level, "exp": int(time.time()) + lifetime_seconds}
+    return jwt.encode(claims, app_config.jwt_secret, algorithm="HS256")
+
+
+async def load_context(connection: asyncpg.Connection, max_users: int, seed: int, lifetime_seconds: int = 3600) -> BenchContext:
+    users = {
+        user_id: BenchUser(user_id, access_level, issue_token(user_id, access_level, lifetime_seconds))
+        for user_id, access_level in await connection.fetch(SELECT_USERS, max_users)
+    }
+    if not users:
+        raise RuntimeError("database has no users with devices, seed it first: python -m bench seed")
+
+    devices = {}
+    for user_id, site_id, device_id, name, device_type in await connection.fetch(SELECT_DEVICES, list(users)):
+        user = users[user_id]
+        if site_id not in user.sites:
+            user.sites.append(site_id)
+        devices[device_id] = BenchDevice(device_id, site_id, name, device_type)
+        user.devices.append(devices[device_id])
+    for device_id, metric_type in await connection.fetch(SELECT_METRIC_TYPES, list(devices)):
+        devices[device_id].metric_types.append(metric_type)
+    for user_id, subscription_id in await connection.fetch(SELECT_SUBSCRIPTIONS, list(users)):
+        users[user_id].subscriptions.append(subscription_id)
+
+    return BenchContext(users=list(users.values()), rng=random.Random(seed))
+
+
+async def load_disposable_devices(connection: asyncpg.Connection, ctx: BenchContext):
+    users = {user.id: user for user in ctx.users}
+    ctx.disposable_devices = [
+        (users[user_id], device_id)
+        for user_id, device_id in await connection.fetch(SELECT_DISPOSABLE_DEVICES, list(users))
+    ]
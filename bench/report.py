@@ -0,0 +1,64 @@
+import math
+
+
+def percentile(sorted_values: list[float], q: float) -> float | None:
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(q / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def _ms(seconds: float | None) -> float | None:
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def summarize(latencies: list[float], errors: int, statuses: dict[int, int], wall_seconds: float,
+              statements: dict | None) -> dict:
+    latencies = sorted(latencies)
+    requests = len(latencies) + errors
+    summary = {
+        "requests": requests,
+        "errors": errors,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "rps": round(requests / wall_seconds, 2) if wall_seconds else None,
+        "mean_ms": _ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(latencies[-1]) if latencies else None,
+        "queries_per_request": None,
+        "db_ms_per_request": None,
+        "rows_per_request": None,
+    }
+    if statements and requests:
+        summary["queries_per_request"] = round(statements["calls"] / requests, 3)
+        summary["db_ms_per_request"] = round(statements["exec_ms"] / requests, 3)
+        summary["rows_per_request"] = round(statements["rows"] / requests, 3)
+    return summary
+
+
+# metrics where higher value is a regression, rps is handled separately
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "queries_per_request")
+
+
+def compare(base: dict, new: dict, threshold_percent: float) -> tuple[list[str], list[str]]:
+    """Human readable diff of two result files and list of regressions over threshold"""
+    lines, regressions = [], []
+    for endpoint in sorted(set(base["endpoints"]) | set(new["endpoints"])):
+        before, after = base["endpoints"].get(endpoint), new["endpoints"].get(endpoint)
+        if before is None or after is None:
+            lines.append(f"{endpoint}: only in {'new' if before is None else 'base'}")
+            continue
+        changes = []
+        for metric in LOWER_IS_BETTER + ("rps",):
+            old, current = before.get(metric), after.get(metric)
+            if not old or current is None:
+                continue
+            change = (current - old) / old * 100
+            changes.append(f"{metric} {old} -> {current} ({change:+.1f}%)")
+            worse = -change if metric == "rps" else change
+            if worse > threshold_percent:
+                regressions.append(f"{endpoint} {metric} {change:+.1f}%")
+        lines.append(f"{endpoint}: {', '.join(changes)}")
+    return lines, regressions
@@ -0,0 +1,109 @@
+import asyncio
+import time
+from collections import Counter
+
+import asyncpg
+import httpx
+from loguru import logger
+
+from bench.context import BenchContext
+from bench.report import summarize
+from bench.scenarios import Scenario
+
+RESET_STATEMENTS = "SELECT pg_stat_statements_reset()"
+# statements of the benchmark itself and transaction control are not counted
+SELECT_STATEMENTS = r"""
+    SELECT coalesce(sum(calls), 0), coalesce(sum(total_exec_time), 0), coalesce(sum(rows), 0)
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+      AND query !~* 'pg_stat_statements'
+      AND query !~* '^\s*(BEGIN|COMMIT|ROLLBACK)'
+"""
+
+
+class StatementCounter:
+    """Database statements executed meanwhile, from pg_stat_statements when the extension is installed"""
+
+    def __init__(self, connection: asyncpg.Connection):
+        self._connection = connection
+        self.available = True
+
+    async def reset(self):
+        if not self.available:
+            return
+        try:
+            await self._connection.execute(RESET_STATEMENTS)
+        except asyncpg.PostgresError as e:
+            logger.warning(f"pg_stat_statements is not available, query counts are not reported: {e}")
+            self.available = False
+
+    async def collect(self) -> dict | None:
+        if not self.available:
+            return None
+        calls, exec_ms, rows = await self._connection.fetchrow(SELECT_STATEMENTS)
+        return {"calls": int(calls), "exec_ms": float(exec_ms), "rows": int(rows)}
+
+
+async def _send(client: httpx.AsyncClient, scenario: Scenario, request) -> int:
+    method, url, kwargs = request
+    if scenario.streaming:
+        async with client.stream(method, url, **kwargs) as response:
+            return response.status_code
+    response = await client.request(method, url, **kwargs)
+    return response.status_code
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, ctx: BenchContext, requests: int,
+                       concurrency: int, warmup: int, statements: StatementCounter) -> dict:
+    for _ in range(warmup):
+        request = scenario.build(ctx)
+        if request is None:
+            break
+        await _send(client, scenario, request)
+
+    latencies: list[float] = []
+    statuses: Counter[int] = Counter()
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            request = scenario.build(ctx)
+            if request is None:
+                return
+            started = time.perf_counter()
+            try:
+                status_code = await _send(client, scenario, request)
+            except httpx.HTTPError:
+                statuses[0] += 1
+                errors += 1
+                continue
+            statuses[status_code] += 1
+            if status_code in scenario.ok_statuses:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    await statements.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_seconds = time.perf_counter() - started
+    return summarize(latencies, errors, statuses, wall_seconds, await statements.collect())
+
+
+async def run_benchmark(base_url: str, scenarios: list[Scenario], ctx: BenchContext, connection: asyncpg.Connection,
+                        requests: int, concurrency: int, warmup: int, timeout: float) -> dict[str, dict]:
+    statements = StatementCounter(connection)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        for scenario in scenarios:
+            if scenario.prepare:
+                await scenario.prepare(connection, ctx)
+            results[scenario.name] = await run_scenario(client, scenario, ctx, requests, concurrency, warmup, statements)
+            result = results[scenario.name]
+            logger.info(f"{scenario.name}: {result['rps']} rps, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+                        f"{result['queries_per_request']} queries/request, {result['errors']} errors")
+    return results
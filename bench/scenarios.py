@@ -0,0 +1,178 @@
+import uuid
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+
+from bench.context import BenchContext, load_disposable_devices
+
+# (method, url, request kwargs) of one request, None once the scenario has nothing more to send
+Request = tuple[str, str, dict] | None
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """One endpoint under load, build returns a fresh request for every call"""
+    name: str
+    build: Callable[[BenchContext], Request]
+    ok_statuses: tuple[int, ...] = (200,)
+    prepare: Callable[[asyncpg.Connection, BenchContext], Awaitable[None]] | None = None
+    # body is not read, latency is time to response headers
+    streaming: bool = False
+    tags: tuple[str, ...] = field(default_factory=tuple)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _metric_type(ctx: BenchContext, device) -> str:
+    return ctx.rng.choice(device.metric_types or ["voltage"])
+
+
+def list_sites(ctx: BenchContext) -> Request:
+    user = ctx.user(technical=False)
+    return "GET", "/sites", {"headers": user.headers, "params": {"limit": 100}}
+
+
+def get_site(ctx: BenchContext) -> Request:
+    user = ctx.user(technical=False)
+    return "GET", f"/sites/{ctx.rng.choice(user.sites)}", {"headers": user.headers}
+
+
+def list_site_devices(ctx: BenchContext) -> Request:
+    user = ctx.user(technical=False)
+    return "GET", f"/sites/{ctx.rng.choice(user.sites)}/devices", {"headers": user.headers, "params": {"limit": 100}}
+
+
+def site_summary(ctx: BenchContext) -> Request:
+    user = ctx.user(technical=False)
+    return "GET", f"/sites/{ctx.rng.choice(user.sites)}/summary", {"headers": user.headers}
+
+
+def list_devices(ctx: BenchContext) -> Request:
+    user = ctx.user(technical=False)
+    return "GET", "/devices", {"headers": user.headers, "params": {"limit": 100}}
+
+
+def create_device(ctx: BenchContext) -> Request:
+    user = ctx.user()
+    payload = {"name": f"bench-{uuid.uuid4().hex[:12]}", "site_id": str(ctx.rng.choice(user.sites)), "type": "battery"}
+    return "POST", "/devices", {"headers": user.headers, "json": payload}
+
+
+def update_device(ctx: BenchContext) -> Request:
+    user = ctx.user()
+    device = ctx.device(user)
+    payload = {"name": device.name, "site_id": str(device.site_id), "type": device.type}
+    return "PUT", f"/devices/{device.id}", {"headers": user.headers, "json": payload}
+
+
+def delete_device(ctx: BenchContext) -> Request:
+    if not ctx.disposable_devices:
+        return None
+    user, device_id = ctx.disposable_devices.pop()
+    return "DELETE", f"/devices/{device_id}", {"headers": user.headers}
+
+
+def latest_metric(ctx: BenchContext) -> Request:
+    user = ctx.user()
+    device = ctx.device(user)
+    return "GET", f"/devices/{device.id}/metrics/latest", {"headers": user.headers, "params": {"metric_type": _metric_type(ctx, device)}}
+
+
+def site_latest_metrics(ctx: BenchContext) -> Request:
+    user = ctx.user(technical=False)
+    return "GET", f"/sites/{ctx.rng.choice(user.sites)}/metrics/latest", {"headers": user.headers}
+
+
+def latest_metrics_batch(ctx: BenchContext) -> Request:
+    user = ctx.user(technical=False)
+    devices = ctx.rng.sample(user.devices, min(20, len(user.devices)))
+    payload = {"device_ids": [str(device.id) for device in devices], "metric_types": ["voltage", "power_output"]}
+    return "POST", "/metrics/latest:batch", {"headers": user.headers, "json": payload}
+
+
+def export_site_metrics(ctx: BenchContext) -> Request:
+    user = ctx.user(technical=False)
+    end = _now()
+    params = {"start_time": (end - timedelta(hours=1)).isoformat(), "end_time": end.isoformat(), "format": "csv"}
+    return "GET", f"/sites/{ctx.rng.choice(user.sites)}/metrics/export", {"headers": user.headers, "params": params}
+
+
+def ingest_metrics(ctx: BenchContext) -> Request:
+    user = ctx.user()
+    now = _now()
+    readings = []
+    for offset in range(100):
+        device = ctx.device(user)
+        readings.append({
+            "time": (now - timedelta(microseconds=offset)).isoformat(),
+            "device_id": str(device.id),
+            "metric_type": _metric_type(ctx, device),
+            "value": ctx.rng.uniform(0.0, 100.0),
+        })
+    return "POST", "/metrics/batch", {"headers": user.headers, "json": readings}
+
+
+def create_subscription(ctx: BenchContext) -> Request:
+    user = ctx.user(technical=False)
+    device = ctx.device(user)
+    payload = {"device_ids": [str(device.id)], "metric_types": [_metric_type(ctx, device)]}
+    return "POST", "/subscriptions", {"headers": user.headers, "json": payload}
+
+
+def _subscribed_user(ctx: BenchContext):
+    users = [user for user in ctx.users if user.subscriptions]
+    return ctx.rng.choice(users)
+
+
+def time_series(ctx: BenchContext) -> Request:
+    user = _subscribed_user(ctx)
+    end = _now()
+    params = {"start_time": (end - timedelta(days=7)).isoformat(), "end_time": end.isoformat(), "interval": "1h"}
+    return "GET", f"/subscriptions/{ctx.rng.choice(user.subscriptions)}/time-series", {"headers": user.headers, "params": params}
+
+
+def alert_rules(ctx: BenchContext) -> Request:
+    user = _subscribed_user(ctx)
+    return "GET", f"/subscriptions/{ctx.rng.choice(user.subscriptions)}/alerts", {"headers": user.headers}
+
+
+def stream_connect(ctx: BenchContext) -> Request:
+    user = _subscribed_user(ctx)
+    return "GET", f"/subscriptions/{ctx.rng.choice(user.subscriptions)}/stream", {"headers": user.headers}
+
+
+def _admin(path: str) -> Callable[[BenchContext], Request]:
+    def build(ctx: BenchContext) -> Request:
+        return "GET", path, {"headers": ctx.user().headers}
+    return build
+
+
+SCENARIOS = [
+    Scenario("GET /sites", list_sites, tags=("sites",)),
+    Scenario("GET /sites/{site_id}", get_site, tags=("sites",)),
+    Scenario("GET /sites/{site_id}/devices", list_site_devices, tags=("sites",)),
+    Scenario("GET /sites/{site_id}/summary", site_summary, tags=("sites",)),
+    Scenario("GET /devices", list_devices, tags=("devices",)),
+    Scenario("POST /devices", create_device, tags=("devices", "write")),
+    Scenario("PUT /devices/{device_id}", update_device, tags=("devices", "write")),
+    # deletes only devices created by POST /devices scenario
+    Scenario("DELETE /devices/{device_id}", delete_device, prepare=load_disposable_devices, tags=("devices", "write")),
+    Scenario("GET /devices/{device_id}/metrics/latest", latest_metric, tags=("metrics",)),
+    Scenario("GET /sites/{site_id}/metrics/latest", site_latest_metrics, tags=("metrics",)),
+    Scenario("POST /metrics/latest:batch", latest_metrics_batch, tags=("metrics",)),
+    Scenario("GET /sites/{site_id}/metrics/export", export_site_metrics, tags=("metrics",)),
+    Scenario("POST /metrics/batch", ingest_metrics, ok_statuses=(200, 202), tags=("metrics", "write")),
+    # repeated subscriptions of the same pair answer 200, reported under "existing" instead of "created"
+    Scenario("POST /subscriptions", create_subscription, tags=("subscriptions", "write")),
+    Scenario("GET /subscriptions/{subscription_id}/time-series", time_series, tags=("subscriptions",)),
+    Scenario("GET /subscriptions/{subscription_id}/alerts", alert_rules, tags=("subscriptions",)),
+    Scenario("GET /subscriptions/{subscription_id}/stream", stream_connect, streaming=True, tags=("subscriptions",)),
+    Scenario("GET /admin/caches", _admin("/admin/caches"), tags=("admin",)),
+    Scenario("GET /admin/pool", _admin("/admin/pool"), tags=("admin",)),
+    Scenario("GET /admin/ingest", _admin("/admin/ingest"), tags=("admin",)),
+    Scenario("GET /admin/storage/chunks", _admin("/admin/storage/chunks"), tags=("admin",)),
+]
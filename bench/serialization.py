@@ -0,0 +1,74 @@
+"""Serialization cost of a time-series response, measured in process without server or database"""
+import json
+import statistics
+import time
+import uuid
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from src.routers.json_response import RowsJSONResponse
+from src.routers.router_model import TimeSeriesResponse
+
+TIME_SERIES_ADAPTER = TypeAdapter(TimeSeriesResponse)
+
+
+def time_series_rows(points: int) -> list[dict]:
+    """Rows as returned by get_subscription_timeseries_data"""
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [{"time": start + timedelta(minutes=i), "value": 230.0 + i % 97 / 10} for i in range(points)]
+
+
+def _content(rows: list[dict]) -> dict:
+    return {
+        "device_id": uuid.UUID(int=1),
+        "metric_type": "voltage",
+        "data": rows,
+        "start_time": rows[0]["time"] if rows else datetime(2025, 1, 1, tzinfo=timezone.utc),
+        "end_time": rows[-1]["time"] if rows else datetime(2025, 1, 1, tzinfo=timezone.utc),
+        "interval": "1m",
+        "aggregation": "avg",
+        "count": len(rows),
+    }
+
+
+def stdlib_json(rows: list[dict]) -> bytes:
+    # response model validated, then jsonable_encoder and json.dumps of starlette JSONResponse
+    model = TimeSeriesResponse(**_content(rows))
+    return json.dumps(jsonable_encoder(model), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def response_model(rows: list[dict]) -> bytes:
+    # response model built by the route and dumped by pydantic, FastAPI default when response_model is set
+    return TIME_SERIES_ADAPTER.dump_json(TimeSeriesResponse(**_content(rows)))
+
+
+def orjson_rows(rows: list[dict]) -> bytes:
+    # repository rows encoded as they are, no model
+    return RowsJSONResponse(_content(rows)).body
+
+
+SERIALIZERS: dict[str, Callable[[list[dict]], bytes]] = {
+    "stdlib_json": stdlib_json,
+    "response_model": response_model,
+    "orjson_rows": orjson_rows,
+}
+
+
+def measure(points: int, repeat: int) -> dict:
+    rows = time_series_rows(points)
+    results = {}
+    for name, serialize in SERIALIZERS.items():
+        body = serialize(rows)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            serialize(rows)
+            timings.append(time.perf_counter() - started)
+        results[name] = {
+            "ms_per_10k_points": round(statistics.median(timings) * 1000 * 10_000 / points, 3),
+            "bytes": len(body),
+        }
+    return {"points": points, "repeat": repeat, "serializers": results}
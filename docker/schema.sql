@@ -1,4 +1,6 @@
 CREATE EXTENSION IF NOT EXISTS pg_cron;
+-- per query call counts and timings, used by bench/
+CREATE EXTENSION IF NOT EXISTS pg_stat_statements;
 
 DROP TABLE users;
 CREATE TABLE users (
@@ -11,16 +13,21 @@ CREATE TABLE users (
 CREATE TABLE sites (
     id UUID PRIMARY KEY,
     name VARCHAR(100),
-    user_id UUID
+    user_id UUID,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
+CREATE INDEX IF NOT EXISTS sites_user_name_id_idx ON sites (user_id, (coalesce(name, '')), id);
+CREATE INDEX IF NOT EXISTS sites_user_id_idx ON sites (user_id, id);
 
 DROP TABLE devices;
 CREATE TABLE if not exists devices (
     id UUID PRIMARY KEY,
     name VARCHAR(100) NOT NULL,
     site_id UUID,
-    type VARCHAR(100)
+    type VARCHAR(100),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
+CREATE INDEX IF NOT EXISTS devices_site_name_id_idx ON devices (site_id, name, id);
 
 DROP TABLE IF EXISTS device_metrics;
 CREATE TABLE if not exists device_metrics (
@@ -32,6 +39,26 @@ CREATE TABLE if not exists device_metrics (
 );
 
 SELECT create_hypertable('device_metrics', by_range('time', INTERVAL '1 day'));
+CREATE INDEX IF NOT EXISTS device_metrics_device_metric_time_idx ON device_metrics (device_id, metric_type, time DESC);
+
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id UUID PRIMARY KEY,
+    device_id UUID REFERENCES devices (id),
+    metric_type VARCHAR NOT NULL,
+    created_at TIMESTAMP,
+    CONSTRAINT subscriptions_device_metric_key UNIQUE (device_id, metric_type)
+);
+
+CREATE TABLE IF NOT EXISTS alert_rules (
+    id UUID PRIMARY KEY,
+    subscription_id UUID NOT NULL REFERENCES subscriptions (id) ON DELETE CASCADE,
+    kind VARCHAR(20) NOT NULL,
+    operator VARCHAR(2) NOT NULL,
+    threshold DOUBLE PRECISION NOT NULL,
+    duration_seconds INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_alert_rules_subscription_id ON alert_rules (subscription_id);
 
 
 CREATE SCHEMA dev_stats;
@@ -0,0 +1,175 @@
+import uuid
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.devices_repository import SQLAlchemyDevices
+from src.db.metrics_repository import SQLAlchemyMetrics
+from src.db.site_repository import SQLAlchemySites
+
+
+# rows mirror attributes of ORM models, so routers and response models don't see the difference
+class SiteRow(NamedTuple):
+    id: uuid.UUID
+    name: str
+    user_id: uuid.UUID
+    updated_at: datetime
+
+
+class DeviceRow(NamedTuple):
+    id: uuid.UUID
+    name: str
+    site_id: uuid.UUID
+    type: str
+    updated_at: datetime
+
+
+class MetricRow(NamedTuple):
+    time: datetime
+    device_id: uuid.UUID
+    metric_type: str
+    value: float
+
+
+class SubscriptionRow(NamedTuple):
+    id: uuid.UUID
+    device_id: uuid.UUID
+    metric_type: str
+    created_at: datetime
+
+
+class DriverConnection:
+    """Lazily borrowed asyncpg connection of the SQLAlchemy session, shared by all repositories of a request"""
+
+    def __init__(self, session: AsyncSession):
+        self._session = session
+        self._connection = None
+
+    async def get(self):
+        if self._connection is None:
+            connection = await self._session.connection()
+            raw_connection = await connection.get_raw_connection()
+            self._connection = raw_connection.driver_connection
+        return self._connection
+
+    def reset(self):
+        self._connection = None
+
+
+# asyncpg prepares each statement once per connection and keeps it in its statement cache
+SELECT_SITE = "SELECT id, name, user_id, updated_at FROM sites WHERE id = $1"
+SELECT_USER_SITES = """
+    SELECT id, name, user_id, updated_at FROM sites WHERE user_id = $1
+    ORDER BY coalesce(name, ''), id LIMIT $2
+"""
+SELECT_USER_SITES_AFTER = """
+    SELECT id, name, user_id, updated_at FROM sites WHERE user_id = $1 AND (coalesce(name, ''), id) > ($2, $3)
+    ORDER BY coalesce(name, ''), id LIMIT $4
+"""
+SELECT_USER_OWNERSHIP = "SELECT s.id, d.id FROM sites s LEFT JOIN devices d ON d.site_id = s.id WHERE s.user_id = $1"
+SELECT_DEVICE = "SELECT id, name, site_id, type, updated_at FROM devices WHERE id = $1"
+SELECT_USER_DEVICES = """
+    SELECT d.id, d.name, d.site_id, d.type, d.updated_at FROM devices d JOIN sites s ON s.id = d.site_id
+    WHERE d.id = ANY($1::uuid[]) AND s.user_id = $2
+"""
+SELECT_SUBSCRIPTION = "SELECT id, device_id, metric_type, created_at FROM subscriptions WHERE id = $1"
+SELECT_LAST_VALUES = """
+    SELECT time, device_id, metric_type, value FROM device_metrics
+    WHERE device_id = $1 AND metric_type = $2 ORDER BY time DESC LIMIT $3
+"""
+SELECT_LATEST_BY_PAIRS = """
+    SELECT m.time, m.device_id, m.metric_type, m.value
+    FROM unnest($1::uuid[], $2::varchar[]) AS k(device_id, metric_type)
+    CROSS JOIN LATERAL (
+        SELECT time, device_id, metric_type, value FROM device_metrics d
+        WHERE d.device_id = k.device_id AND d.metric_type = k.metric_type
+        ORDER BY d.time DESC LIMIT 1
+    ) m
+"""
+SELECT_LATEST_BY_SITE = """
+    SELECT m.time, m.device_id, m.metric_type, m.value
+    FROM devices dev
+    CROSS JOIN unnest($2::varchar[]) AS t(metric_type)
+    CROSS JOIN LATERAL (
+        SELECT time, device_id, metric_type, value FROM device_metrics d
+        WHERE d.device_id = dev.id AND d.metric_type = t.metric_type
+        ORDER BY d.time DESC LIMIT 1
+    ) m
+    WHERE dev.site_id = $1
+"""
+
+
+class AsyncpgSites(SQLAlchemySites):
+    """ SitesRepository reads on raw asyncpg, writes are inherited from SQLAlchemy impl"""
+
+    def __init__(self, session: AsyncSession, driver: DriverConnection):
+        super().__init__(session)
+        self._driver = driver
+
+    async def get_user_site(self, site_id: uuid.UUID) -> SiteRow | None:
+        connection = await self._driver.get()
+        record = await connection.fetchrow(SELECT_SITE, site_id)
+        return SiteRow(*record) if record else None
+
+    async def get_all_user_sites(self, user_id: uuid.UUID, after: tuple[str, uuid.UUID] | None, limit: int) -> list[SiteRow]:
+        connection = await self._driver.get()
+        if after:
+            records = await connection.fetch(SELECT_USER_SITES_AFTER, user_id, *after, limit)
+        else:
+            records = await connection.fetch(SELECT_USER_SITES, user_id, limit)
+        return [SiteRow(*record) for record in records]
+
+    async def get_user_ownership(self, user_id: uuid.UUID) -> list[tuple[uuid.UUID, uuid.UUID | None]]:
+        connection = await self._driver.get()
+        return [tuple(record) for record in await connection.fetch(SELECT_USER_OWNERSHIP, user_id)]
+
+
+class AsyncpgDevices(SQLAlchemyDevices):
+    """ DevicesRepository reads on raw asyncpg, writes are inherited from SQLAlchemy impl"""
+
+    def __init__(self, session: AsyncSession, driver: DriverConnection):
+        super().__init__(session)
+        self._driver = driver
+
+    async def get_device(self, device_id: uuid.UUID) -> DeviceRow | None:
+        connection = await self._driver.get()
+        record = await connection.fetchrow(SELECT_DEVICE, device_id)
+        return DeviceRow(*record) if record else None
+
+    async def check_exist_user_devices(self, user_id: uuid.UUID, device_ids: [uuid.UUID]) -> list[DeviceRow]:
+        connection = await self._driver.get()
+        return [DeviceRow(*record) for record in await connection.fetch(SELECT_USER_DEVICES, list(device_ids), user_id)]
+
+
+class AsyncpgMetrics(SQLAlchemyMetrics):
+    """ MetricsRepository reads on raw asyncpg, the rest is inherited from SQLAlchemy impl"""
+
+    def __init__(self, session: AsyncSession, driver: DriverConnection):
+        super().__init__(session)
+        self._driver = driver
+
+    async def get_device_metric_last_values(self, device_id: uuid.UUID, metric_type: str | list[str], num_of_last_values: int=1) -> list[MetricRow]:
+        connection = await self._driver.get()
+        records = await connection.fetch(SELECT_LAST_VALUES, device_id, metric_type.lower(), num_of_last_values)
+        return [MetricRow(*record) for record in records]
+
+    async def get_latest_metrics(self, pairs: list[tuple[uuid.UUID, str]]) -> list[MetricRow]:
+        if not pairs:
+            return []
+        connection = await self._driver.get()
+        records = await connection.fetch(
+            SELECT_LATEST_BY_PAIRS,
+            [device_id for device_id, _ in pairs],
+            [metric_type for _, metric_type in pairs],
+        )
+        return [MetricRow(*record) for record in records]
+
+    async def get_site_latest_metrics(self, site_id: uuid.UUID, metric_types: list[str]) -> list[MetricRow]:
+        connection = await self._driver.get()
+        return [MetricRow(*record) for record in await connection.fetch(SELECT_LATEST_BY_SITE, site_id, metric_types)]
+
+    async def get_subscription(self, subscription_id: uuid.UUID) -> SubscriptionRow | None:
+        connection = await self._driver.get()
+        record = await connection.fetchrow(SELECT_SUBSCRIPTION, subscription_id)
+        return SubscriptionRow(*record) if record else None
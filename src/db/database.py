@@ -1,8 +1,14 @@
+import asyncio
+import time
 from collections.abc import AsyncGenerator
 
 from loguru import logger
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from prometheus_client import Histogram
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from src.config import app_config
+from src.db.asyncpg_repository import AsyncpgDevices, AsyncpgMetrics, AsyncpgSites, DriverConnection
 from src.db.devices_repository import SQLAlchemyDevices
 from src.db.metrics_repository import SQLAlchemyMetrics
 from src.db.repository import DevicesRepository, MetricsRepository, SitesRepository
@@ -10,12 +16,71 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.db.site_repository import SQLAlchemySites
 
-engine = create_async_engine(
-    app_config.dns,
-    future=True,
-    echo=True,
+
+def driver_dsn(dns: str) -> str:
+    """Plain asyncpg DSN of the SQLAlchemy database URL, for connections opened outside the pool"""
+    return make_url(dns).set(drivername="postgresql", query={}).render_as_string(hide_password=False)
+
+
+def worker_pool_limits(pool_size: int, max_overflow: int, max_connections: int, reserved: int, workers: int,
+                       dedicated: int) -> tuple[int, int]:
+    """Clamp pool_size and max_overflow, so pools of all workers fit into server max_connections.
+
+    Every worker gets an equal share of (max_connections - reserved), dedicated connections opened
+    outside the pool (LISTEN) are taken from the share first.
+    """
+    share = max((max_connections - reserved) // max(workers, 1) - dedicated, 1)
+    pool_size = min(pool_size, share)
+    return pool_size, max(min(max_overflow, share - pool_size), 0)
+
+
+POOL_SIZE, MAX_OVERFLOW = worker_pool_limits(
+    app_config.db_pool_size,
+    app_config.db_max_overflow,
+    max_connections=app_config.db_max_connections,
+    reserved=app_config.db_reserved_connections,
+    workers=app_config.web_workers,
+    dedicated=1 if app_config.cluster_notify else 0,
 )
 
+
+POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds", "Wait for a pooled connection, including opening a new one",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool reporting how long checkouts wait, a growing wait means the pool is too small"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+
+def create_engine() -> AsyncEngine:
+    # SQLAlchemy keeps its own prepared statement cache on top of asyncpg one, both are sized together
+    url = make_url(app_config.dns).update_query_dict(
+        {"prepared_statement_cache_size": str(app_config.db_statement_cache_size)}
+    )
+    return create_async_engine(
+        url,
+        echo=app_config.db_echo,
+        poolclass=TimedQueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=app_config.db_pool_timeout,
+        pool_recycle=app_config.db_pool_recycle,
+        pool_pre_ping=app_config.db_pool_pre_ping,
+        connect_args={"statement_cache_size": app_config.db_statement_cache_size},
+    )
+
+
+engine = create_engine()
+
 AsyncSessionFactory = async_sessionmaker(
     engine,
     autoflush=False,
@@ -23,6 +88,28 @@ AsyncSessionFactory = async_sessionmaker(
 )
 
 
+async def warm_up_pool(min_size: int):
+    """Open min_size connections upfront, so first requests don't pay for connecting"""
+    connections = [engine.connect() for _ in range(min(min_size, POOL_SIZE))]
+    await asyncio.gather(*(connection.start() for connection in connections))
+    await asyncio.gather(*(connection.close() for connection in connections))
+
+
+def pool_stats() -> dict:
+    pool = engine.pool
+    checked_out = pool.checkedout()
+    capacity = POOL_SIZE + MAX_OVERFLOW
+    return {
+        "pool_size": pool.size(),
+        "max_overflow": MAX_OVERFLOW,
+        "checked_in": pool.checkedin(),
+        "checked_out": checked_out,
+        # SQLAlchemy reports unopened part of the pool as negative overflow
+        "overflow": max(pool.overflow(), 0),
+        "utilization": checked_out / capacity if capacity else 0.0,
+    }
+
+
 class RepositoryContainer:
     def __init__(self, session: AsyncSession):
         self._session = session
@@ -50,16 +137,55 @@ class RepositoryContainer:
             self._sites_repo = SQLAlchemySites(self._session)
         return self._sites_repo
 
+    async def release(self):
+        """Return pooled connection before long living responses, e.g. metric streams"""
+        await self._session.close()
+
+
+class AsyncpgRepositoryContainer(RepositoryContainer):
+    """Repositories reading through raw asyncpg connection of the same session and pool"""
+
+    def __init__(self, session: AsyncSession):
+        super().__init__(session)
+        self._driver = DriverConnection(session)
+
+    @property
+    def devices(self) -> DevicesRepository:
+        if self._devices_repo is None:
+            self._devices_repo = AsyncpgDevices(self._session, self._driver)
+        return self._devices_repo
+
+    @property
+    def metrics(self) -> MetricsRepository:
+        if self._metrics_repo is None:
+            self._metrics_repo = AsyncpgMetrics(self._session, self._driver)
+        return self._metrics_repo
+
+    @property
+    def sites(self) -> SitesRepository:
+        if self._sites_repo is None:
+            self._sites_repo = AsyncpgSites(self._session, self._driver)
+        return self._sites_repo
+
+    async def release(self):
+        self._driver.reset()
+        await super().release()
+
+
+REPOSITORY_CONTAINERS = {
+    "sqlalchemy": RepositoryContainer,
+    "asyncpg": AsyncpgRepositoryContainer,
+}
+
 
 async def get_db() -> AsyncGenerator[RepositoryContainer| None]:
+    container_class = REPOSITORY_CONTAINERS[app_config.repository_backend]
     async with AsyncSessionFactory() as session:
-        logger.debug(f"ASYNC Pool: {engine.pool.status()}")
         try:
-            yield RepositoryContainer(session)
+            yield container_class(session)
         except Exception as e:
             logger.error(f"Error getting database session: {e}")
             await session.rollback()
             raise
         finally:
             await session.close()
-
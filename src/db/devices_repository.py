@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import select, delete, Result
+from sqlalchemy import select, delete, Result, tuple_
 from typing import Any
 
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -46,25 +46,53 @@ class SQLAlchemyDevices:
             setattr(device_model, k, v)
 
         await self._session.commit()
-        await self._session.refresh(Devices)
+        await self._session.refresh(device_model)
         return True
 
 
     async def delete_device(self, device_id: uuid.UUID) -> bool:
         result = await self._session.execute(delete(Devices).where(Devices.id == device_id))
         await self._session.commit()
-        return result.rowcount() > 0
+        return result.rowcount > 0
 
 
-    async def exist_device(self, user_id: uuid.UUID, device_ids: [uuid.UUID]) -> list:
+    async def check_exist_user_devices(self, user_id: uuid.UUID, device_ids: [uuid.UUID]) -> list:
         stmt = select(Devices).join(Sites).where(
             Devices.id.in_(device_ids),
-            Sites.user_id == uuid.UUID(user_id)
+            Sites.user_id == user_id
         )
 
         result: Result = await self._session.execute(stmt)
         return result.scalars().all()
 
+    async def get_site_devices(self, site_id: uuid.UUID, after: tuple[str, uuid.UUID] | None, limit: int) -> list[Devices]:
+        stmt = select(Devices).where(Devices.site_id == site_id).order_by(Devices.name, Devices.id).limit(limit)
+        if after:
+            stmt = stmt.where(tuple_(Devices.name, Devices.id) > tuple_(*after))
+        result: Result = await self._session.execute(stmt)
+        return result.scalars().all()
+
+    async def get_user_devices(self, user_id: uuid.UUID, after: tuple[uuid.UUID, str, uuid.UUID] | None,
+                               limit: int) -> list[Devices]:
+        """Devices of all user sites ordered by (site_id, name, id).
+
+        User sites are walked in id order over sites_user_id_idx and devices of each site are read in
+        (name, id) order from devices_site_name_id_idx, so the scan stops once `limit` rows are found and
+        deep pages cost the same as the first one.
+        """
+        stmt = (
+            select(Devices)
+            .join(Sites, Sites.id == Devices.site_id)
+            .where(Sites.user_id == user_id)
+            .order_by(Sites.id, Devices.name, Devices.id)
+            .limit(limit)
+        )
+        if after:
+            # the bound on sites.id lets the walk start at the cursor site instead of the first one
+            stmt = stmt.where(Sites.id >= after[0], tuple_(Devices.site_id, Devices.name, Devices.id) > tuple_(*after))
+        result: Result = await self._session.execute(stmt)
+        return result.scalars().all()
+
     def _to_domain(self, device_model) -> DeviceFullResponse:
         """Convert SQLAlchemy model to domain object"""
         return DeviceFullResponse(
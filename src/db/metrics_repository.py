@@ -1,14 +1,59 @@
 import uuid
-from datetime import datetime
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta
 
-from sqlalchemy import select, func
+from sqlalchemy import select, delete, func, and_, bindparam, true, cast, String, table, column, DateTime, Float, BigInteger, text
 from typing import Any
 
+from sqlalchemy.dialects.postgresql import ARRAY, UUID, insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 from sqlalchemy import exc, Result
 
-from src.db.repository import TimeSeriesQuery
-from src.models import DeviceMetrics, Devices, Subscription
+from src.config import app_config
+from src.db.repository import TimeSeriesQuery, parse_interval
+from src.db.timescale import select_rollup
+from src.models import AlertRule, DeviceMetrics, Devices, Subscription
+from src.services.instrumentation import timed_statement
+
+METRIC_COLUMNS = ("time", "device_id", "metric_type", "value")
+
+# aggregations are evaluated by TimescaleDB, first/last are its hyperfunctions
+AGGREGATION_FUNCS = {
+    "avg": lambda value, time: func.avg(value),
+    "sum": lambda value, time: func.sum(value),
+    "min": lambda value, time: func.min(value),
+    "max": lambda value, time: func.max(value),
+    "count": lambda value, time: func.count(value),
+    "first": lambda value, time: func.first(value, time),
+    "last": lambda value, time: func.last(value, time),
+}
+
+# the same aggregations re-evaluated over continuous aggregate buckets
+ROLLUP_AGGREGATION_FUNCS = {
+    "avg": lambda rollup: func.sum(rollup.c.sum) / func.nullif(func.sum(rollup.c.count), 0),
+    "sum": lambda rollup: func.sum(rollup.c.sum),
+    "min": lambda rollup: func.min(rollup.c.min),
+    "max": lambda rollup: func.max(rollup.c.max),
+    "count": lambda rollup: func.sum(rollup.c.count),
+    "first": lambda rollup: func.first(rollup.c.first, rollup.c.bucket),
+    "last": lambda rollup: func.last(rollup.c.last, rollup.c.bucket),
+}
+
+
+def _rollup_table(name: str):
+    return table(
+        name,
+        column("bucket", DateTime(timezone=True)),
+        column("device_id", UUID(as_uuid=True)),
+        column("metric_type", String),
+        column("sum", Float),
+        column("min", Float),
+        column("max", Float),
+        column("count", BigInteger),
+        column("first", Float),
+        column("last", Float),
+    )
 
 
 class SQLAlchemyMetrics:
@@ -19,11 +64,12 @@ class SQLAlchemyMetrics:
 
 
     async def get_device_metric_last_values(self, device_id: uuid.UUID, metric_type: str | list[str], num_of_last_values: int=1) -> list[DeviceMetrics]:
+        # metric types are stored lower-cased, comparing raw column keeps the index usable
         stmt = (
             select(DeviceMetrics)
             .where(
                 DeviceMetrics.device_id == device_id,
-                func.lower(DeviceMetrics.metric_type) == metric_type.lower()
+                DeviceMetrics.metric_type == metric_type.lower()
             )
             .order_by(DeviceMetrics.time.desc())
             .limit(num_of_last_values)
@@ -34,24 +80,202 @@ class SQLAlchemyMetrics:
         return scalars.all()
 
 
-    async def create_devices_subscriptions(self, device_ids: list[uuid.UUID], metric_types: list[str], existing_pairs:set[tuple[Any, Any]]) -> bool:
-        for device_id in device_ids:
-            for metric_type in metric_types:
-                if (device_id, metric_type) not in existing_pairs:
-                    subscription = Subscription(
-                        id=uuid.uuid4(),
-                        device_id=device_id,
-                        metric_type=metric_type,
-                        created_at=datetime.utcnow()
-                    )
-                    self._session.add(subscription)
+    async def get_latest_metrics(self, pairs: list[tuple[uuid.UUID, str]]) -> list[DeviceMetrics]:
+        """Newest reading of every (device_id, metric_type) pair resolved in one LATERAL query"""
+        if not pairs:
+            return []
+
+        keys = func.unnest(
+            bindparam('device_ids', [device_id for device_id, _ in pairs], type_=ARRAY(UUID(as_uuid=True))),
+            bindparam('metric_types', [metric_type for _, metric_type in pairs], type_=ARRAY(String)),
+        ).table_valued('device_id', 'metric_type').render_derived(name='k')
+        latest = self._latest_lateral(keys.c.device_id, keys.c.metric_type)
+        stmt = select(aliased(DeviceMetrics, latest)).select_from(keys).join(latest, true())
+
+        result: Result = await self._session.execute(stmt)
+        return result.scalars().all()
+
+
+    async def get_site_latest_metrics(self, site_id: uuid.UUID, metric_types: list[str]) -> list[DeviceMetrics]:
+        """Newest reading of given metric types for every device of the site, in one query"""
+        types = func.unnest(
+            bindparam('metric_types', metric_types, type_=ARRAY(String))
+        ).table_valued('metric_type').render_derived(name='t')
+        latest = self._latest_lateral(Devices.id, types.c.metric_type)
+        stmt = (
+            select(aliased(DeviceMetrics, latest))
+            .select_from(Devices)
+            .join(types, true())
+            .join(latest, true())
+            .where(Devices.site_id == site_id)
+        )
+
+        result: Result = await self._session.execute(stmt)
+        return result.scalars().all()
+
+
+    async def get_site_metric_buckets(self, site_id: uuid.UUID, metric_types: list[str], bucket_width: timedelta,
+                                      start_time: datetime) -> list[dict]:
+        """Sum, count and max per bucket of every site device with its type, read from rollup when one fits"""
+        rollup = select_rollup(bucket_width, start_time) if app_config.use_rollups else None
+        if rollup:
+            source = _rollup_table(rollup.view)
+            time_column = source.c.bucket
+            total, count, maximum = func.sum(source.c.sum), func.sum(source.c.count), func.max(source.c.max)
+        else:
+            source = DeviceMetrics.__table__
+            time_column = source.c.time
+            total, count, maximum = func.sum(source.c.value), func.count(source.c.value), func.max(source.c.value)
+
+        bucket = func.time_bucket(bucket_width, time_column).label('bucket')
+        stmt = (
+            select(
+                bucket,
+                source.c.device_id,
+                Devices.type.label('device_type'),
+                source.c.metric_type,
+                total.label('sum'),
+                count.label('count'),
+                maximum.label('max'),
+            )
+            .select_from(source)
+            .join(Devices, Devices.id == source.c.device_id)
+            .where(
+                Devices.site_id == site_id,
+                source.c.metric_type.in_(metric_types),
+                time_column >= start_time,
+            )
+            .group_by(bucket, source.c.device_id, Devices.type, source.c.metric_type)
+        )
+
+        result: Result = await self._session.execute(stmt)
+        return [dict(row._mapping) for row in result]
+
+
+    @staticmethod
+    def _latest_lateral(device_id, metric_type):
+        # walks (device_id, metric_type, time DESC) index, one row per outer pair
+        return (
+            select(DeviceMetrics)
+            .where(
+                DeviceMetrics.device_id == device_id,
+                DeviceMetrics.metric_type == metric_type,
+            )
+            .order_by(DeviceMetrics.time.desc())
+            .limit(1)
+            .lateral('latest')
+        )
+
+
+    async def stream_site_metrics(self, site_id: uuid.UUID, start_time: datetime, end_time: datetime,
+                                  batch_size: int) -> AsyncIterator[list[tuple]]:
+        """Raw readings of site devices fetched through server-side cursor, batch by batch"""
+        stmt = (
+            select(DeviceMetrics.time, DeviceMetrics.device_id, DeviceMetrics.metric_type, DeviceMetrics.value)
+            .join(Devices, Devices.id == DeviceMetrics.device_id)
+            .where(
+                Devices.site_id == site_id,
+                DeviceMetrics.time >= start_time,
+                DeviceMetrics.time < end_time,
+            )
+            .order_by(DeviceMetrics.time)
+            .execution_options(yield_per=batch_size)
+        )
+        result = await self._session.stream(stmt)
+        async for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+
+
+    async def insert_metrics(self, records: list[tuple[datetime, uuid.UUID, str, float]]
+                             ) -> list[tuple[datetime, uuid.UUID, str, float]]:
+        """COPY readings into a staging table and merge them into the hypertable.
+
+        Readings already stored under the same (time, device_id, metric_type) key are skipped,
+        returns the inserted readings only, so duplicates of a retried batch are not published again.
+        """
+        if not records:
+            return []
+
+        connection = await self._session.connection()
+        raw_connection = await connection.get_raw_connection()
+        driver = raw_connection.driver_connection
+
+        async with driver.transaction():
+            # the staging table lives as long as the pooled connection and is emptied by every commit
+            await driver.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS device_metrics_stage "
+                "(LIKE device_metrics INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            )
+            # COPY is not reported by asyncpg query logger, the merge below is
+            with timed_statement("COPY device_metrics_stage FROM STDIN"):
+                await driver.copy_records_to_table("device_metrics_stage", records=records, columns=METRIC_COLUMNS)
+            inserted = await driver.fetch(
+                "INSERT INTO device_metrics (time, device_id, metric_type, value) "
+                "SELECT time, device_id, metric_type, value FROM device_metrics_stage "
+                "ON CONFLICT DO NOTHING "
+                "RETURNING time, device_id, metric_type, value"
+            )
+        await self._session.commit()
+        return [tuple(record) for record in inserted]
+
+
+    async def get_chunk_stats(self) -> list[dict]:
+        """Size of every device_metrics chunk, compressed ones with their size before compression"""
+        result: Result = await self._session.execute(text("""
+            SELECT c.chunk_name, c.range_start, c.range_end, c.is_compressed,
+                   d.total_bytes,
+                   s.before_compression_total_bytes, s.after_compression_total_bytes
+            FROM timescaledb_information.chunks c
+            JOIN chunks_detailed_size('device_metrics') d ON d.chunk_name = c.chunk_name
+            LEFT JOIN chunk_compression_stats('device_metrics') s ON s.chunk_name = c.chunk_name
+            WHERE c.hypertable_name = 'device_metrics'
+            ORDER BY c.range_start
+        """))
+        return [
+            {
+                'chunk_name': row.chunk_name,
+                'range_start': row.range_start,
+                'range_end': row.range_end,
+                'is_compressed': row.is_compressed,
+                'total_bytes': row.total_bytes,
+                'before_compression_bytes': row.before_compression_total_bytes,
+                'after_compression_bytes': row.after_compression_total_bytes,
+            }
+            for row in result
+        ]
+
+
+    async def create_devices_subscriptions(self, pairs: list[tuple[uuid.UUID, str]]) -> list | None:
+        """Insert missing (device_id, metric_type) pairs in one statement, returns created rows.
+
+        Pairs are sent as arrays, so the statement has three parameters whatever the batch size.
+        Existing pairs are skipped by the unique constraint, None means a device vanished meanwhile.
+        """
+        if not pairs:
+            return []
+        rows = func.unnest(
+            bindparam('ids', [uuid.uuid4() for _ in pairs], type_=ARRAY(UUID(as_uuid=True))),
+            bindparam('device_ids', [device_id for device_id, _ in pairs], type_=ARRAY(UUID(as_uuid=True))),
+            bindparam('metric_types', [metric_type for _, metric_type in pairs], type_=ARRAY(String)),
+        ).table_valued('id', 'device_id', 'metric_type').render_derived(name='p')
+        stmt = (
+            pg_insert(Subscription)
+            .from_select(
+                ['id', 'device_id', 'metric_type', 'created_at'],
+                select(rows.c.id, rows.c.device_id, rows.c.metric_type, bindparam('created_at', datetime.utcnow())),
+            )
+            .on_conflict_do_nothing(index_elements=['device_id', 'metric_type'])
+            .returning(Subscription.id, Subscription.device_id, Subscription.metric_type, Subscription.created_at)
+        )
 
         try:
+            result: Result = await self._session.execute(stmt)
+            created = result.all()
             await self._session.commit()
         except exc.IntegrityError:
             await self._session.rollback()
-            return False
-        return True
+            return None
+        return created
 
 
     async def create_device_subscriptions(self, device_id: int, metric_type: str) -> bool:
@@ -107,7 +331,118 @@ class SQLAlchemyMetrics:
             return True
         return False
 
+    async def get_subscription_keys(self) -> list[tuple[uuid.UUID, uuid.UUID, str]]:
+        """(id, device_id, metric_type) of every subscription, source of the in-memory index"""
+        result: Result = await self._session.execute(
+            select(Subscription.id, Subscription.device_id, Subscription.metric_type)
+        )
+        return [tuple(row) for row in result]
+
+
+    async def delete_subscription(self, subscription_id: uuid.UUID) -> bool:
+        result = await self._session.execute(delete(Subscription).where(Subscription.id == subscription_id))
+        await self._session.commit()
+        return result.rowcount > 0
+
+
+    async def get_subscription(self, subscription_id: uuid.UUID) -> Subscription | None:
+        result: Result = await self._session.execute(select(Subscription).where(Subscription.id == subscription_id))
+        return result.scalar_one_or_none()
+
+
+    async def create_alert_rule(self, subscription_id: uuid.UUID, rule: dict[str, Any]) -> AlertRule:
+        alert_rule = AlertRule(id=uuid.uuid4(), subscription_id=subscription_id, created_at=datetime.utcnow(), **rule)
+        self._session.add(alert_rule)
+        await self._session.commit()
+        return alert_rule
+
+
+    async def get_alert_rules(self, subscription_id: uuid.UUID | None = None) -> list[dict]:
+        """Rules with (device_id, metric_type) of their subscription, all of them when no subscription is given"""
+        stmt = (
+            select(AlertRule, Subscription.device_id, Subscription.metric_type)
+            .join(Subscription, Subscription.id == AlertRule.subscription_id)
+            .order_by(AlertRule.created_at)
+        )
+        if subscription_id is not None:
+            stmt = stmt.where(AlertRule.subscription_id == subscription_id)
+
+        result: Result = await self._session.execute(stmt)
+        return [
+            {
+                'id': rule.id,
+                'subscription_id': rule.subscription_id,
+                'device_id': device_id,
+                'metric_type': metric_type,
+                'kind': rule.kind,
+                'operator': rule.operator,
+                'threshold': rule.threshold,
+                'duration_seconds': rule.duration_seconds,
+            }
+            for rule, device_id, metric_type in result
+        ]
+
+
+    async def delete_alert_rule(self, subscription_id: uuid.UUID, rule_id: uuid.UUID) -> bool:
+        result = await self._session.execute(
+            delete(AlertRule).where(AlertRule.id == rule_id, AlertRule.subscription_id == subscription_id)
+        )
+        await self._session.commit()
+        return result.rowcount > 0
+
+
+    async def get_subscription_timeseries_data(self, subscription_id: uuid.UUID, query: TimeSeriesQuery) -> list[dict]:
+        rows = await self.get_subscriptions_timeseries_data([subscription_id], query)
+        return [{'time': row['time'], 'value': row['value']} for row in rows]
+
+
     async def get_subscriptions_timeseries_data(self, subscription_ids: list[uuid.UUID], query: TimeSeriesQuery) -> list[dict]:
-        ...
+        """Downsample subscribed metrics with time_bucket, so only one row per bucket leaves the database.
 
+        When requested interval and range are composed of whole rollup buckets, the coarsest continuous
+        aggregate is read instead of raw readings. Rollup buckets are then selected by their start time.
+        """
+        bucket_width = parse_interval(query.interval or "1h")
+        aggregation = query.aggregation or "avg"
+        rollup = select_rollup(bucket_width, query.start_time, query.end_time) if app_config.use_rollups else None
 
+        if rollup:
+            source = _rollup_table(rollup.view)
+            time_column = source.c.bucket
+            value = ROLLUP_AGGREGATION_FUNCS[aggregation](source)
+        else:
+            source = DeviceMetrics.__table__
+            time_column = source.c.time
+            value = AGGREGATION_FUNCS[aggregation](source.c.value, source.c.time)
+
+        bucket = func.time_bucket(bucket_width, time_column).label('time')
+        stmt = (
+            select(
+                Subscription.id.label('subscription_id'),
+                bucket,
+                # double precision for every aggregation, counts come as bigint or numeric otherwise
+                cast(value, Float).label('value'),
+            )
+            .select_from(source)
+            .join(Subscription, and_(
+                Subscription.device_id == source.c.device_id,
+                Subscription.metric_type == source.c.metric_type,
+            ))
+            .where(Subscription.id.in_(subscription_ids))
+            .group_by(Subscription.id, bucket)
+            .order_by(Subscription.id, bucket)
+        )
+        if query.start_time:
+            stmt = stmt.where(time_column >= query.start_time)
+        if query.end_time:
+            stmt = stmt.where(time_column < query.end_time)
+
+        result: Result = await self._session.execute(stmt)
+        return [
+            {
+                'subscription_id': row.subscription_id,
+                'time': row.time,
+                'value': row.value,
+            }
+            for row in result
+        ]
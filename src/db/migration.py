@@ -1,84 +1,321 @@
+import argparse
+import asyncio
 import random
+import time
 import uuid
-from venv import logger
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 
-from sqlalchemy.ext.asyncio import AsyncSession
+import asyncpg
+from loguru import logger
 
-import faker
+from src.config import app_config
+from src.db.database import driver_dsn
+from src.models import DeviceType
 
-from src.db.database import get_db
-from src.models import Sites, Devices, DeviceMetrics, DeviceType, Users
-from datetime import datetime, timedelta
+try:
+    import numpy as np
+except ImportError:  # generator is a dev tool, API doesn't need numpy
+    np = None
 
-fake = faker.Faker()
 METRIC_TYPES = ["power_output", "voltage", "current", "charge_level", "temperature"]
+# metrics reported by each kind of device
+DEVICE_METRIC_TYPES = {
+    DeviceType.SOLAR_PANEL: ["power_output", "voltage", "current", "temperature"],
+    DeviceType.WIND_TURBINES: ["power_output", "voltage", "current"],
+    DeviceType.BATTERY: ["charge_level", "voltage", "current", "temperature"],
+    DeviceType.INVERTER: ["power_output", "voltage", "current", "temperature"],
+}
+# nominal power range in W of generating devices
+DEVICE_CAPACITY = {
+    DeviceType.SOLAR_PANEL: (3_000.0, 10_000.0),
+    DeviceType.WIND_TURBINES: (2_000.0, 8_000.0),
+    DeviceType.INVERTER: (3_000.0, 10_000.0),
+    DeviceType.BATTERY: (0.0, 0.0),
+}
+SEEDED_TABLES = ["device_metrics", "alert_rules", "subscriptions", "devices", "sites", "users"]
+METRIC_COLUMNS = ["time", "device_id", "metric_type", "value"]
 
-async def generate_random_users(session: AsyncSession, numb_of_users:int):
-    users = []
-    access_level = ["normal", "technic"]
-    for _ in range(1, numb_of_users +1):
-        user_id = uuid.uuid4()
-        name = fake.name()
-        access_level = random.choice(access_level)
-        users.append(Users(id=user_id, name=name, access_level=access_level))
-        session.add(Users(id=user_id, name=name, access_level=access_level))
-    await session.commit()
-    return users
-
-async def generate_random_sites(session: AsyncSession, users:list):
-    sites = []
-    for user in users:
-        site_id = uuid.uuid4()
-        name = fake.address()
-        sites.append(Sites(id=site_id, name=name, user_id=user.id))
-        session.add(Sites(id=site_id, name=name, user_id=user.id))
-
-    await session.commit()
-    return sites
-
-async def generate_random_devices(session: AsyncSession, sites:list):
+# binary COPY framing, see "Binary Format" of postgres COPY documentation
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + bytes(8)
+COPY_TRAILER = b"\xff\xff"
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass(frozen=True)
+class SeedScale:
+    users: int = 50
+    sites_per_user: int = 2
+    devices_per_site: int = 5
+    days: int = 7
+    step_seconds: int = 60
+    technical_share: float = 0.5
+    subscriptions_per_device: int = 1
+
+    @property
+    def points_per_series(self) -> int:
+        return self.days * 86_400 // self.step_seconds
+
+    @property
+    def metric_rows(self) -> int:
+        devices = self.users * self.sites_per_user * self.devices_per_site
+        average_metrics = sum(map(len, DEVICE_METRIC_TYPES.values())) / len(DEVICE_METRIC_TYPES)
+        return int(devices * average_metrics * self.points_per_series)
+
+
+def generate_users(scale: SeedScale, rng: random.Random) -> list[tuple[uuid.UUID, str, str]]:
+    return [
+        (uuid.UUID(int=rng.getrandbits(128)), f"user-{number:07d}",
+         "technical" if rng.random() < scale.technical_share else "normal")
+        for number in range(scale.users)
+    ]
+
+
+def generate_sites(scale: SeedScale, users: list[tuple], rng: random.Random) -> list[tuple[uuid.UUID, str, uuid.UUID]]:
+    return [
+        (uuid.UUID(int=rng.getrandbits(128)), f"{user_name}-site-{number:03d}", user_id)
+        for user_id, user_name, _ in users
+        for number in range(scale.sites_per_user)
+    ]
+
+
+def generate_devices(scale: SeedScale, sites: list[tuple], rng: random.Random) -> list[tuple[uuid.UUID, str, uuid.UUID, str]]:
+    device_types = list(DeviceType)
     devices = []
-    device_types = list(DeviceType)  #
-    for site in sites:
-        device_id = uuid.uuid4()
-        name = fake.address()
-        device_type = random.choice(list(device_types))
-        devices.append(Devices(id=device_id, name=name, site_id=site.id, type=device_type.value))
-        session.add(Devices(id=device_id, name=name, site_id=site.id, type=device_type.value))
-
-    await session.commit()
+    for site_id, _, _ in sites:
+        for number in range(scale.devices_per_site):
+            device_type = rng.choice(device_types)
+            devices.append((uuid.UUID(int=rng.getrandbits(128)), f"{device_type.value}-{number:03d}", site_id, device_type.value))
     return devices
 
-async def generate_random_metrics(session: AsyncSession, devices:list):
-    metrics = []
-    now = datetime.now()
-    for device in devices:
-        metric_type = random.choice(METRIC_TYPES)
-        value = random.uniform(0.0, 100.0)
-        random_datetime = now - timedelta(minutes=random.randint(0, 10800))
-        metrics.append(DeviceMetrics(time=random_datetime, device_id=device.id, metric_type=metric_type, value=value))
-        session.add(DeviceMetrics(time=random_datetime, device_id=device.id, metric_type=metric_type, value=value))
 
-    await session.commit()
+def generate_subscriptions(scale: SeedScale, devices: list[tuple], start: datetime,
+                           rng: random.Random) -> list[tuple[uuid.UUID, uuid.UUID, str, datetime]]:
+    subscriptions = []
+    for device_id, _, _, device_type in devices:
+        metric_types = DEVICE_METRIC_TYPES[DeviceType(device_type)]
+        for metric_type in rng.sample(metric_types, min(scale.subscriptions_per_device, len(metric_types))):
+            subscriptions.append((uuid.UUID(int=rng.getrandbits(128)), device_id, metric_type, start.replace(tzinfo=None)))
+    return subscriptions
+
+
+def _smooth_noise(rng, devices: int, days: "np.ndarray", periods: tuple[float, ...]) -> "np.ndarray":
+    """Sum of slow sinusoids with random phase per device, continuous across time blocks"""
+    phases = rng.uniform(0, 2 * np.pi, size=(devices, len(periods)))
+    noise = np.zeros((devices, days.size))
+    for index, period in enumerate(periods):
+        noise += np.sin(2 * np.pi * days / period + phases[:, index, None])
+    return noise / len(periods)
+
+
+def device_curves(device_type: DeviceType, capacity: "np.ndarray", seconds: "np.ndarray", rng,
+                  phase_rng) -> dict[str, "np.ndarray"]:
+    """Readings of devices (rows) at given unix seconds (columns) following day/night cycle of the device kind.
+
+    phase_rng has to be seeded by the device batch only, so weather stays continuous between time blocks.
+    """
+    devices = capacity.size
+    hours = (seconds % 86_400) / 3_600
+    days = seconds / 86_400
+    # clear sky irradiance between 6 and 18 UTC, peaking at noon
+    daylight = np.clip(np.sin(np.pi * (hours - 6) / 12), 0, None) ** 1.2
+    ambient = 12 + 8 * np.sin(2 * np.pi * (hours - 9) / 24)
+
+    def noise(scale: float) -> "np.ndarray":
+        return rng.normal(0.0, scale, size=(devices, seconds.size))
+
+    curves = {
+        "voltage": 230 + 2 * np.sin(2 * np.pi * hours / 24) + noise(0.5),
+        "temperature": ambient + noise(0.3),
+    }
+    if device_type in (DeviceType.SOLAR_PANEL, DeviceType.INVERTER):
+        clouds = np.clip(0.75 + 0.25 * _smooth_noise(phase_rng, devices, days, (0.3, 1.7, 4.1)), 0, 1)
+        power = capacity[:, None] * daylight * clouds
+        curves["temperature"] += 25 * daylight * clouds
+    elif device_type == DeviceType.WIND_TURBINES:
+        gusts = _smooth_noise(phase_rng, devices, days, (0.2, 0.9, 3.1))
+        wind = np.clip(0.45 + 0.35 * gusts + 0.1 * np.cos(2 * np.pi * hours / 24), 0, 1)
+        power = capacity[:, None] * wind ** 3
+    else:
+        # battery charges from the daytime surplus and covers the evening load
+        charge = 50 - 40 * np.cos(2 * np.pi * (hours - 4) / 24)
+        curves["charge_level"] = np.clip(charge + noise(1.0), 0, 100)
+        power = np.broadcast_to(3_000 * np.sin(2 * np.pi * (hours - 10) / 24), (devices, seconds.size))
+
+    curves["power_output"] = np.clip(power + noise(10.0), 0, None)
+    curves["current"] = power / curves["voltage"]
+    return curves
+
+
+def encode_metrics(metric_type: str, device_ids: "np.ndarray", times: "np.ndarray", values: "np.ndarray") -> bytes:
+    """Binary COPY rows of values shaped (devices, times), built without per row python code"""
+    metric = metric_type.encode()
+    row = np.dtype([
+        ("fields", ">i2"),
+        ("time_size", ">i4"), ("time", ">i8"),
+        ("device_size", ">i4"), ("device", "V16"),
+        ("metric_size", ">i4"), ("metric", f"S{len(metric)}"),
+        ("value_size", ">i4"), ("value", ">f8"),
+    ])
+    rows = np.empty(values.size, dtype=row)
+    rows["fields"] = len(METRIC_COLUMNS)
+    rows["time_size"] = 8
+    rows["device_size"] = 16
+    rows["metric_size"] = len(metric)
+    rows["value_size"] = 8
+    rows["time"] = np.tile(times, device_ids.size)
+    rows["device"] = np.repeat(device_ids, times.size)
+    rows["metric"] = metric
+    rows["value"] = values.ravel()
+    return rows.tobytes()
+
+
+def metric_chunk(device_type: DeviceType, device_ids: list[uuid.UUID], start: datetime, step_seconds: int,
+                 first_point: int, points: int, batch_seed: tuple[int, ...]) -> bytes:
+    """Binary COPY rows of all metrics of device batch in [first_point, first_point + points) steps"""
+    batch_rng = np.random.default_rng(batch_seed)
+    low, high = DEVICE_CAPACITY[device_type]
+    capacity = batch_rng.uniform(low, high, size=len(device_ids))
+    offsets = (first_point + np.arange(points, dtype=np.int64)) * step_seconds
+    seconds = int(start.timestamp()) + offsets
+    times = (int((start - PG_EPOCH).total_seconds()) + offsets) * 1_000_000
+    ids = np.frombuffer(b"".join(device_id.bytes for device_id in device_ids), dtype="V16")
+
+    curves = device_curves(device_type, capacity, seconds.astype(np.float64),
+                           rng=np.random.default_rng(batch_seed + (first_point,)), phase_rng=batch_rng)
+    return b"".join(
+        encode_metrics(metric_type, ids, times, curves[metric_type])
+        for metric_type in DEVICE_METRIC_TYPES[device_type]
+    )
+
+
+async def _copy_source(chunks) -> AsyncIterator[bytes]:
+    yield COPY_HEADER
+    for build in chunks:
+        # numpy releases the GIL, so chunks of parallel streams are built concurrently
+        yield await asyncio.to_thread(build)
+    yield COPY_TRAILER
+
+
+async def copy_metrics(dsn: str, devices: list[tuple], scale: SeedScale, start: datetime, stream: int, seed: int,
+                       rows_per_chunk: int) -> int:
+    """One COPY stream, every device batch is committed on its own"""
+    by_type: dict[DeviceType, list[uuid.UUID]] = {}
+    for device_id, _, _, device_type in devices:
+        by_type.setdefault(DeviceType(device_type), []).append(device_id)
+
+    points = scale.points_per_series
+    day_points = min(points, 86_400 // scale.step_seconds)
+    inserted = 0
+    connection = await asyncpg.connect(dsn)
+    try:
+        for type_index, device_type in enumerate(DeviceType):
+            device_ids = by_type.get(device_type, [])
+            metrics_per_device = len(DEVICE_METRIC_TYPES[device_type])
+            batch_size = max(1, rows_per_chunk // (day_points * metrics_per_device))
+            block_points = min(points, max(1, rows_per_chunk // (batch_size * metrics_per_device)))
+            for batch_start in range(0, len(device_ids), batch_size):
+                batch = device_ids[batch_start:batch_start + batch_size]
+                batch_seed = (seed, stream, type_index, batch_start)
+                chunks = [
+                    lambda first=first: metric_chunk(device_type, batch, start, scale.step_seconds, first,
+                                                     min(block_points, points - first), batch_seed)
+                    for first in range(0, points, block_points)
+                ]
+                result = await connection.copy_to_table("device_metrics", source=_copy_source(chunks),
+                                                        columns=METRIC_COLUMNS, format="binary")
+                inserted += int(result.split()[-1])
+                logger.debug(f"stream {stream}: {inserted:,} metrics")
+    finally:
+        await connection.close()
+    return inserted
+
+
+async def copy_rows(connection: asyncpg.Connection, table: str, columns: list[str], rows) -> int:
+    result = await connection.copy_records_to_table(table, records=rows, columns=columns)
+    return int(result.split()[-1])
+
+
+async def seed_database(scale: SeedScale, seed: int = 0, truncate: bool = False, streams: int = 4,
+                        rows_per_chunk: int = 1_000_000) -> dict[str, int]:
+    """Bulk load users -> sites -> devices -> subscriptions -> metrics with COPY, returns row counts.
+
+    Metrics are generated with numpy and loaded by parallel binary COPY streams, devices are split
+    between streams. Same seed gives the same dataset, only shifted to the current time.
+    """
+    if np is None:
+        raise RuntimeError("metric generator requires numpy, install dev dependencies")
+
+    rng = random.Random(seed)
+    end = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    start = end - timedelta(seconds=scale.step_seconds * scale.points_per_series)
+
+    users = generate_users(scale, rng)
+    sites = generate_sites(scale, users, rng)
+    devices = generate_devices(scale, sites, rng)
+    subscriptions = generate_subscriptions(scale, devices, start, rng)
+
+    dsn = driver_dsn(app_config.dns)
+    started = time.perf_counter()
+    connection = await asyncpg.connect(dsn)
+    try:
+        async with connection.transaction():
+            if truncate:
+                await connection.execute(f"TRUNCATE {', '.join(SEEDED_TABLES)}")
+            counts = {
+                "users": await copy_rows(connection, "users", ["id", "name", "access_level"], users),
+                "sites": await copy_rows(connection, "sites", ["id", "name", "user_id"], sites),
+                "devices": await copy_rows(connection, "devices", ["id", "name", "site_id", "type"], devices),
+                "subscriptions": await copy_rows(connection, "subscriptions", ["id", "device_id", "metric_type", "created_at"], subscriptions),
+            }
+    finally:
+        await connection.close()
+
+    logger.info(f"Generating about {scale.metric_rows:,} metrics over {streams} COPY streams")
+    inserted = await asyncio.gather(*(
+        copy_metrics(dsn, devices[stream::streams], scale, start, stream, seed, rows_per_chunk)
+        for stream in range(streams)
+    ))
+    counts["device_metrics"] = sum(inserted)
 
+    elapsed = time.perf_counter() - started
+    logger.info(f"Seeded {counts} in {elapsed:.1f}s ({counts['device_metrics'] / elapsed:,.0f} metrics/s)")
+    return counts
 
-async def seed_database():
-    async for session in get_db():
-        try:
-            users = await generate_random_users(session, numb_of_users=50)
 
-            sites = await generate_random_sites(session, users=users)
+def add_seed_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--users", type=int, default=SeedScale.users)
+    parser.add_argument("--sites-per-user", type=int, default=SeedScale.sites_per_user)
+    parser.add_argument("--devices-per-site", type=int, default=SeedScale.devices_per_site)
+    parser.add_argument("--days", type=int, default=SeedScale.days, help="history of generated metrics")
+    parser.add_argument("--step-seconds", type=int, default=SeedScale.step_seconds, help="period of generated metrics, e.g. 1 or 60")
+    parser.add_argument("--technical-share", type=float, default=SeedScale.technical_share)
+    parser.add_argument("--subscriptions-per-device", type=int, default=SeedScale.subscriptions_per_device)
+    parser.add_argument("--seed", type=int, default=0, help="seed of generated data, same seed gives same dataset")
+    parser.add_argument("--streams", type=int, default=4, help="parallel COPY connections loading metrics")
+    parser.add_argument("--rows-per-chunk", type=int, default=1_000_000, help="metrics generated at once by one stream")
+    parser.add_argument("--truncate", action="store_true", help=f"empty {', '.join(SEEDED_TABLES)} first")
 
-            devices = await generate_random_devices(session, sites=sites)
 
-            await generate_random_metrics(session, devices=devices)
+def scale_from_args(args: argparse.Namespace) -> SeedScale:
+    return SeedScale(
+        users=args.users,
+        sites_per_user=args.sites_per_user,
+        devices_per_site=args.devices_per_site,
+        days=args.days,
+        step_seconds=args.step_seconds,
+        technical_share=args.technical_share,
+        subscriptions_per_device=args.subscriptions_per_device,
+    )
 
-        except Exception as e:
-            logger.error(e)
-            await session.rollback()
 
+async def seed_from_args(args: argparse.Namespace) -> dict[str, int]:
+    return await seed_database(scale_from_args(args), seed=args.seed, truncate=args.truncate, streams=args.streams,
+                               rows_per_chunk=args.rows_per_chunk)
 
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(seed_database())
\ No newline at end of file
+    argument_parser = argparse.ArgumentParser(description="Seed database with generated users, sites, devices and metrics")
+    add_seed_arguments(argument_parser)
+    asyncio.run(seed_from_args(argument_parser.parse_args()))
@@ -1,11 +1,27 @@
+import re
 import uuid
 from abc import abstractmethod
+from collections.abc import AsyncIterator
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Protocol, TypeVar, Any
 
 T = TypeVar('T')
 
+AGGREGATIONS = ("avg", "sum", "min", "max", "count", "first", "last")
+
+_INTERVAL_RE = re.compile(r"^(\d+)([smhdw])$")
+_INTERVAL_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+
+def parse_interval(interval: str) -> timedelta:
+    """Convert shorthand like '15m', '1h' or '1d' into a timedelta"""
+    match = _INTERVAL_RE.match(interval)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"invalid interval: {interval}")
+    return timedelta(**{_INTERVAL_UNITS[match.group(2)]: int(match.group(1))})
+
+
 @dataclass
 class TimeSeriesQuery:
     """Query parameters for time-series data"""
@@ -22,7 +38,11 @@ class SitesRepository(Protocol[T]):
         ...
 
     @abstractmethod
-    async def get_all_user_sites(self, user_id: uuid.UUID, offset: int, limit: int) -> T:
+    async def get_all_user_sites(self, user_id: uuid.UUID, after: tuple[str, uuid.UUID] | None, limit: int) -> T:
+        ...
+
+    @abstractmethod
+    async def get_user_ownership(self, user_id: uuid.UUID) -> list[tuple[uuid.UUID, uuid.UUID | None]]:
         ...
 
 
@@ -46,6 +66,14 @@ class DevicesRepository(Protocol[T]):
     async def delete_device(self, device_id: uuid.UUID) -> bool:
         ...
 
+    @abstractmethod
+    async def get_site_devices(self, site_id: uuid.UUID, after: tuple[str, uuid.UUID] | None, limit: int) -> T:
+        ...
+
+    @abstractmethod
+    async def get_user_devices(self, user_id: uuid.UUID, after: tuple[uuid.UUID, str, uuid.UUID] | None, limit: int) -> T:
+        ...
+
     @abstractmethod
     async def check_exist_user_devices(self, user_id: uuid.UUID, device_ids: [uuid.UUID]) -> T:
         ...
@@ -58,18 +86,49 @@ class MetricsRepository(Protocol[T]):
     async def get_device_metric_last_values(self, device_id, metric_type: str | list[str], num_of_last_values: int) -> T:
         ...
 
+    @abstractmethod
+    async def get_latest_metrics(self, pairs: list[tuple[uuid.UUID, str]]) -> T:
+        ...
+
+    @abstractmethod
+    async def get_site_latest_metrics(self, site_id: uuid.UUID, metric_types: list[str]) -> T:
+        ...
+
+    @abstractmethod
+    async def get_site_metric_buckets(self, site_id: uuid.UUID, metric_types: list[str], bucket_width: timedelta,
+                                      start_time: datetime) -> list[dict]:
+        ...
+
+    @abstractmethod
+    def stream_site_metrics(self, site_id: uuid.UUID, start_time: datetime, end_time: datetime,
+                            batch_size: int) -> AsyncIterator[list[tuple]]:
+        ...
+
+    @abstractmethod
+    async def insert_metrics(self, records: list[tuple[datetime, uuid.UUID, str, float]]
+                             ) -> list[tuple[datetime, uuid.UUID, str, float]]:
+        ...
+
+    @abstractmethod
+    async def get_chunk_stats(self) -> list[dict]:
+        ...
+
     @abstractmethod
     async def create_device_subscriptions(self, device_id: uuid.UUID, metric_type: list[str] | str) -> T:
         ...
 
     @abstractmethod
-    async def create_devices_subscriptions(self, device_ids: list[uuid.UUID], metric_types: list[str], existing_pairs:set[tuple[Any, Any]]) -> bool:
+    async def create_devices_subscriptions(self, pairs: list[tuple[uuid.UUID, str]]) -> list[T] | None:
         ...
 
     @abstractmethod
     async def get_user_subscription(self, subscription_id: uuid.UUID) -> T:
         ...
 
+    @abstractmethod
+    async def get_subscription(self, subscription_id: uuid.UUID) -> T:
+        ...
+
     @abstractmethod
     async def check_existing_subscription(self, device_ids: list[uuid.UUID], metric_types: [str]) -> bool:
         ...
@@ -86,6 +145,22 @@ class MetricsRepository(Protocol[T]):
     async def get_subscriptions_timeseries_data(self, subscription_ids: list[uuid.UUID], query: TimeSeriesQuery) -> [T]:
         ...
 
+    @abstractmethod
+    async def get_subscription_keys(self) -> list[tuple[uuid.UUID, uuid.UUID, str]]:
+        ...
 
+    @abstractmethod
+    async def delete_subscription(self, subscription_id: uuid.UUID) -> bool:
+        ...
 
+    @abstractmethod
+    async def create_alert_rule(self, subscription_id: uuid.UUID, rule: dict[str, Any]) -> T:
+        ...
 
+    @abstractmethod
+    async def get_alert_rules(self, subscription_id: uuid.UUID | None = None) -> list[dict]:
+        ...
+
+    @abstractmethod
+    async def delete_alert_rule(self, subscription_id: uuid.UUID, rule_id: uuid.UUID) -> bool:
+        ...
@@ -1,9 +1,9 @@
 import uuid
-from select import select
 
+from sqlalchemy import select, func, tuple_, literal_column
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.models import Sites
+from src.models import Sites, Devices
 
 
 class SQLAlchemySites:
@@ -14,11 +14,24 @@ class SQLAlchemySites:
 
     async def get_user_site(self, site_id: uuid.UUID) -> [Sites | None]:
         result = await self._session.execute(select(Sites).where(Sites.id == site_id))
-        site = result.first()
+        site = result.scalar_one_or_none()
         return site
 
 
-    async def get_all_user_sites(self, user_id: uuid.UUID, offset: int, limit: int) -> list[Sites] | None:
-        result = await self._session.execute(select(Sites).where(Sites.user_id == user_id)).offset(offset).limit(limit)
+    async def get_all_user_sites(self, user_id: uuid.UUID, after: tuple[str, uuid.UUID] | None, limit: int) -> list[Sites] | None:
+        # literal '' keeps the expression equal to the one of sites_user_name_id_idx
+        name = func.coalesce(Sites.name, literal_column("''"))
+        stmt = select(Sites).where(Sites.user_id == user_id).order_by(name, Sites.id).limit(limit)
+        if after:
+            stmt = stmt.where(tuple_(name, Sites.id) > tuple_(*after))
+        result = await self._session.execute(stmt)
         sites = result.scalars().all()
         return sites
+
+
+    async def get_user_ownership(self, user_id: uuid.UUID) -> list[tuple[uuid.UUID, uuid.UUID | None]]:
+        """(site_id, device_id) pairs of all user sites, device_id is None for sites without devices"""
+        result = await self._session.execute(
+            select(Sites.id, Devices.id).outerjoin(Devices, Devices.site_id == Sites.id).where(Sites.user_id == user_id)
+        )
+        return [tuple(row) for row in result]
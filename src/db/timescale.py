@@ -0,0 +1,167 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+@dataclass(frozen=True)
+class Rollup:
+    """Continuous aggregate of device_metrics with fixed bucket width"""
+    view: str
+    bucket: timedelta
+    source: str
+    refresh_start: timedelta
+    refresh_end: timedelta
+    refresh_every: timedelta
+
+
+# ordered from finest to coarsest, each one is built on top of the previous one
+ROLLUPS = (
+    Rollup("device_metrics_1m", timedelta(minutes=1), "device_metrics",
+           refresh_start=timedelta(hours=2), refresh_end=timedelta(minutes=1), refresh_every=timedelta(minutes=1)),
+    Rollup("device_metrics_1h", timedelta(hours=1), "device_metrics_1m",
+           refresh_start=timedelta(days=3), refresh_end=timedelta(hours=1), refresh_every=timedelta(minutes=30)),
+    Rollup("device_metrics_1d", timedelta(days=1), "device_metrics_1h",
+           refresh_start=timedelta(days=30), refresh_end=timedelta(days=1), refresh_every=timedelta(hours=1)),
+)
+
+
+def _interval(value: timedelta) -> str:
+    return f"INTERVAL '{int(value.total_seconds())} seconds'"
+
+
+# time_bucket origin, buckets up to a day wide start at its whole multiples
+BUCKET_ORIGIN = datetime(2000, 1, 3, tzinfo=timezone.utc)
+
+
+def _aligned(value: datetime, width: timedelta) -> bool:
+    # naive datetimes are sent to postgres as UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - BUCKET_ORIGIN) % width == timedelta(0)
+
+
+def select_rollup(bucket_width: timedelta, *boundaries: datetime | None) -> Rollup | None:
+    """Coarsest rollup whose buckets compose requested width and range, None means raw data has to be used.
+
+    Rollup buckets can't be split, so range boundaries have to fall on their edges. Otherwise the partial
+    first bucket would be lost and the last one would take in readings past the end.
+    """
+    for rollup in reversed(ROLLUPS):
+        if bucket_width < rollup.bucket or bucket_width % rollup.bucket:
+            continue
+        if all(boundary is None or _aligned(boundary, rollup.bucket) for boundary in boundaries):
+            return rollup
+    return None
+
+
+def _rollup_ddl(rollup: Rollup) -> list[str]:
+    if rollup.source == "device_metrics":
+        aggregates = (
+            "avg(value) AS avg, sum(value) AS sum, min(value) AS min, max(value) AS max, "
+            "count(value) AS count, first(value, time) AS first, last(value, time) AS last"
+        )
+        time_column = "time"
+    else:
+        # hierarchical aggregate, averages are recomputed from sums and counts
+        aggregates = (
+            "sum(sum) / nullif(sum(count), 0) AS avg, sum(sum) AS sum, min(min) AS min, max(max) AS max, "
+            "sum(count) AS count, first(first, bucket) AS first, last(last, bucket) AS last"
+        )
+        time_column = "bucket"
+    bucket = f"time_bucket({_interval(rollup.bucket)}, {time_column})"
+
+    return [
+        f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {rollup.view}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT {bucket} AS bucket, device_id, metric_type, {aggregates}
+        FROM {rollup.source}
+        GROUP BY {bucket}, device_id, metric_type
+        WITH NO DATA
+        """,
+        f"""
+        SELECT add_continuous_aggregate_policy('{rollup.view}',
+            start_offset => {_interval(rollup.refresh_start)},
+            end_offset => {_interval(rollup.refresh_end)},
+            schedule_interval => {_interval(rollup.refresh_every)},
+            if_not_exists => true)
+        """,
+    ]
+
+
+def timescale_schema_ddl() -> list[str]:
+    statements = [
+        "CREATE INDEX IF NOT EXISTS device_metrics_device_metric_time_idx "
+        "ON device_metrics (device_id, metric_type, time DESC)",
+        # keyset pagination of sites and devices listings
+        "CREATE INDEX IF NOT EXISTS sites_user_name_id_idx ON sites (user_id, (coalesce(name, '')), id)",
+        "CREATE INDEX IF NOT EXISTS sites_user_id_idx ON sites (user_id, id)",
+        "CREATE INDEX IF NOT EXISTS devices_site_name_id_idx ON devices (site_id, name, id)",
+        # arbiter of ON CONFLICT in batch subscription creation, fails while duplicate pairs exist
+        "CREATE UNIQUE INDEX IF NOT EXISTS subscriptions_device_metric_key ON subscriptions (device_id, metric_type)",
+        # row versions behind ETags, now() is evaluated once so existing rows are not rewritten
+        "ALTER TABLE sites ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+        "ALTER TABLE devices ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+    ]
+    for rollup in ROLLUPS:
+        statements.extend(_rollup_ddl(rollup))
+    return statements
+
+
+def storage_policies_ddl(compression_enabled: bool, compress_after_days: int, raw_retention_days: int) -> list[str]:
+    """Policies are recreated on every start, so changed configuration is applied as well"""
+    statements = []
+    if compress_after_days and not compression_enabled:
+        # segmenting by series keeps per device range scans on compressed chunks cheap
+        statements.append(
+            "ALTER TABLE device_metrics SET (timescaledb.compress, "
+            "timescaledb.compress_segmentby = 'device_id, metric_type', "
+            "timescaledb.compress_orderby = 'time DESC')"
+        )
+
+    statements.append("SELECT remove_compression_policy('device_metrics', if_exists => true)")
+    if compress_after_days:
+        statements.append(f"SELECT add_compression_policy('device_metrics', INTERVAL '{compress_after_days} days')")
+
+    statements.append("SELECT remove_retention_policy('device_metrics', if_exists => true)")
+    if raw_retention_days:
+        statements.append(f"SELECT add_retention_policy('device_metrics', INTERVAL '{raw_retention_days} days')")
+    return statements
+
+
+# arbitrary application wide key of the session level advisory lock
+SCHEMA_LOCK_KEY = 7_316_001
+
+
+async def ensure_timescale_schema(engine: AsyncEngine, compress_after_days: int, raw_retention_days: int):
+    """Idempotently create indexes, continuous aggregates and storage policies"""
+    longest_refresh = max(rollup.refresh_start for rollup in ROLLUPS)
+    if raw_retention_days and timedelta(days=raw_retention_days) <= longest_refresh:
+        raise ValueError(f"raw retention of {raw_retention_days} days would drop data rollups still refresh ({longest_refresh})")
+
+    async with engine.connect() as connection:
+        # continuous aggregates can't be created inside transaction block
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        # workers start together, only one of them applies the schema at a time
+        await connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        try:
+            for statement in timescale_schema_ddl():
+                await connection.execute(text(statement))
+
+            result = await connection.execute(text(
+                "SELECT compression_enabled FROM timescaledb_information.hypertables "
+                "WHERE hypertable_name = 'device_metrics'"
+            ))
+            compression_enabled = bool(result.scalar())
+            for statement in storage_policies_ddl(compression_enabled, compress_after_days, raw_retention_days):
+                await connection.execute(text(statement))
+        finally:
+            await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+
+    logger.info(
+        f"TimescaleDB schema is up to date, rollups: {[rollup.view for rollup in ROLLUPS]}, "
+        f"compress after: {compress_after_days} days, raw retention: {raw_retention_days} days"
+    )
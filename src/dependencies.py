@@ -1,8 +1,21 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
 from dataclasses import dataclass
 
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, WebSocket, WebSocketException
 import jwt
 from fastapi.security import OAuth2PasswordBearer
+from loguru import logger
+
+from src.config import app_config
+
+# tokens with unknown kid may force a JWKS reload at most this often
+JWKS_FORCED_RELOAD_SECONDS = 1.0
+
 
 @dataclass
 class UserClaims:
@@ -11,19 +24,182 @@ class UserClaims:
     payload: dict
 
 
+class JWTVerifier:
+    """Verifies tokens and caches resulting claims by token hash.
 
-SECRET_KEY = "secret"
-ALGORITHM = "HS256"
+    Repeated requests with the same token skip signature verification until the token expires
+    or the cache ttl passes. Keys of asymmetric algorithms are picked by 'kid' from local JWKS file,
+    which is reloaded when it changes on disk.
+    """
+
+    def __init__(self, algorithms: list[str], secret: str | None, public_key_file: str | None,
+                 jwks_file: str | None, jwks_reload_seconds: int, cache_size: int, cache_ttl_seconds: int):
+        self._algorithms = [algorithm.strip() for algorithm in algorithms]
+        self._secret = secret
+        self._public_key = self._load_public_key(public_key_file) if public_key_file else None
+        self._jwks_file = jwks_file
+        self._jwks_reload_seconds = jwks_reload_seconds
+        self._jwks: dict[str | None, jwt.PyJWK] = {}
+        self._jwks_mtime: float | None = None
+        self._jwks_checked_at = 0.0
+        self._jwks_forced_at = 0.0
+        self._cache_size = cache_size
+        self._cache_ttl_seconds = cache_ttl_seconds
+        self._cache: OrderedDict[bytes, tuple[UserClaims, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.verify_seconds = 0.0
+
+    def verify(self, token: str) -> UserClaims:
+        token_hash = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        cached = self._cache.get(token_hash)
+        if cached is not None:
+            claims, expires_at = cached
+            if expires_at > now:
+                self._cache.move_to_end(token_hash)
+                self.hits += 1
+                return claims
+            del self._cache[token_hash]
+
+        self.misses += 1
+        started = time.perf_counter()
+        try:
+            algorithm, key = self._resolve_key(token)
+            payload = jwt.decode(jwt=token, key=key, algorithms=[algorithm])
+        except jwt.PyJWTError:
+            self.failures += 1
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid or expired token")
+        finally:
+            self.verify_seconds += time.perf_counter() - started
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-def decode_jwt_token(token:str = Depends(oauth2_scheme)) -> UserClaims:
-    try:
-        payload = jwt.decode(jwt=token, key=SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("user_id")
         access_level = payload.get("access_level")
-        msg = payload.get("payload")
-        if not user_id or not access_level:
+        if not user_id or not access_level or not _is_uuid(user_id):
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid or expired token")
-        return UserClaims(user_id, access_level, msg)
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid or expired token")
\ No newline at end of file
+
+        claims = UserClaims(user_id, access_level, payload.get("payload"))
+        expires_at = now + self._cache_ttl_seconds
+        if "exp" in payload:
+            expires_at = min(expires_at, float(payload["exp"]))
+        self._cache[token_hash] = (claims, expires_at)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return claims
+
+    def _resolve_key(self, token: str):
+        header = jwt.get_unverified_header(token)
+        algorithm = header.get("alg")
+        if algorithm not in self._algorithms:
+            raise jwt.InvalidAlgorithmError(f"algorithm {algorithm} is not allowed")
+
+        # never verify HMAC tokens with public keys and vice versa
+        if algorithm.startswith("HS"):
+            if not self._secret:
+                raise jwt.InvalidKeyError("no secret configured")
+            return algorithm, self._secret
+
+        if self._jwks_file:
+            kid = header.get("kid")
+            jwk = self._find_jwk(kid)
+            if jwk is None:
+                raise jwt.InvalidKeyError(f"unknown key id {kid}")
+            return algorithm, jwk.key
+
+        if self._public_key is None:
+            raise jwt.InvalidKeyError("no public key configured")
+        return algorithm, self._public_key
+
+    def _find_jwk(self, kid: str | None) -> jwt.PyJWK | None:
+        self._reload_jwks()
+        if kid is None and len(self._jwks) == 1:
+            return next(iter(self._jwks.values()))
+        jwk = self._jwks.get(kid)
+        if jwk is None:
+            # key might be rotated just now
+            self._reload_jwks(force=True)
+            jwk = self._jwks.get(kid)
+        return jwk
+
+    def _reload_jwks(self, force: bool = False):
+        now = time.monotonic()
+        if force:
+            # don't let a stream of bogus kids hit the disk on every request
+            if now - self._jwks_forced_at < JWKS_FORCED_RELOAD_SECONDS:
+                return
+            self._jwks_forced_at = now
+        elif now - self._jwks_checked_at < self._jwks_reload_seconds:
+            return
+        self._jwks_checked_at = now
+
+        try:
+            mtime = os.stat(self._jwks_file).st_mtime
+            if mtime == self._jwks_mtime:
+                return
+            with open(self._jwks_file) as f:
+                key_set = jwt.PyJWKSet.from_dict(json.load(f))
+        except (OSError, ValueError, jwt.PyJWTError) as e:
+            # file may be missing or half-written while keys are rotated, retried on the next check
+            logger.error(f"Failed to load JWKS from {self._jwks_file}, keeping previous key ids {list(self._jwks)}: {e}")
+            return
+        self._jwks = {key.key_id: key for key in key_set.keys}
+        self._jwks_mtime = mtime
+        logger.info(f"Loaded JWKS with key ids: {list(self._jwks)}")
+
+    @staticmethod
+    def _load_public_key(path: str) -> str:
+        with open(path) as f:
+            return f.read()
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        verifications = self.misses
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+            "verify_seconds_total": self.verify_seconds,
+            "verify_seconds_avg": self.verify_seconds / verifications if verifications else 0.0,
+        }
+
+
+def _is_uuid(value) -> bool:
+    """Routes turn the subject into uuid.UUID, so anything else must be refused before it becomes a 500"""
+    try:
+        uuid.UUID(value)
+    except (TypeError, ValueError, AttributeError):
+        return False
+    return True
+
+
+jwt_verifier = JWTVerifier(
+    algorithms=app_config.jwt_algorithms,
+    secret=app_config.jwt_secret,
+    public_key_file=app_config.jwt_public_key_file,
+    jwks_file=app_config.jwt_jwks_file,
+    jwks_reload_seconds=app_config.jwks_reload_seconds,
+    cache_size=app_config.jwt_cache_size,
+    cache_ttl_seconds=app_config.jwt_cache_ttl_seconds,
+)
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+def decode_jwt_token(token:str = Depends(oauth2_scheme)) -> UserClaims:
+    return jwt_verifier.verify(token)
+
+
+def decode_ws_token(websocket: WebSocket, token: str | None = None) -> UserClaims:
+    """Browsers can't set headers on WebSocket handshake, so token may come as query param"""
+    if token is None:
+        scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer":
+            token = None
+    if not token:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="missing token")
+    try:
+        return decode_jwt_token(token)
+    except HTTPException:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="invalid or expired token")
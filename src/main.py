@@ -1,34 +1,79 @@
 from contextlib import asynccontextmanager
 
-import asyncpg
 from fastapi import FastAPI
 import uvicorn
 from loguru import logger
 
 from .config import app_config
+from .db.database import engine, warm_up_pool
+from .db.timescale import ensure_timescale_schema
+from .services.alerts import load_alert_rules
+from .services.cluster import cluster_bridge
+from .services.ingest import ingest_buffer
+from .services.subscriptions import load_subscription_index
+from .services.instrumentation import QueryTimingMiddleware, install_instrumentation
+from .services.process_metrics import LoopLagMonitor, RequestMetricsMiddleware, install_gc_metrics
 from .routers.devices import devices_router
 from .routers.sites import sites_router
 from .routers.metrics import metrics_router
-app = FastAPI()
+from .routers.admin import admin_router
+from .routers.telemetry import telemetry_router
+
+
+loop_lag_monitor = LoopLagMonitor(interval_seconds=app_config.loop_lag_interval_ms / 1000)
 
-app.include_router(sites_router)
-app.include_router(devices_router)
-app.include_router(metrics_router)
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
+    if app_config.manage_timescale_schema:
+        try:
+            await ensure_timescale_schema(engine,
+                                          compress_after_days=app_config.compress_after_days,
+                                          raw_retention_days=app_config.raw_retention_days)
+        except Exception as e:
+            logger.error(f"Failed to apply TimescaleDB schema: {e}")
     try:
-        _app.postgres_pool = await asyncpg.create_pool(
-            dsn=app_config.dns,
-            min_size=5,
-            max_size=20,
-        )
-        yield
+        await warm_up_pool(app_config.db_pool_min_size)
     except Exception as e:
-        logger.error(e)
-    finally:
-        await _app.postgres_pool.close()
+        logger.error(f"Failed to open database connections: {e}")
+    try:
+        await load_subscription_index()
+        await load_alert_rules()
+    except Exception as e:
+        logger.error(f"Failed to load subscriptions and alert rules: {e}")
+
+    if app_config.process_metrics:
+        loop_lag_monitor.start()
+    if app_config.cluster_notify:
+        cluster_bridge.start()
+    if app_config.ingest_buffer_enabled:
+        ingest_buffer.start()
+
+    yield
+
+    await ingest_buffer.stop(timeout=app_config.ingest_drain_seconds)
+    await cluster_bridge.stop()
+    await loop_lag_monitor.stop()
+    await engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.include_router(sites_router)
+app.include_router(devices_router)
+app.include_router(metrics_router)
+app.include_router(admin_router)
+app.include_router(telemetry_router)
+
+if app_config.db_instrumentation:
+    install_instrumentation(engine)
+    app.add_middleware(QueryTimingMiddleware, warn_queries=app_config.request_query_warning)
+if app_config.process_metrics:
+    install_gc_metrics()
+    # added last, so it is the outermost middleware and its latency covers the others
+    app.add_middleware(RequestMetricsMiddleware)
 
 
 if __name__ == "__main__":
-    uvicorn.run(app)
\ No newline at end of file
+    # workers import the app on their own, so it is passed as import string
+    uvicorn.run("src.main:app", host=app_config.web_host, port=app_config.web_port, workers=app_config.web_workers)
@@ -1,5 +1,5 @@
 from enum import Enum
-from sqlalchemy import Column, String, UUID, Float, DateTime, ForeignKey
+from sqlalchemy import Column, String, UUID, Float, DateTime, ForeignKey, Index, Integer, UniqueConstraint, func, literal_column
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 import uuid
@@ -14,6 +14,9 @@ class METRIC_TYPE_TO_UNIT(Enum):
     CHARGE_LEVEL = "%"
     TEMPERATURE = "C"
 
+# metric_type of subscriptions to every metric of the device
+WILDCARD = "*"
+
 class DeviceType(Enum):
     SOLAR_PANEL = "pv_panel"
     WIND_TURBINES = "wind_turbines"
@@ -31,13 +34,29 @@ class Sites(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String(100))
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)  # References Users.user_id
+    # version of the row, source of ETags of site responses
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # keyset pagination of user sites by (name, id), unnamed sites sort first
+        Index("sites_user_name_id_idx", "user_id", func.coalesce(name, literal_column("''")), "id"),
+        # user sites in id order, drives keyset pagination of all user devices
+        Index("sites_user_id_idx", "user_id", "id"),
+    )
 
 class Devices(Base):
     __tablename__ = "devices"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4())
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String(100), nullable=False)
     site_id = Column(UUID, ForeignKey("sites.id"), nullable=False)
     type = Column(String(100), nullable=False)
+    # version of the row, source of ETags of device responses
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # keyset pagination of site devices by (name, id)
+        Index("devices_site_name_id_idx", "site_id", "name", "id"),
+    )
 
 # hyper table
 class DeviceMetrics(Base):
@@ -47,13 +66,31 @@ class DeviceMetrics(Base):
     metric_type = Column(String(100), primary_key=True)
     value = Column(Float)
 
+    __table_args__ = (
+        # latest value lookups per device and metric
+        Index("device_metrics_device_metric_time_idx", "device_id", "metric_type", time.desc()),
+    )
+
 # getting automatically all new coming data
 class Subscription(Base):
     __tablename__ = "subscriptions"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4())
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     device_id = Column(UUID, ForeignKey("devices.id"), nullable=False)
     metric_type = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # one subscription per pair, target of ON CONFLICT in batch creation
+        UniqueConstraint("device_id", "metric_type", name="subscriptions_device_metric_key"),
+    )
 
-
+# threshold or rate condition evaluated on every ingested reading of the subscription
+class AlertRule(Base):
+    __tablename__ = "alert_rules"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    subscription_id = Column(UUID(as_uuid=True), ForeignKey("subscriptions.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String(20), nullable=False)  # 'threshold' on the value or 'rate' of change per minute
+    operator = Column(String(2), nullable=False)
+    threshold = Column(Float, nullable=False)
+    duration_seconds = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
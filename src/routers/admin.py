@@ -0,0 +1,98 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse, Response
+
+from src.config import app_config
+from src.db.database import RepositoryContainer, get_db, pool_stats
+from src.dependencies import UserClaims, decode_jwt_token, jwt_verifier
+from src.routers.router_model import ChunkStatsResponse, StorageStatsResponse
+from src.services.alerts import alert_engine
+from src.services.cluster import cluster_bridge
+from src.services.ingest import ingest_buffer
+from src.services.latest_cache import latest_cache
+from src.services.ownership import ownership_index
+from src.services.profiler import ProfilerBusy, flamegraph_svg, folded, sampling_profiler
+from src.services.response_cache import response_cache
+from src.services.site_rollups import site_rollups
+from src.services.subscriptions import subscription_index
+
+admin_router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+def require_technical(user: UserClaims = Depends(decode_jwt_token)) -> UserClaims:
+    if user.access_level != "technical":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Don't have technical status")
+    return user
+
+
+@admin_router.get("/caches",
+                  description="Hit/miss counters of in-process caches")
+async def get_cache_stats(user: UserClaims = Depends(require_technical)):
+    return {
+        "latest_metrics": latest_cache.stats(),
+        "jwt": jwt_verifier.stats(),
+        "ownership": ownership_index.stats(),
+        "responses": response_cache.stats(),
+        "site_rollups": site_rollups.stats(),
+        "subscriptions": subscription_index.stats(),
+        "cluster": cluster_bridge.stats(),
+    }
+
+
+@admin_router.get("/alerts",
+                  description="Loaded alert rules and how many readings they evaluated, fired and resolved")
+async def get_alert_stats(user: UserClaims = Depends(require_technical)):
+    return alert_engine.stats()
+
+
+@admin_router.get("/pool",
+                  description="Utilization of the database connection pool")
+async def get_pool_stats(user: UserClaims = Depends(require_technical)):
+    return pool_stats()
+
+
+@admin_router.get("/ingest",
+                  description="Queue depth and flush statistics of the write-behind ingest buffer")
+async def get_ingest_stats(user: UserClaims = Depends(require_technical)):
+    return ingest_buffer.stats()
+
+
+def _ratio(before: int | None, after: int | None) -> float | None:
+    return before / after if before and after else None
+
+
+@admin_router.get("/storage/chunks",
+                  response_model=StorageStatsResponse,
+                  description="Per chunk size of device_metrics hypertable and achieved compression ratio")
+async def get_storage_stats(user: UserClaims = Depends(require_technical), db: RepositoryContainer = Depends(get_db)):
+    chunks = [
+        ChunkStatsResponse(**chunk, compression_ratio=_ratio(chunk['before_compression_bytes'], chunk['after_compression_bytes']))
+        for chunk in await db.metrics.get_chunk_stats()
+    ]
+    compressed = [chunk for chunk in chunks if chunk.compression_ratio]
+    return StorageStatsResponse(
+        chunks=chunks,
+        total_bytes=sum(chunk.total_bytes for chunk in chunks),
+        compression_ratio=_ratio(sum(chunk.before_compression_bytes for chunk in compressed),
+                                 sum(chunk.after_compression_bytes for chunk in compressed)),
+    )
+
+
+@admin_router.get("/profile",
+                  description="Sample the event loop of the worker serving this request for given seconds of live traffic. "
+                              "Returns SVG flamegraph or folded stacks for flamegraph.pl/speedscope")
+async def get_profile(
+        user: UserClaims = Depends(require_technical),
+        seconds: float = Query(10, gt=0, description="Length of the profile"),
+        format: str = Query("svg", pattern="^(svg|folded)$"),
+):
+    if seconds > app_config.profile_max_seconds:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"profile can be at most {app_config.profile_max_seconds} seconds long")
+    try:
+        stacks = await sampling_profiler.profile(seconds, interval_seconds=app_config.profile_interval_ms / 1000)
+    except ProfilerBusy:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="another profile is running")
+
+    if format == "folded":
+        return PlainTextResponse(folded(stacks))
+    return Response(flamegraph_svg(stacks, title=f"{seconds:g}s of event loop"), media_type="image/svg+xml")
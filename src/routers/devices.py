@@ -1,13 +1,19 @@
 import uuid
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi import status
 from src.dependencies import decode_jwt_token, UserClaims
 from src.db.database import get_db, RepositoryContainer
 
-from src.routers.router_model import DeviceRequest, DeviceResponse
+from src.routers.pagination import cursor_uuid, decode_cursor, next_page
+from src.routers.router_model import DeviceRequest, DeviceResponse, DeviceFullResponse
+from src.services.cluster import cluster_bridge
+from src.services.ownership import UserOwnership, get_ownership
+from src.services.response_cache import entity_etag, json_renderer, response_cache
 
 devices_router = APIRouter()
 
+render_devices = json_renderer(list[DeviceFullResponse])
+
 
 # @router.post("/users/")
 # async def insert_user(
@@ -32,31 +38,72 @@ devices_router = APIRouter()
 
 
 # DEVICES ***************
+@devices_router.get("/devices",
+                    response_model=list[DeviceFullResponse],
+                    description="Return devices of all user sites ordered by site and name. Next page cursor is in X-Next-Cursor and Link headers, "
+                                "304 is returned when If-None-Match holds the current ETag")
+async def get_devices(
+        request: Request,
+        user: UserClaims = Depends(decode_jwt_token),
+        db: RepositoryContainer = Depends(get_db),
+        cursor: str | None = Query(None, description="Cursor of the page returned by previous request"),
+        limit: int = Query(100, ge=1, le=1000, description="Maximum number of devices to return")
+):
+    after = None
+    if cursor:
+        site_id, name, device_id = decode_cursor(cursor, 3)
+        after = (cursor_uuid(site_id), name, cursor_uuid(device_id))
+    user_id = uuid.UUID(user.id)
+
+    async def load():
+        devices = list(await db.devices.get_user_devices(user_id=user_id, after=after, limit=limit + 1))
+        etag = entity_etag(devices, limit)
+        page, headers = next_page(request, devices, limit, lambda device: (device.site_id, device.name, device.id))
+        return page, etag, headers
+
+    return await response_cache.respond(request, user_id, load, render_devices)
+
+
 @devices_router.post("/devices",
                      response_model=DeviceResponse)
-async def create_device(payload: DeviceRequest, user: UserClaims = Depends(decode_jwt_token), db: RepositoryContainer = Depends(get_db)):
+async def create_device(payload: DeviceRequest, user: UserClaims = Depends(decode_jwt_token), db: RepositoryContainer = Depends(get_db),
+                        ownership: UserOwnership = Depends(get_ownership)):
     if user.access_level != "technical":
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Don't have technical status")
+    if payload.site_id not in ownership.sites:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="site not found")
 
     dict_payload = payload.model_dump(exclude_unset=True)
     result = await db.devices.create_device(site_id=payload.site_id, device=dict_payload)
     if not result:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="site not found")
+    cluster_bridge.invalidate_ownership(ownership.user_id)
+    cluster_bridge.invalidate_site(payload.site_id)
 
     return DeviceResponse(status=status.HTTP_200_OK, msg="Device was created")
 
 
 @devices_router.put("/devices/{device_id}",
                     response_model=DeviceResponse)
-async def update_device(device_id: uuid.UUID, payload: DeviceRequest, user: UserClaims = Depends(decode_jwt_token), db: RepositoryContainer = Depends(get_db)):
+async def update_device(device_id: uuid.UUID, payload: DeviceRequest, user: UserClaims = Depends(decode_jwt_token), db: RepositoryContainer = Depends(get_db),
+                        ownership: UserOwnership = Depends(get_ownership)):
     if user.access_level != "technical":
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Don't have technical status")
+    ownership.require_device(device_id)
+    # device can be moved only between sites of the same user
+    if payload.site_id is not None:
+        ownership.require_site(payload.site_id)
 
     dict_payload = payload.model_dump(exclude_unset=True, exclude={'id'})
     device = await db.devices.update_device(device_id=device_id, updated_device=dict_payload)
 
     if not device:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="device was not found")
+    cluster_bridge.invalidate_ownership(ownership.user_id)
+    # type or site of the device may have changed, rollups of both sites are rebuilt
+    cluster_bridge.invalidate_site(ownership.devices[device_id])
+    if payload.site_id is not None:
+        cluster_bridge.invalidate_site(payload.site_id)
     return DeviceResponse(status=status.HTTP_200_OK, msg="Device was updated")
 
 
@@ -65,13 +112,18 @@ async def update_device(device_id: uuid.UUID, payload: DeviceRequest, user: User
 async def delete_device(
         device_id: uuid.UUID,
         user: UserClaims = Depends(decode_jwt_token),
-        db: RepositoryContainer = Depends(get_db)
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
 ):
     if user.access_level != "technical":
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Don't have technical status")
+    ownership.require_device(device_id)
 
     device = await db.devices.delete_device(device_id=device_id)
     if not device:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="device was not found")
+    cluster_bridge.invalidate_device(device_id)
+    cluster_bridge.invalidate_ownership(ownership.user_id)
+    cluster_bridge.invalidate_site(ownership.devices[device_id])
 
     return DeviceResponse(status=status.HTTP_200_OK, msg="Device was deleted")
@@ -0,0 +1,17 @@
+import orjson
+from fastapi.responses import JSONResponse
+
+# UTC datetimes end with Z, so output is byte for byte the one of response models
+ORJSON_OPTIONS = orjson.OPT_UTC_Z
+
+
+class RowsJSONResponse(JSONResponse):
+    """Plain dicts and lists built straight from repository rows, encoded by orjson.
+
+    Large payloads skip building and validating a response model per item. orjson encodes datetimes
+    and UUIDs natively, values have to be of JSON types already (floats, not Decimals).
+    Routes keep response_model for the OpenAPI schema.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
@@ -3,18 +3,40 @@
 # value together with metadata (timestamp,
 # unit).
 # R3: Latest Metric
+import asyncio
+import json
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Literal
 
-import faker
-from fastapi import Depends, status, HTTPException, APIRouter
+from fastapi import Depends, status, HTTPException, APIRouter, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.config import app_config
 from src.db.database import get_db, RepositoryContainer
-from src.dependencies import UserClaims, decode_jwt_token
+from src.db.repository import TimeSeriesQuery, parse_interval
+from src.dependencies import UserClaims, decode_jwt_token, decode_ws_token
 from src.models import DeviceMetrics, Devices, Sites, METRIC_TYPE_TO_UNIT, Subscription
-from src.routers.router_model import MetricResponse, CreateSubscriptionRequest, TimeSeriesResponse, MetricStatusCodeResponse
+from src.services.alerts import alert_engine
+from src.services.broker import SLOW_CONSUMER, metric_broker, StreamConsumer
+from src.services.cluster import cluster_bridge
+from src.services.export import EXPORT_FORMATS, pa
+from src.services.ingest import IngestQueueFull, IngestUnavailable, ingest_buffer
+from src.services.latest_cache import latest_cache
+from src.services.ownership import UserOwnership, get_ownership, load_ownership
+from src.services.subscriptions import WILDCARD, subscription_index
+from src.routers.json_response import RowsJSONResponse
+from src.routers.router_model import MetricResponse, CreateSubscriptionRequest, TimeSeriesResponse, MetricStatusCodeResponse, \
+    MetricReading, MetricBatchResponse, DeviceMetricResponse, LatestMetricsBatchRequest, AlertRuleRequest, AlertRuleResponse, \
+    SubscriptionBatchResponse, SubscriptionPair, SubscriptionResponse
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+KNOWN_METRIC_TYPES = {metric.name.lower() for metric in METRIC_TYPE_TO_UNIT}
+# how many validation messages are echoed back to the client
+MAX_REPORTED_ERRORS = 10
 
 
 metrics_router = APIRouter()
@@ -22,94 +44,454 @@ metrics_router = APIRouter()
 @metrics_router.get("/devices/{device_id}/metrics/latest",
                     response_model=MetricResponse)
 async def get_latest_metric(device_id: uuid.UUID, metric_type: str, user: UserClaims = Depends(decode_jwt_token),
-                            db: RepositoryContainer = Depends(get_db)):
+                            db: RepositoryContainer = Depends(get_db), ownership: UserOwnership = Depends(get_ownership)):
+    if user.access_level != "technical":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Don't have technical status")
+    ownership.require_device(device_id)
+
+    metric_type = metric_type.lower()
+    if metric_type not in KNOWN_METRIC_TYPES:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"unknown metric type {metric_type}")
+
+    key = (device_id, metric_type)
+    latest = latest_cache.get(key)
+    if latest is None:
+        metrics = await db.metrics.get_latest_metrics([key])
+        latest_cache.update((metric.time, metric.device_id, metric.metric_type, metric.value) for metric in metrics)
+        latest = latest_cache.get(key)
+        if latest is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"given metrics for device {device_id} was not found")
+
+    time, value = latest
+    return MetricResponse(time=time,
+                          metric_type=metric_type,
+                          value=value,
+                          unit=_metric_unit(metric_type))
+
+
+def _metric_unit(metric_type: str) -> str:
+    unit = METRIC_TYPE_TO_UNIT.__members__.get(metric_type.upper())
+    return unit.value if unit else "unknown"
+
+
+def _utc(value: datetime) -> datetime:
+    """Naive datetimes are taken as UTC, so they can be compared with aware ones and stored as timestamptz"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _normalize_metric_types(metric_types: list[str] | None) -> list[str]:
+    if not metric_types:
+        return sorted(KNOWN_METRIC_TYPES)
+    normalized = sorted({metric_type.lower() for metric_type in metric_types})
+    unknown = set(normalized) - KNOWN_METRIC_TYPES
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"unknown metric types: {sorted(unknown)}")
+    return normalized
+
+
+@metrics_router.get("/sites/{site_id}/metrics/latest",
+                    response_model=list[DeviceMetricResponse],
+                    description="Latest value of every device and metric type of the site, resolved by one query")
+async def get_site_latest_metrics(
+        site_id: uuid.UUID,
+        metric_types: list[str] | None = Query(None),
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
+):
+    metric_types = _normalize_metric_types(metric_types)
+    ownership.require_site(site_id)
+
+    metrics = await db.metrics.get_site_latest_metrics(site_id=site_id, metric_types=metric_types)
+    records = [(metric.time, metric.device_id, metric.metric_type, metric.value) for metric in metrics]
+    latest_cache.update(records)
+
+    return RowsJSONResponse([
+        {"time": time, "metric_type": metric_type, "value": value, "unit": _metric_unit(metric_type), "device_id": device_id}
+        for time, device_id, metric_type, value in records
+    ])
+
+
+@metrics_router.get("/sites/{site_id}/metrics/export",
+                    description="Stream raw metrics of all site devices, memory use doesn't depend on range size")
+async def export_site_metrics(
+        site_id: uuid.UUID,
+        start_time: datetime,
+        end_time: datetime,
+        format: Literal["csv", "ndjson", "parquet", "arrow"] = Query("csv"),
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
+):
+    encoder, media_type, extension, needs_arrow = EXPORT_FORMATS[format]
+    if needs_arrow and pa is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{format} export requires pyarrow to be installed")
+    start_time, end_time = _utc(start_time), _utc(end_time)
+    if end_time <= start_time:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end_time has to be after start_time")
+
+    ownership.require_site(site_id)
+
+    # session of the request stays open until the whole body is sent
+    batches = db.metrics.stream_site_metrics(site_id=site_id, start_time=start_time, end_time=end_time,
+                                             batch_size=app_config.export_batch_size)
+    filename = f"site-{site_id}-{start_time:%Y%m%dT%H%M%S}-{end_time:%Y%m%dT%H%M%S}.{extension}"
+    return StreamingResponse(encoder(batches), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@metrics_router.post("/metrics/latest:batch",
+                     response_model=list[DeviceMetricResponse],
+                     description="Latest values of given devices and metric types, cache misses are loaded by one query")
+async def get_latest_metrics_batch(
+        request: LatestMetricsBatchRequest,
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
+):
+    metric_types = _normalize_metric_types(request.metric_types)
+    device_ids = list(dict.fromkeys(request.device_ids))
+    if len(device_ids) * len(metric_types) > app_config.max_latest_batch:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"batch is limited to {app_config.max_latest_batch} device and metric pairs")
+
+    # devices of other users are silently skipped, as the ones without any metric
+    keys = [(device_id, metric_type) for device_id in device_ids if device_id in ownership.devices for metric_type in metric_types]
+    found, missing = latest_cache.get_many(keys)
+    if missing:
+        metrics = await db.metrics.get_latest_metrics(missing)
+        records = [(metric.time, metric.device_id, metric.metric_type, metric.value) for metric in metrics]
+        latest_cache.update(records)
+        found.update({(device_id, metric_type): (time, value) for time, device_id, metric_type, value in records})
+
+    response = []
+    for device_id, metric_type in keys:
+        latest = found.get((device_id, metric_type))
+        if latest:
+            response.append({"time": latest[0], "metric_type": metric_type, "value": latest[1],
+                             "unit": _metric_unit(metric_type), "device_id": device_id})
+    return RowsJSONResponse(response)
+
+
+def _parse_metric_batch(body: bytes, content_type: str) -> tuple[list[tuple], list[str]]:
+    """Turn JSON array or NDJSON body into COPY-ready records, invalid readings are collected as errors"""
+    if content_type.split(";")[0].strip() in NDJSON_CONTENT_TYPES:
+        items = []
+        for line_no, line in enumerate(body.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                items.append(f"line {line_no} is not valid JSON")
+    else:
+        try:
+            items = json.loads(body)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="body is not valid JSON")
+        if isinstance(items, dict):
+            items = items.get("metrics")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="expected list of metrics")
+
+    if len(items) > app_config.max_ingest_batch:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"batch is limited to {app_config.max_ingest_batch} metrics")
+
+    records, errors = [], []
+    for item in items:
+        if isinstance(item, str):
+            errors.append(item)
+            continue
+        try:
+            reading = MetricReading.model_validate(item)
+        except ValidationError as e:
+            errors.append(f"invalid metric: {e.errors()[0]['msg']}")
+            continue
+
+        metric_type = reading.metric_type.lower()
+        if metric_type not in KNOWN_METRIC_TYPES:
+            errors.append(f"unknown metric_type: {reading.metric_type}")
+            continue
+
+        records.append((_utc(reading.time), reading.device_id, metric_type, reading.value))
+
+    return records, errors
+
+
+@metrics_router.post("/metrics/batch",
+                     response_model=MetricBatchResponse,
+                     description="Bulk write of device readings, accepts JSON array or NDJSON body. "
+                                 "Readings are queued and written in the background (202), 429 when the queue is full",
+                     responses={
+                         "202": {"description": "Readings were queued", "model": MetricBatchResponse},
+                         "429": {"description": "Ingest queue is full, retry later"},
+                         "503": {"description": "Ingest is shutting down"},
+                     })
+async def ingest_metrics_batch(
+        request: Request,
+        response: Response,
+        user: UserClaims = Depends(decode_jwt_token),
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
+):
     if user.access_level != "technical":
-        return status.HTTP_401_UNAUTHORIZED
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Don't have technical status")
+
+    records, errors = _parse_metric_batch(await request.body(), request.headers.get("content-type", ""))
+    rejected = len(errors)
+    owned_records = [record for record in records if record[1] in ownership.devices]
+    if len(owned_records) != len(records):
+        rejected += len(records) - len(owned_records)
+        errors.append(f"{len(records) - len(owned_records)} metrics of unknown devices")
 
-    metric = await db.metrics.get_metric_last_values(device_id, metric_type)
-    if not metric:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"given metrics for device {device_id} was not found")
+    if app_config.ingest_buffer_enabled and ingest_buffer.running:
+        try:
+            ingest_buffer.submit(owned_records)
+        except IngestQueueFull:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="ingest queue is full",
+                                headers={"Retry-After": "1"})
+        except IngestUnavailable:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="ingest is not available",
+                                headers={"Retry-After": "5"})
+        # duplicates are only known once the batch is written
+        response.status_code = status.HTTP_202_ACCEPTED
+        return MetricBatchResponse(accepted=len(owned_records), rejected=rejected, errors=errors[:MAX_REPORTED_ERRORS])
 
-    unit = METRIC_TYPE_TO_UNIT[metric_type.upper()].value
-    return MetricResponse(time=metric.time,
-                          metric_type=metric.metric_type,
-                          value=metric.value,
-                          unit=unit)
+    inserted = await db.metrics.insert_metrics(owned_records)
+    metric_broker.publish(inserted)
+
+    # duplicates of already stored readings are counted as rejected
+    return MetricBatchResponse(
+        accepted=len(inserted),
+        rejected=rejected + len(owned_records) - len(inserted),
+        errors=errors[:MAX_REPORTED_ERRORS],
+    )
 
 
 # R4: Metric Subscription (Streaming)
 @metrics_router.post("/subscriptions",
-                   response_model=MetricResponse)
+                   response_model=SubscriptionBatchResponse,
+                   description=f"Subscribe devices to metric types in one statement, metric type '{WILDCARD}' subscribes "
+                               f"to all metrics of the device. Pairs subscribed before are reported as existing")
 async def create_subscriptions(
         request: CreateSubscriptionRequest,
-        user: UserClaims = Depends(decode_jwt_token),
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
+):
+    device_ids = list(dict.fromkeys(request.device_ids))
+    metric_types = list(dict.fromkeys(request.metric_types))
+    if len(device_ids) * len(metric_types) > app_config.max_subscription_batch:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"batch is limited to {app_config.max_subscription_batch} device and metric pairs")
+    ownership.require_devices(device_ids)
+
+    pairs = [(device_id, metric_type) for device_id in device_ids for metric_type in metric_types]
+    created = await db.metrics.create_devices_subscriptions(pairs=pairs)
+    if created is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Devices were changed meanwhile, try again")
+    subscription_index.add_many((sub.id, sub.device_id, sub.metric_type) for sub in created)
+
+    created_pairs = {(sub.device_id, sub.metric_type) for sub in created}
+    return SubscriptionBatchResponse(
+        created=[SubscriptionResponse.model_validate(sub, from_attributes=True) for sub in created],
+        existing=[SubscriptionPair(device_id=device_id, metric_type=metric_type)
+                  for device_id, metric_type in pairs if (device_id, metric_type) not in created_pairs],
+    )
+
+
+@metrics_router.delete("/subscriptions/{subscription_id}",
+                       response_model=MetricStatusCodeResponse,
+                       description="Delete the subscription with its alert rules, its open streams are closed")
+async def delete_subscription(
+        subscription_id: uuid.UUID,
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
+):
+    await _get_owned_subscription(subscription_id, db, ownership)
+    if not await db.metrics.delete_subscription(subscription_id=subscription_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subscription was not created so far. Do it first")
+    cluster_bridge.remove_subscription(subscription_id)
+    return MetricStatusCodeResponse(status=status.HTTP_200_OK, msg="Subscription was deleted")
+
+
+async def _get_owned_subscription(subscription_id: uuid.UUID, db: RepositoryContainer, ownership: UserOwnership):
+    subscription = await db.metrics.get_subscription(subscription_id=subscription_id)
+    if not subscription or subscription.device_id not in ownership.devices:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subscription was not created so far. Do it first")
+    return subscription
+
+
+@metrics_router.get("/subscriptions/{subscription_id}/stream",
+                    description="Server-Sent Events stream of new metrics of given subscription. "
+                                "WebSocket clients can connect to the same path.")
+async def stream_subscription(
+        subscription_id: uuid.UUID,
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
+):
+    subscription = await db.metrics.get_subscription(subscription_id=subscription_id)
+    # streams can be open for hours, don't block pooled connection meanwhile
+    await db.release()
+    if not subscription or subscription.device_id not in ownership.devices:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subscription was not created so far. Do it first")
+
+    # subscriptions created by other workers may not be indexed here yet
+    subscription_index.add(subscription.id, subscription.device_id, subscription.metric_type)
+
+    async def events():
+        consumer = metric_broker.subscribe({subscription.id})
+        try:
+            while True:
+                try:
+                    payload = await asyncio.wait_for(consumer.get(), timeout=app_config.stream_keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if payload is None:
+                    yield f"event: close\ndata: {consumer.close_reason}\n\n"
+                    return
+                yield f"data: {payload}\n\n"
+        finally:
+            metric_broker.unsubscribe(consumer)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def _close_on_disconnect(websocket: WebSocket, consumer: StreamConsumer):
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        consumer.close()
+
+
+@metrics_router.websocket("/subscriptions/{subscription_id}/stream")
+async def stream_subscription_ws(
+        websocket: WebSocket,
+        subscription_id: uuid.UUID,
+        user: UserClaims = Depends(decode_ws_token),
         db: RepositoryContainer = Depends(get_db)
 ):
+    ownership = await load_ownership(user, db)
+    subscription = await db.metrics.get_subscription(subscription_id=subscription_id)
+    await db.release()
+    if not subscription or subscription.device_id not in ownership.devices:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="subscription not found")
+        return
 
-    valid_devices = await db.devices.check_exist_user_devices(user_id=uuid.UUID(user.id), device_ids=request.device_ids)
-    valid_device_ids = {device.id for device in valid_devices}
+    subscription_index.add(subscription.id, subscription.device_id, subscription.metric_type)
+    await websocket.accept()
+    consumer = metric_broker.subscribe({subscription.id})
+    watcher = asyncio.create_task(_close_on_disconnect(websocket, consumer))
+    try:
+        while (payload := await consumer.get()) is not None:
+            await websocket.send_text(payload)
+        if not watcher.done():
+            code = status.WS_1013_TRY_AGAIN_LATER if consumer.close_reason == SLOW_CONSUMER else status.WS_1000_NORMAL_CLOSURE
+            await websocket.close(code=code, reason=consumer.close_reason)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        metric_broker.unsubscribe(consumer)
 
-    if len(valid_device_ids) != len(request.device_ids):
-        invalid_device_ids = set(request.device_ids) - valid_device_ids
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Didn't find valid device_id: {list[invalid_device_ids]} for subscription")
 
+@metrics_router.post("/subscriptions/{subscription_id}/alerts",
+                     response_model=AlertRuleResponse,
+                     status_code=status.HTTP_201_CREATED,
+                     description="Alert rule evaluated on every ingested reading of the subscription, state changes "
+                                 "are sent to its streams as events with \"event\": \"alert\"")
+async def create_alert_rule(
+        subscription_id: uuid.UUID,
+        payload: AlertRuleRequest,
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
+):
+    subscription = await _get_owned_subscription(subscription_id, db, ownership)
+    if subscription.metric_type == WILDCARD:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="alert rules need subscription of one metric type")
+    alert_rule = await db.metrics.create_alert_rule(subscription_id=subscription_id, rule=payload.model_dump())
+    rule = {
+        "id": alert_rule.id,
+        "subscription_id": subscription_id,
+        "device_id": subscription.device_id,
+        "metric_type": subscription.metric_type,
+        **payload.model_dump(),
+    }
+    cluster_bridge.add_alert_rule(rule)
+    return AlertRuleResponse(**rule)
 
-    # Check for existing subscriptions to avoid duplicates
-    existing_subscriptions = await db.metrics.check_existing_subscription(device_ids=request.device_ids, metric_types=request.metric_types)
-    existing_pairs = {(sub.device_id, sub.metric_type) for sub in existing_subscriptions}
 
-    # Create only new subscriptions
-    new_subscriptions = []
+@metrics_router.get("/subscriptions/{subscription_id}/alerts",
+                    response_model=list[AlertRuleResponse],
+                    description="Alert rules of the subscription and whether they are firing right now")
+async def get_alert_rules(
+        subscription_id: uuid.UUID,
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
+):
+    await _get_owned_subscription(subscription_id, db, ownership)
+    rules = await db.metrics.get_alert_rules(subscription_id=subscription_id)
+    return [AlertRuleResponse(**rule, firing=alert_engine.is_firing(rule["id"])) for rule in rules]
 
-    if not new_subscriptions:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Subscription already exist")
 
-    await db.metrics.create_devices_subscriptions(device_ids=request.device_ids, metric_types=request.metric_types, existing_pairs=existing_pairs)
-    return MetricStatusCodeResponse(status_code=status.HTTP_200_OK, details="Subscription was created")
+@metrics_router.delete("/subscriptions/{subscription_id}/alerts/{rule_id}",
+                       response_model=MetricStatusCodeResponse)
+async def delete_alert_rule(
+        subscription_id: uuid.UUID,
+        rule_id: uuid.UUID,
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
+):
+    await _get_owned_subscription(subscription_id, db, ownership)
+    if not await db.metrics.delete_alert_rule(subscription_id=subscription_id, rule_id=rule_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"alert rule with id: {rule_id} was not found")
+    cluster_bridge.remove_alert_rule(rule_id)
+    return MetricStatusCodeResponse(status=status.HTTP_200_OK, msg="Alert rule was deleted")
 
 
 # # R5: Time-Series Endpoint
-@metrics_router.get("/subscriptions/{subscription_id}/time-series")
+@metrics_router.get("/subscriptions/{subscription_id}/time-series",
+                    response_model=TimeSeriesResponse)
 async def get_time_series(
         subscription_id: uuid.UUID,
         start_time: datetime,
         end_time: datetime,
-        user: UserClaims = Depends(decode_jwt_token),
-        db: RepositoryContainer = Depends(get_db)
+        interval: str = Query("1h", pattern=r"^\d+[smhdw]$", description="Bucket width, e.g. 1m, 15m, 1h, 1d"),
+        aggregation: Literal["avg", "sum", "min", "max", "count", "first", "last"] = Query("avg"),
+        db: RepositoryContainer = Depends(get_db),
+        ownership: UserOwnership = Depends(get_ownership)
 ):
+    start_time, end_time = _utc(start_time), _utc(end_time)
+    if end_time <= start_time:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end_time has to be after start_time")
 
-    subscription = await db.metrics.check_existing_subscription_by_id(subscription_id=subscription_id)
-    if not subscription:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subscription was not created so far. Do it first")
-
-
-    fake = faker.Faker()
-    time_diff = end_time - start_time
-    hours = max(1, int(time_diff.total_seconds() / 3600))
-    limit = min(100, hours)
+    try:
+        bucket_width = parse_interval(interval)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    metric_ranges = {
-        "temperature": (15.0, 35.0),
-        "humidity": (30.0, 80.0),
-        "pressure": (980.0, 1040.0),
-        "voltage": (220.0, 240.0),
-        "current": (1.0, 10.0),
-        "power_output": (0.0, 100.0),
-        "charge_level": (0.0, 100.0)
-    }
+    # refuse ranges which would return more buckets than the dashboards can draw
+    if (end_time - start_time) / bucket_width > app_config.max_time_series_points:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"interval {interval} is too fine for given range, use a wider one")
 
-    min_val, max_val = metric_ranges.get(subscription.metric_type, (0.0, 100.0))
+    subscription = await db.metrics.get_subscription(subscription_id=subscription_id)
+    if not subscription or subscription.device_id not in ownership.devices:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subscription was not created so far. Do it first")
+    if subscription.metric_type == WILDCARD:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="time series needs subscription of one metric type")
 
-    data = []
-    for _ in range(limit):
-        value = fake.pyfloat(min_value=min_val, max_value=max_val, right_digits=2)
-        data.append(value)
+    query = TimeSeriesQuery(start_time=start_time, end_time=end_time, interval=interval, aggregation=aggregation)
+    data = await db.metrics.get_subscription_timeseries_data(subscription_id=subscription_id, query=query)
 
-    return TimeSeriesResponse(
-        device_id=subscription.device_id,
-        metric_type=subscription.metric_type,
-        data= data,
-        start_time= start_time,
-        end_time= end_time,
-        count= limit,
-    )
+    # up to max_time_series_points buckets, rows are encoded as they come from the repository
+    return RowsJSONResponse({
+        "device_id": subscription.device_id,
+        "metric_type": subscription.metric_type,
+        "data": data,
+        "start_time": start_time,
+        "end_time": end_time,
+        "interval": interval,
+        "aggregation": aggregation,
+        "count": len(data),
+    })
@@ -0,0 +1,45 @@
+import base64
+import json
+import uuid
+from collections.abc import Callable
+from typing import Any
+
+from fastapi import HTTPException, Request, status
+
+
+def encode_cursor(*values: Any) -> str:
+    data = json.dumps([str(value) for value in values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str, size: int) -> list[str]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="invalid cursor")
+    return values
+
+
+def cursor_uuid(value: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="invalid cursor")
+
+
+def next_page(request: Request, rows: list, limit: int, cursor_key: Callable[[Any], tuple]) -> tuple[list, dict[str, str]]:
+    """Rows are fetched with limit + 1, the extra one only tells there is a next page.
+
+    Cursor of the next page is returned in X-Next-Cursor and Link headers, so the body stays a plain list.
+    """
+    if len(rows) <= limit:
+        return rows, {}
+
+    rows = rows[:limit]
+    cursor = encode_cursor(*cursor_key(rows[-1]))
+    return rows, {
+        "X-Next-Cursor": cursor,
+        "Link": f'<{request.url.include_query_params(cursor=cursor)}>; rel="next"',
+    }
@@ -1,6 +1,12 @@
 import uuid
 from datetime import datetime
-from pydantic import BaseModel, field_serializer, Field
+from typing import Literal
+
+from pydantic import BaseModel, field_serializer, field_validator, Field, model_validator
+
+from src.models import METRIC_TYPE_TO_UNIT, WILDCARD
+
+SUBSCRIBABLE_METRIC_TYPES = {metric.name.lower() for metric in METRIC_TYPE_TO_UNIT} | {WILDCARD}
 
 
 class UserClaims(BaseModel):
@@ -18,6 +24,19 @@ class SiteResponse(BaseModel):
     model_config = {"from_attributes": True}
 
 
+class QuantitySummary(BaseModel):
+    value: float | None
+    unit: str
+    devices: int
+
+
+class SiteSummaryResponse(BaseModel):
+    site_id: uuid.UUID
+    updated_at: datetime | None
+    # window ('now', '15m', '1h', '1d') -> quantity name -> value
+    windows: dict[str, dict[str, QuantitySummary]]
+
+
 class DeviceRequest(BaseModel):
     id: uuid.UUID | None = None
     name: str
@@ -31,11 +50,7 @@ class DeviceFullResponse(BaseModel):
     public_site_id: uuid.UUID = Field(alias="site_id")
     type: str
 
-    @field_serializer('public_id')
-    def serialize_id(self, value: uuid.UUID) -> str:
-        return str(value)[:8]
-
-    @field_serializer('public_site_id')
+    @field_serializer('public_device_id', 'public_site_id')
     def serialize_id(self, value: uuid.UUID) -> str:
         return str(value)[:8]
 
@@ -59,6 +74,28 @@ class MetricResponse(BaseModel):
     value: float
     unit: str = "unknown"
 
+class DeviceMetricResponse(MetricResponse):
+    device_id: uuid.UUID
+
+
+class LatestMetricsBatchRequest(BaseModel):
+    device_ids: list[uuid.UUID]
+    metric_types: list[str]
+
+
+class MetricReading(BaseModel):
+    time: datetime
+    device_id: uuid.UUID
+    metric_type: str
+    value: float
+
+
+class MetricBatchResponse(BaseModel):
+    accepted: int
+    rejected: int
+    errors: list[str] = []
+
+
 class SubscriptionCreate(BaseModel):
     metric_types: list[str]
     device_ids: list[uuid.UUID]
@@ -69,15 +106,25 @@ class SubscriptionResponse(BaseModel):
     metric_type: str
     device_id: uuid.UUID
 
-class TimeSeriesResponse(BaseModel):
+class TimeSeriesPoint(BaseModel):
     time: datetime
-    value: float
+    value: float | None
 
 
 class CreateSubscriptionRequest(BaseModel):
     device_ids: list[uuid.UUID]
     metric_types: list[str]
 
+    @field_validator("metric_types")
+    @classmethod
+    def known_metric_types(cls, metric_types: list[str]) -> list[str]:
+        # readings are stored with lower case metric types, a typo would create a subscription never matched
+        metric_types = [metric_type.lower() for metric_type in metric_types]
+        unknown = sorted(set(metric_types) - SUBSCRIBABLE_METRIC_TYPES)
+        if unknown:
+            raise ValueError(f"unknown metric types: {unknown}")
+        return metric_types
+
 
 class SubscriptionResponse(BaseModel):
     id: uuid.UUID
@@ -86,10 +133,66 @@ class SubscriptionResponse(BaseModel):
     created_at: datetime
 
 
+class SubscriptionPair(BaseModel):
+    device_id: uuid.UUID
+    metric_type: str
+
+
+class SubscriptionBatchResponse(BaseModel):
+    created: list[SubscriptionResponse]
+    existing: list[SubscriptionPair]
+
+
+class AlertRuleRequest(BaseModel):
+    kind: Literal["threshold", "rate"]
+    operator: Literal[">", ">=", "<", "<="]
+    # value in the unit of the metric, or its change per minute for 'rate' rules
+    threshold: float
+    # how long a threshold has to be breached before firing, trailing window of 'rate' rules
+    duration_seconds: int = Field(0, ge=0, le=86_400)
+
+    @model_validator(mode="after")
+    def rate_needs_window(self):
+        if self.kind == "rate" and not self.duration_seconds:
+            raise ValueError("rate rule needs duration_seconds window")
+        return self
+
+
+class AlertRuleResponse(BaseModel):
+    id: uuid.UUID
+    subscription_id: uuid.UUID
+    device_id: uuid.UUID
+    metric_type: str
+    kind: str
+    operator: str
+    threshold: float
+    duration_seconds: int
+    firing: bool = False
+
+
 class TimeSeriesResponse(BaseModel):
     device_id: uuid.UUID
     metric_type: str
-    data: list
+    data: list[TimeSeriesPoint]
     start_time: datetime
     end_time: datetime
-    count: int
\ No newline at end of file
+    interval: str
+    aggregation: str
+    count: int
+
+
+class ChunkStatsResponse(BaseModel):
+    chunk_name: str
+    range_start: datetime
+    range_end: datetime
+    is_compressed: bool
+    total_bytes: int
+    before_compression_bytes: int | None = None
+    after_compression_bytes: int | None = None
+    compression_ratio: float | None = None
+
+
+class StorageStatsResponse(BaseModel):
+    chunks: list[ChunkStatsResponse]
+    total_bytes: int
+    compression_ratio: float | None = None
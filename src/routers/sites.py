@@ -2,48 +2,121 @@ import uuid
 
 from src.db.database import RepositoryContainer, get_db
 from src.dependencies import UserClaims, decode_jwt_token
-from src.routers.router_model import SiteResponse
+from src.routers.pagination import cursor_uuid, decode_cursor, next_page
+from src.routers.router_model import SiteResponse, DeviceFullResponse, SiteSummaryResponse
+from src.services.ownership import UserOwnership, get_ownership
+from src.services.response_cache import entity_etag, json_renderer, response_cache
+from src.services.site_rollups import site_rollups
 
-from fastapi import status, HTTPException, Depends, Query, APIRouter
+from fastapi import status, HTTPException, Depends, Query, APIRouter, Request
 
 
 sites_router = APIRouter()
 
+render_site = json_renderer(SiteResponse)
+render_sites = json_renderer(list[SiteResponse])
+render_devices = json_renderer(list[DeviceFullResponse])
+
 
 @sites_router.get("/sites/{site_id}",
-                  response_model=SiteResponse)
+                  response_model=SiteResponse,
+                  description="Site detail, answers 304 when If-None-Match holds the current ETag")
 async def get_site(
     site_id: uuid.UUID,
-    user: UserClaims = Depends(decode_jwt_token),
-    db: RepositoryContainer = Depends(get_db)
+    request: Request,
+    db: RepositoryContainer = Depends(get_db),
+    ownership: UserOwnership = Depends(get_ownership)
 ):
-    # return { "id" :uuid.uuid4(), "name" :"ddd"}
     # more detailed data about requested site
-    site = await db.sites.get_user_site(site_id=site_id)
-    if not site:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"site with id: {site_id} was not found")
-    return site
+    ownership.require_site(site_id)
+
+    async def load():
+        site = await db.sites.get_user_site(site_id=site_id)
+        if not site:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"site with id: {site_id} was not found")
+        return site, entity_etag([site]), {}
+
+    return await response_cache.respond(request, ownership.user_id, load, render_site)
 
 
 @sites_router.get(
     "/sites",
     response_model=list[SiteResponse],
-    description="Return list of all site for given user",
+    description="Return list of all site for given user, ordered by name. Next page cursor is in X-Next-Cursor and Link headers, "
+                "304 is returned when If-None-Match holds the current ETag",
     responses={
            "200": {"description":"List of all sites", "model": list[SiteResponse] },
+           "304": {"description": "Sites didn't change since the ETag" },
+           "400": {"description": "Invalid cursor" },
            "401": {"description": "Invalid of missing JSON" },
         }
     )
 async def get_sites(
+    request: Request,
     user: UserClaims = Depends(decode_jwt_token),
     db: RepositoryContainer = Depends(get_db),
-    skip: int = Query(0, ge=0, description="Number of sites to skip"),
+    cursor: str | None = Query(None, description="Cursor of the page returned by previous request"),
     limit: int = Query(100, ge=1, le=1000, description="Maximum number of sites to return")
 ):
     # get all sites attached to user
-    sites = await db.sites.get_all_user_sites(user_id=uuid.UUID(user.id), offset=skip, limit=limit)
-    if not sites:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No sites was found")
+    after = None
+    if cursor:
+        name, site_id = decode_cursor(cursor, 2)
+        after = (name, cursor_uuid(site_id))
+    user_id = uuid.UUID(user.id)
+
+    async def load():
+        sites = list(await db.sites.get_all_user_sites(user_id=user_id, after=after, limit=limit + 1))
+        if not sites and not cursor:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No sites was found")
+        # the extra row decides the next page cursor, so it is part of the ETag too
+        etag = entity_etag(sites, limit)
+        page, headers = next_page(request, sites, limit, lambda site: (site.name or "", site.id))
+        return page, etag, headers
+
+    return await response_cache.respond(request, user_id, load, render_sites)
+
+
+@sites_router.get(
+    "/sites/{site_id}/devices",
+    response_model=list[DeviceFullResponse],
+    description="Return devices of the site ordered by name. Next page cursor is in X-Next-Cursor and Link headers, "
+                "304 is returned when If-None-Match holds the current ETag",
+    )
+async def get_site_devices(
+    site_id: uuid.UUID,
+    request: Request,
+    db: RepositoryContainer = Depends(get_db),
+    ownership: UserOwnership = Depends(get_ownership),
+    cursor: str | None = Query(None, description="Cursor of the page returned by previous request"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of devices to return")
+):
+    ownership.require_site(site_id)
+    after = None
+    if cursor:
+        name, device_id = decode_cursor(cursor, 2)
+        after = (name, cursor_uuid(device_id))
+
+    async def load():
+        devices = list(await db.devices.get_site_devices(site_id=site_id, after=after, limit=limit + 1))
+        etag = entity_etag(devices, limit)
+        page, headers = next_page(request, devices, limit, lambda device: (device.name, device.id))
+        return page, etag, headers
+
+    return await response_cache.respond(request, ownership.user_id, load, render_devices)
+
 
-    return sites
 
+@sites_router.get(
+    "/sites/{site_id}/summary",
+    response_model=SiteSummaryResponse,
+    description="PV and wind production, battery charge and inverter temperature of the site now and over "
+                "the last 15m, 1h and 1d. Served from in-memory rollups kept up to date by ingest",
+    )
+async def get_site_summary(
+    site_id: uuid.UUID,
+    db: RepositoryContainer = Depends(get_db),
+    ownership: UserOwnership = Depends(get_ownership)
+):
+    ownership.require_site(site_id)
+    return await site_rollups.summary(site_id, db.metrics)
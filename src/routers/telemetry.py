@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+
+from src.services.instrumentation import prometheus_exposition
+
+telemetry_router = APIRouter()
+
+
+@telemetry_router.get("/metrics", include_in_schema=False)
+async def get_prometheus_metrics():
+    body, content_type = prometheus_exposition()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,208 @@
+import json
+import operator
+import uuid
+from collections import deque
+from collections.abc import Iterable
+from dataclasses import dataclass
+from datetime import datetime
+
+from loguru import logger
+
+from src.db.database import AsyncSessionFactory
+from src.db.metrics_repository import SQLAlchemyMetrics
+from src.services.broker import MetricRecord, StreamKey, metric_broker
+
+OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+ALERT_KINDS = ("threshold", "rate")
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    id: uuid.UUID
+    subscription_id: uuid.UUID
+    device_id: uuid.UUID
+    metric_type: str
+    kind: str
+    operator: str
+    threshold: float
+    duration_seconds: int
+
+    @classmethod
+    def from_row(cls, row: dict) -> "CompiledRule":
+        return cls(**{name: row[name] for name in cls.__dataclass_fields__})
+
+    @property
+    def key(self) -> StreamKey:
+        return self.device_id, self.metric_type
+
+
+class ThresholdEvaluator:
+    """Fires once the value satisfies the condition for duration_seconds without interruption"""
+
+    __slots__ = ("rule", "compare", "breach_since", "last_seen", "firing")
+
+    def __init__(self, rule: CompiledRule):
+        self.rule = rule
+        self.compare = OPERATORS[rule.operator]
+        self.breach_since: float | None = None
+        self.last_seen = float("-inf")
+        self.firing = False
+
+    def observe(self, timestamp: float, value: float) -> float | None:
+        """Returns observed value when the rule changed state"""
+        # late readings would reorder the window, they are skipped
+        if timestamp < self.last_seen:
+            return None
+        self.last_seen = timestamp
+        return self._transition(timestamp, value, self.rule.duration_seconds)
+
+    def _transition(self, timestamp: float, observed: float, hold_seconds: float) -> float | None:
+        if self.compare(observed, self.rule.threshold):
+            if self.breach_since is None:
+                self.breach_since = timestamp
+            if not self.firing and timestamp - self.breach_since >= hold_seconds:
+                self.firing = True
+                return observed
+        else:
+            self.breach_since = None
+            if self.firing:
+                self.firing = False
+                return observed
+        return None
+
+
+class RateEvaluator(ThresholdEvaluator):
+    """Compares change per minute between the oldest and newest reading of the trailing duration_seconds"""
+
+    __slots__ = ("window",)
+
+    def __init__(self, rule: CompiledRule):
+        super().__init__(rule)
+        self.window: deque[tuple[float, float]] = deque()
+
+    def observe(self, timestamp: float, value: float) -> float | None:
+        if timestamp < self.last_seen:
+            return None
+        self.last_seen = timestamp
+        window = self.window
+        window.append((timestamp, value))
+        while timestamp - window[0][0] > self.rule.duration_seconds:
+            window.popleft()
+        span = timestamp - window[0][0]
+        if not span:
+            return None
+        # duration_seconds is the window of the rate, it fires as soon as the rate crosses threshold
+        return self._transition(timestamp, (value - window[0][1]) / span * 60, 0)
+
+
+EVALUATORS = {"threshold": ThresholdEvaluator, "rate": RateEvaluator}
+
+
+class AlertEngine:
+    """Evaluates alert rules on every ingested batch, state lives in memory per rule.
+
+    Readings are routed to rules by one dict lookup on (device_id, metric_type). Changes of rule
+    state are delivered as JSON events to stream consumers of the rule's subscription. Every worker sees all
+    readings (see ClusterBridge), so each one evaluates rules for its own stream clients.
+    """
+
+    def __init__(self):
+        self._evaluators: dict[StreamKey, list[ThresholdEvaluator]] = {}
+        self._rules: dict[uuid.UUID, ThresholdEvaluator] = {}
+        self.evaluated = 0
+        self.fired = 0
+        self.resolved = 0
+
+    def load(self, rows: Iterable[dict]):
+        """Replace all rules, state of unchanged rules is kept"""
+        previous = self._rules
+        self._evaluators, self._rules = {}, {}
+        for row in rows:
+            rule = CompiledRule.from_row(row)
+            evaluator = previous.get(rule.id)
+            if evaluator is None or evaluator.rule != rule:
+                evaluator = EVALUATORS[rule.kind](rule)
+            self._add(evaluator)
+
+    def add_rule(self, row: dict):
+        rule = CompiledRule.from_row(row)
+        self.remove_rule(rule.id)
+        self._add(EVALUATORS[rule.kind](rule))
+
+    def _add(self, evaluator: ThresholdEvaluator):
+        self._rules[evaluator.rule.id] = evaluator
+        self._evaluators.setdefault(evaluator.rule.key, []).append(evaluator)
+
+    def remove_rule(self, rule_id: uuid.UUID):
+        evaluator = self._rules.pop(rule_id, None)
+        if evaluator is None:
+            return
+        evaluators = self._evaluators[evaluator.rule.key]
+        evaluators.remove(evaluator)
+        if not evaluators:
+            del self._evaluators[evaluator.rule.key]
+
+    def remove_subscription(self, subscription_id: uuid.UUID):
+        for rule_id in [rule_id for rule_id, evaluator in self._rules.items()
+                        if evaluator.rule.subscription_id == subscription_id]:
+            self.remove_rule(rule_id)
+
+    def is_firing(self, rule_id: uuid.UUID) -> bool:
+        evaluator = self._rules.get(rule_id)
+        return evaluator is not None and evaluator.firing
+
+    def evaluate(self, records: list[MetricRecord]):
+        index = self._evaluators
+        if not index:
+            return
+        for time, device_id, metric_type, value in records:
+            evaluators = index.get((device_id, metric_type))
+            if not evaluators:
+                continue
+            timestamp = time.timestamp()
+            for evaluator in evaluators:
+                self.evaluated += 1
+                observed = evaluator.observe(timestamp, value)
+                if observed is not None:
+                    self._emit(evaluator, time, observed)
+
+    def _emit(self, evaluator: ThresholdEvaluator, time: datetime, observed: float):
+        rule = evaluator.rule
+        if evaluator.firing:
+            self.fired += 1
+        else:
+            self.resolved += 1
+        metric_broker.publish_event(rule.subscription_id, json.dumps({
+            "event": "alert",
+            "state": "firing" if evaluator.firing else "resolved",
+            "rule_id": str(rule.id),
+            "subscription_id": str(rule.subscription_id),
+            "device_id": str(rule.device_id),
+            "metric_type": rule.metric_type,
+            "kind": rule.kind,
+            "operator": rule.operator,
+            "threshold": rule.threshold,
+            "observed": observed,
+            "time": time.isoformat(),
+        }))
+
+    def stats(self) -> dict:
+        return {
+            "rules": len(self._rules),
+            "series": len(self._evaluators),
+            "firing": sum(evaluator.firing for evaluator in self._rules.values()),
+            "evaluated": self.evaluated,
+            "fired": self.fired,
+            "resolved": self.resolved,
+        }
+
+
+alert_engine = AlertEngine()
+metric_broker.add_listener(alert_engine.evaluate)
+
+
+async def load_alert_rules():
+    async with AsyncSessionFactory() as session:
+        rows = await SQLAlchemyMetrics(session).get_alert_rules()
+    alert_engine.load(rows)
+    logger.info(f"Loaded {len(rows)} alert rules")
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import uuid
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from datetime import datetime
+
+from loguru import logger
+
+from src.config import app_config
+from src.services.subscriptions import SubscriptionIndex, subscription_index
+
+# (time, device_id, metric_type, value) as produced by the ingest path
+MetricRecord = tuple[datetime, uuid.UUID, str, float]
+StreamKey = tuple[uuid.UUID, str]
+SLOW_CONSUMER = "slow consumer"
+
+
+class StreamConsumer:
+    """Bounded queue of one streaming client.
+
+    When the client does not keep up, the oldest payload is dropped. After too many drops
+    the consumer is closed and the client gets disconnected.
+    """
+
+    def __init__(self, subscription_ids: set[uuid.UUID], queue_size: int, max_drops: int):
+        self.subscription_ids = subscription_ids
+        self.dropped = 0
+        self.closed = False
+        self.close_reason: str | None = None
+        self._max_drops = max_drops
+        self._queue: asyncio.Queue[str | None] = asyncio.Queue(maxsize=queue_size)
+
+    def offer(self, payload: str):
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self._queue.get_nowait()
+            self._queue.put_nowait(payload)
+            self.dropped += 1
+            if self.dropped > self._max_drops:
+                self.close(SLOW_CONSUMER)
+
+    def close(self, reason: str = "closed"):
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason
+        # wake up the reader, pending payloads are not delivered anymore
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def get(self) -> str | None:
+        """Next JSON payload, None once the consumer was closed"""
+        return await self._queue.get()
+
+
+class MetricBroker:
+    """In-process fan-out of freshly ingested metrics.
+
+    Consumers are keyed by subscription, readings are matched to subscriptions by the
+    subscription index. Payloads are serialized once per reading and shared by all consumers
+    it matches. Listeners get every published batch, e.g. caches, forwarders only batches
+    ingested by this process, e.g. to relay them to other workers.
+    """
+
+    def __init__(self, queue_size: int, max_drops: int, index: SubscriptionIndex):
+        self._queue_size = queue_size
+        self._max_drops = max_drops
+        self._index = index
+        self._consumers: dict[uuid.UUID, set[StreamConsumer]] = defaultdict(set)
+        self._listeners: list[Callable[[list[MetricRecord]], None]] = []
+        self._forwarders: list[Callable[[list[MetricRecord]], None]] = []
+        self.disconnected = 0
+
+    def subscribe(self, subscription_ids: Iterable[uuid.UUID]) -> StreamConsumer:
+        consumer = StreamConsumer(set(subscription_ids), self._queue_size, self._max_drops)
+        for subscription_id in consumer.subscription_ids:
+            self._consumers[subscription_id].add(consumer)
+        return consumer
+
+    def unsubscribe(self, consumer: StreamConsumer):
+        for subscription_id in consumer.subscription_ids:
+            consumers = self._consumers.get(subscription_id)
+            if consumers is None:
+                continue
+            consumers.discard(consumer)
+            if not consumers:
+                del self._consumers[subscription_id]
+        if consumer.close_reason == SLOW_CONSUMER:
+            self.disconnected += 1
+            logger.warning(f"slow stream consumer disconnected after {consumer.dropped} dropped metrics")
+
+    def add_listener(self, listener: Callable[[list[MetricRecord]], None]):
+        self._listeners.append(listener)
+
+    def add_forwarder(self, forwarder: Callable[[list[MetricRecord]], None]):
+        self._forwarders.append(forwarder)
+
+    def remove_forwarder(self, forwarder: Callable[[list[MetricRecord]], None]):
+        self._forwarders.remove(forwarder)
+
+    def publish(self, records: list[MetricRecord], forward: bool = True):
+        listeners = self._listeners + self._forwarders if forward else self._listeners
+        for listener in listeners:
+            try:
+                listener(records)
+            except Exception as e:
+                logger.error(f"metric listener {listener} failed: {e}")
+
+        all_consumers = self._consumers
+        if not all_consumers:
+            return
+
+        match = self._index.match
+        for time, device_id, metric_type, value in records:
+            payload = None
+            for subscription_id in match(device_id, metric_type):
+                consumers = all_consumers.get(subscription_id)
+                if not consumers:
+                    continue
+                if payload is None:
+                    payload = json.dumps({
+                        "time": time.isoformat(),
+                        "device_id": str(device_id),
+                        "metric_type": metric_type,
+                        "value": value,
+                    })
+                for consumer in consumers:
+                    consumer.offer(payload)
+
+    def publish_event(self, subscription_id: uuid.UUID, payload: str):
+        """Deliver a prepared JSON payload, e.g. an alert, to consumers of one subscription"""
+        for consumer in self._consumers.get(subscription_id, ()):
+            consumer.offer(payload)
+
+    def close_subscription(self, subscription_id: uuid.UUID, reason: str):
+        for consumer in list(self._consumers.get(subscription_id, ())):
+            consumer.close(reason)
+
+    @property
+    def consumers(self) -> int:
+        return len({consumer for consumers in self._consumers.values() for consumer in consumers})
+
+
+metric_broker = MetricBroker(queue_size=app_config.stream_queue_size, max_drops=app_config.stream_max_drops,
+                             index=subscription_index)
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import uuid
+from collections import deque
+from collections.abc import Iterator
+from contextlib import suppress
+from datetime import datetime
+
+import asyncpg
+from loguru import logger
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.config import app_config
+from src.db.database import driver_dsn
+from src.services.alerts import alert_engine, load_alert_rules
+from src.services.broker import MetricRecord, metric_broker
+from src.services.latest_cache import latest_cache
+from src.services.ownership import ownership_index
+from src.services.response_cache import response_cache
+from src.services.site_rollups import site_rollups
+from src.services.subscriptions import load_subscription_index, subscription_index
+
+METRICS_CHANNEL = "device_metrics"
+INVALIDATION_CHANNEL = "cache_invalidation"
+# postgres rejects NOTIFY payloads of 8000 bytes and more
+MAX_PAYLOAD_BYTES = 7_500
+# notifications sent by one round trip
+MAX_SEND_BATCH = 1_000
+# tells other workers that relayed readings were lost, caches built from readings are cleared
+RESYNC_PAYLOAD = json.dumps({"resync": True})
+
+SEND_NOTIFICATIONS = "SELECT pg_notify(channel, payload) FROM unnest($1::text[], $2::text[]) AS m(channel, payload)"
+
+
+def metric_payloads(records: list[MetricRecord]) -> Iterator[str]:
+    """Split readings into JSON arrays fitting into one NOTIFY payload"""
+    rows: list[str] = []
+    size = 0
+    for time, device_id, metric_type, value in records:
+        row = json.dumps([time.isoformat(), str(device_id), metric_type, value])
+        if rows and size + len(row) > MAX_PAYLOAD_BYTES:
+            yield f"[{','.join(rows)}]"
+            rows, size = [], 0
+        rows.append(row)
+        size += len(row) + 1
+    if rows:
+        yield f"[{','.join(rows)}]"
+
+
+class ClusterBridge:
+    """Relays ingested metrics and cache invalidations between workers over LISTEN/NOTIFY.
+
+    Every worker keeps one dedicated connection outside the pool, notifications sent by it are
+    skipped by its own listener. Notifications missed while the connection was down can't be
+    replayed, so local caches are cleared after reconnect.
+
+    Invalidations are never dropped, they wait in an unbounded queue until sent. Relayed readings
+    are bounded by queue_size, once some are dropped the other workers are asked to resync, i.e.
+    to clear caches built from readings.
+    """
+
+    def __init__(self, dsn: str, queue_size: int):
+        self._dsn = dsn
+        self._queue_size = queue_size
+        self._metrics: deque[str] = deque()
+        self._invalidations: deque[str] = deque()
+        self._resync = False
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._server_pid: int | None = None
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.reconnects = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        if self._task is None:
+            metric_broker.add_forwarder(self._forward_metrics)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        metric_broker.remove_forwarder(self._forward_metrics)
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    def invalidate_ownership(self, user_id: uuid.UUID):
+        """User's sites or devices changed"""
+        ownership_index.invalidate_user(user_id)
+        response_cache.invalidate_user(user_id)
+        self._invalidate(json.dumps({"user_id": str(user_id)}))
+
+    def invalidate_device(self, device_id: uuid.UUID):
+        latest_cache.invalidate_device(device_id)
+        self._invalidate(json.dumps({"device_id": str(device_id)}))
+
+    def invalidate_site(self, site_id: uuid.UUID):
+        site_rollups.invalidate_site(site_id)
+        self._invalidate(json.dumps({"site_id": str(site_id)}))
+
+    def add_alert_rule(self, rule: dict):
+        alert_engine.add_rule(rule)
+        self._invalidate(json.dumps({"alert_rule": rule}, default=str))
+
+    def remove_alert_rule(self, rule_id: uuid.UUID):
+        alert_engine.remove_rule(rule_id)
+        self._invalidate(json.dumps({"removed_alert_rule": str(rule_id)}))
+
+    def remove_subscription(self, subscription_id: uuid.UUID):
+        self._remove_subscription(subscription_id)
+        self._invalidate(json.dumps({"removed_subscription": str(subscription_id)}))
+
+    @staticmethod
+    def _remove_subscription(subscription_id: uuid.UUID):
+        subscription_index.remove(subscription_id)
+        alert_engine.remove_subscription(subscription_id)
+        metric_broker.close_subscription(subscription_id, "subscription deleted")
+
+    def _forward_metrics(self, records: list[MetricRecord]):
+        if self._task is None:
+            return
+        for payload in metric_payloads(records):
+            if len(self._metrics) >= self._queue_size:
+                self.dropped += 1
+                self._resync = True
+                continue
+            self._metrics.append(payload)
+        self._wakeup.set()
+
+    def _invalidate(self, payload: str):
+        if self._task is None:
+            return
+        self._invalidations.append(payload)
+        self._wakeup.set()
+
+    async def _run(self):
+        delay = 1
+        while True:
+            try:
+                connection = await asyncpg.connect(self._dsn)
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.error(f"Failed to open LISTEN connection, retry in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+
+            delay = 1
+            try:
+                self._server_pid = connection.get_server_pid()
+                await connection.add_listener(METRICS_CHANNEL, self._on_metrics)
+                await connection.add_listener(INVALIDATION_CHANNEL, self._on_invalidation)
+                if self.reconnects:
+                    latest_cache.clear()
+                    ownership_index.clear()
+                    response_cache.clear()
+                    site_rollups.clear()
+                    await load_subscription_index()
+                    await load_alert_rules()
+                await self._send_loop(connection)
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, SQLAlchemyError) as e:
+                logger.error(f"LISTEN connection failed: {e}")
+            finally:
+                connection.terminate()
+            self.reconnects += 1
+
+    async def _send_loop(self, connection: asyncpg.Connection):
+        while not connection.is_closed():
+            if not (self._invalidations or self._metrics or self._resync):
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), 1)
+                except TimeoutError:
+                    pass
+                continue
+
+            resync, self._resync = self._resync, False
+            messages = [(INVALIDATION_CHANNEL, RESYNC_PAYLOAD)] if resync else []
+            while self._invalidations and len(messages) < MAX_SEND_BATCH:
+                messages.append((INVALIDATION_CHANNEL, self._invalidations.popleft()))
+            while self._metrics and len(messages) < MAX_SEND_BATCH:
+                messages.append((METRICS_CHANNEL, self._metrics.popleft()))
+            channels, payloads = zip(*messages)
+            try:
+                await connection.execute(SEND_NOTIFICATIONS, list(channels), list(payloads))
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                # invalidations go out again after reconnect, lost readings are covered by a resync
+                invalidations = [payload for channel, payload in messages[resync:] if channel == INVALIDATION_CHANNEL]
+                self._invalidations.extendleft(reversed(invalidations))
+                lost_metrics = len(messages) - resync - len(invalidations)
+                self.dropped += lost_metrics
+                self._resync = resync or lost_metrics > 0
+                raise
+            self.sent += len(messages)
+            self.resyncs += resync
+
+    def _on_metrics(self, _connection, pid: int, _channel: str, payload: str):
+        if pid == self._server_pid:
+            return
+        self.received += 1
+        records = [
+            (datetime.fromisoformat(time), uuid.UUID(device_id), metric_type, value)
+            for time, device_id, metric_type, value in json.loads(payload)
+        ]
+        metric_broker.publish(records, forward=False)
+
+    def _on_invalidation(self, _connection, pid: int, _channel: str, payload: str):
+        if pid == self._server_pid:
+            return
+        self.received += 1
+        message = json.loads(payload)
+        if message.get("resync"):
+            latest_cache.clear()
+            site_rollups.clear()
+        if "user_id" in message:
+            ownership_index.invalidate_user(uuid.UUID(message["user_id"]))
+            response_cache.invalidate_user(uuid.UUID(message["user_id"]))
+        if "device_id" in message:
+            latest_cache.invalidate_device(uuid.UUID(message["device_id"]))
+        if "site_id" in message:
+            site_rollups.invalidate_site(uuid.UUID(message["site_id"]))
+        if "alert_rule" in message:
+            rule = message["alert_rule"]
+            alert_engine.add_rule({
+                **rule,
+                "id": uuid.UUID(rule["id"]),
+                "subscription_id": uuid.UUID(rule["subscription_id"]),
+                "device_id": uuid.UUID(rule["device_id"]),
+            })
+        if "removed_alert_rule" in message:
+            alert_engine.remove_rule(uuid.UUID(message["removed_alert_rule"]))
+        if "removed_subscription" in message:
+            self._remove_subscription(uuid.UUID(message["removed_subscription"]))
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued_metrics": len(self._metrics),
+            "queued_invalidations": len(self._invalidations),
+            "sent": self.sent,
+            "received": self.received,
+            "dropped": self.dropped,
+            "resyncs": self.resyncs,
+            "reconnects": self.reconnects,
+        }
+
+
+cluster_bridge = ClusterBridge(driver_dsn(app_config.dns), queue_size=app_config.cluster_queue_size)
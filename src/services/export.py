@@ -0,0 +1,119 @@
+import csv
+import io
+import json
+from collections.abc import AsyncIterator
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from src.services.broker import MetricRecord
+
+COLUMNS = ("time", "device_id", "metric_type", "value")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting bytes until drained, tell() keeps counting so writers compute correct offsets"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def csv_chunks(batches: AsyncIterator[list[MetricRecord]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    async for batch in batches:
+        writer.writerows((time.isoformat(), device_id, metric_type, value) for time, device_id, metric_type, value in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def ndjson_chunks(batches: AsyncIterator[list[MetricRecord]]) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield "".join(
+            json.dumps({"time": time.isoformat(), "device_id": str(device_id), "metric_type": metric_type, "value": value}) + "\n"
+            for time, device_id, metric_type, value in batch
+        ).encode()
+
+
+def _arrow_schema():
+    return pa.schema([
+        ("time", pa.timestamp("us", tz="UTC")),
+        ("device_id", pa.string()),
+        ("metric_type", pa.string()),
+        ("value", pa.float64()),
+    ])
+
+
+def _record_batch(schema, batch: list[MetricRecord]):
+    times, device_ids, metric_types, values = zip(*batch)
+    return pa.RecordBatch.from_arrays([
+        pa.array(times, type=schema.field("time").type),
+        pa.array([str(device_id) for device_id in device_ids], type=pa.string()),
+        pa.array(metric_types, type=pa.string()),
+        pa.array(values, type=pa.float64()),
+    ], schema=schema)
+
+
+async def parquet_chunks(batches: AsyncIterator[list[MetricRecord]]) -> AsyncIterator[bytes]:
+    """Every fetched batch becomes one row group, footer is written when the cursor is exhausted"""
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        async for batch in batches:
+            if batch:
+                writer.write_batch(_record_batch(schema, batch))
+                yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+async def arrow_chunks(batches: AsyncIterator[list[MetricRecord]]) -> AsyncIterator[bytes]:
+    """Arrow IPC stream format, readable batch by batch on the client side"""
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema)
+    try:
+        async for batch in batches:
+            if batch:
+                writer.write_batch(_record_batch(schema, batch))
+                yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+# format -> (encoder, media type, file extension, needs pyarrow)
+EXPORT_FORMATS = {
+    "csv": (csv_chunks, "text/csv", "csv", False),
+    "ndjson": (ndjson_chunks, "application/x-ndjson", "ndjson", False),
+    "parquet": (parquet_chunks, "application/vnd.apache.parquet", "parquet", True),
+    "arrow": (arrow_chunks, "application/vnd.apache.arrow.stream", "arrows", True),
+}
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+
+from loguru import logger
+
+from src.config import app_config
+from src.db.database import AsyncSessionFactory
+from src.db.metrics_repository import SQLAlchemyMetrics
+from src.services.broker import MetricRecord, metric_broker
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class IngestUnavailable(Exception):
+    pass
+
+
+class IngestBuffer:
+    """Write-behind buffer of metric readings.
+
+    Requests only append to a bounded in-memory queue, one flusher task writes the queue with a single
+    COPY once `batch_size` rows are pending or the oldest row waits `max_delay` seconds. Rows actually
+    inserted are published to the broker, duplicates of stored readings are not. Readings are acknowledged
+    before they are stored, rows of a batch failing after all retries are logged and dropped.
+    """
+
+    def __init__(self, writer: Callable[[list[MetricRecord]], Awaitable[list[MetricRecord]]], max_rows: int,
+                 batch_size: int, max_delay: float, retries: int):
+        self._writer = writer
+        self._max_rows = max_rows
+        self._batch_size = batch_size
+        self._max_delay = max_delay
+        self._retries = retries
+        self._pending: list[MetricRecord] = []
+        # [rows left, submitted at] per submit, so rows left behind by a batch keep their age
+        self._arrivals: deque[list] = deque()
+        self._ready = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self.accepted_rows = 0
+        self.written_rows = 0
+        self.failed_rows = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, records: list[MetricRecord]):
+        if self._stopping or self._task is None or self._task.done():
+            raise IngestUnavailable()
+        if len(self._pending) + len(records) > self._max_rows:
+            raise IngestQueueFull()
+        if not records:
+            return
+        self._arrivals.append([len(records), time.monotonic()])
+        self._pending.extend(records)
+        self.accepted_rows += len(records)
+        self._ready.set()
+        if len(self._pending) >= self._batch_size:
+            self._full.set()
+
+    async def stop(self, timeout: float):
+        """Stop accepting readings and write everything already queued."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._ready.set()
+        self._full.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except TimeoutError:
+            logger.error(f"Ingest buffer drain timed out, {len(self._pending)} readings were lost")
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            delay = self._arrivals[0][1] + self._max_delay - time.monotonic() if self._arrivals else 0
+            if delay > 0 and not self._full.is_set():
+                try:
+                    await asyncio.wait_for(self._full.wait(), delay)
+                except TimeoutError:
+                    pass
+
+            batch = self._pending[:self._batch_size]
+            del self._pending[:self._batch_size]
+            self._take_arrivals(len(batch))
+            if len(self._pending) < self._batch_size and not self._stopping:
+                self._full.clear()
+            if not self._pending:
+                if self._stopping:
+                    await self._flush(batch)
+                    return
+                self._ready.clear()
+            await self._flush(batch)
+
+    def _take_arrivals(self, rows: int):
+        while rows and self._arrivals:
+            arrival = self._arrivals[0]
+            taken = min(rows, arrival[0])
+            arrival[0] -= taken
+            rows -= taken
+            if not arrival[0]:
+                self._arrivals.popleft()
+
+    async def _flush(self, batch: list[MetricRecord]):
+        if not batch:
+            return
+        started = time.perf_counter()
+        for attempt in range(self._retries + 1):
+            try:
+                inserted = await self._writer(batch)
+                break
+            except Exception as e:
+                if attempt == self._retries:
+                    self.failed_rows += len(batch)
+                    logger.error(f"Failed to write {len(batch)} buffered readings: {e}")
+                    return
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        self.written_rows += len(inserted)
+        self.flushes += 1
+        self.flush_seconds += time.perf_counter() - started
+        metric_broker.publish(inserted)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "pending_rows": len(self._pending),
+            "max_rows": self._max_rows,
+            "accepted_rows": self.accepted_rows,
+            "written_rows": self.written_rows,
+            "failed_rows": self.failed_rows,
+            "flushes": self.flushes,
+            "avg_batch_rows": self.written_rows / self.flushes if self.flushes else None,
+            "avg_flush_seconds": self.flush_seconds / self.flushes if self.flushes else None,
+        }
+
+
+async def write_metrics(records: list[MetricRecord]) -> list[MetricRecord]:
+    async with AsyncSessionFactory() as session:
+        return await SQLAlchemyMetrics(session).insert_metrics(records)
+
+
+ingest_buffer = IngestBuffer(
+    write_metrics,
+    max_rows=app_config.ingest_queue_rows,
+    batch_size=app_config.ingest_batch_rows,
+    max_delay=app_config.ingest_flush_ms / 1000,
+    retries=app_config.ingest_flush_retries,
+)
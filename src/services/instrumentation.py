@@ -0,0 +1,227 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.config import app_config
+
+# pool pre-ping and similar statements which are not issued by the application
+IGNORED_STATEMENTS = {";", "SELECT 1"}
+# transaction control sent by SQLAlchemy and asyncpg around every unit of work, e.g. 'BEGIN ISOLATION LEVEL ...'
+IGNORED_PREFIXES = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "START TRANSACTION")
+# only these are safe to EXPLAIN, plain EXPLAIN doesn't execute them anyway
+EXPLAINABLE_PREFIXES = ("SELECT", "WITH")
+
+QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Duration of one database statement", ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "Database statements executed by one request", ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500),
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_duration_seconds", "Database time spent by one request", ["method", "route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+@dataclass
+class RequestQueries:
+    """Statements executed on behalf of one request"""
+    count: int = 0
+    seconds: float = 0.0
+    slowest_seconds: float = 0.0
+    slowest_statement: str | None = None
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+
+current_queries: ContextVar[RequestQueries | None] = ContextVar("current_queries", default=None)
+
+
+class SlowQueryLog:
+    """Logs statements over threshold with their EXPLAIN plan.
+
+    Plans are fetched in background on a pooled connection, every statement at most once per interval.
+    """
+
+    def __init__(self, engine: AsyncEngine, threshold_seconds: float, explain: bool, interval_seconds: float):
+        self._engine = engine
+        self.threshold_seconds = threshold_seconds
+        self._explain = explain
+        self._interval_seconds = interval_seconds
+        self._last_logged: dict[str, float] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def observe(self, statement: str, parameters, seconds: float):
+        if seconds < self.threshold_seconds:
+            return
+        now = time.monotonic()
+        if now - self._last_logged.get(statement, -self._interval_seconds) < self._interval_seconds:
+            return
+        self._last_logged[statement] = now
+        if not self._explain or not statement.lstrip().upper().startswith(EXPLAINABLE_PREFIXES):
+            logger.warning(f"slow query {seconds * 1000:.1f} ms: {statement}")
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._log_plan(statement, parameters, seconds))
+        except RuntimeError:
+            return
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _log_plan(self, statement: str, parameters, seconds: float):
+        token = current_queries.set(None)
+        try:
+            async with self._engine.connect() as connection:
+                raw_connection = await connection.get_raw_connection()
+                rows = await raw_connection.driver_connection.fetch(f"EXPLAIN {statement}", *(parameters or ()))
+            plan = "\n".join(row[0] for row in rows)
+            logger.warning(f"slow query {seconds * 1000:.1f} ms: {statement}\n{plan}")
+        except Exception as e:
+            logger.warning(f"slow query {seconds * 1000:.1f} ms: {statement} (EXPLAIN failed: {e})")
+        finally:
+            current_queries.reset(token)
+
+
+def _operation(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else ""
+
+
+def _ignored(statement: str) -> bool:
+    statement = statement.strip()
+    return statement in IGNORED_STATEMENTS or statement[:20].upper().startswith(IGNORED_PREFIXES)
+
+
+def record_query(statement: str, parameters, seconds: float, slow_log: SlowQueryLog | None):
+    if _ignored(statement):
+        return
+    QUERY_SECONDS.labels(_operation(statement)).observe(seconds)
+    queries = current_queries.get()
+    if queries is not None:
+        queries.record(statement, seconds)
+    if slow_log is not None:
+        slow_log.observe(statement, parameters, seconds)
+
+
+def install_query_hooks(engine: AsyncEngine, slow_log: SlowQueryLog | None):
+    """Time every statement of the engine, both ORM ones and those sent straight to asyncpg connections"""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_started"].pop()
+        record_query(statement, parameters, seconds, slow_log)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+
+    # raw asyncpg paths (repository backend, ingest merge) bypass cursor events, prepared statements
+    # of SQLAlchemy are not reported by asyncpg query logger, so nothing is counted twice
+    @event.listens_for(sync_engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        def log_query(record):
+            record_query(record.query, record.args, record.elapsed, slow_log)
+        dbapi_connection.driver_connection.add_query_logger(log_query)
+
+
+# set by install_instrumentation, None while statements are not instrumented
+slow_query_log: SlowQueryLog | None = None
+
+
+@contextmanager
+def timed_statement(statement: str):
+    """Times statements asyncpg query logger doesn't see, COPY in particular"""
+    if slow_query_log is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_query(statement, None, time.perf_counter() - started, slow_query_log)
+
+
+def _server_timing(queries: RequestQueries, total_seconds: float) -> str:
+    return (f'db;dur={queries.seconds * 1000:.3f};desc="{queries.count} queries", '
+            f'db-slowest;dur={queries.slowest_seconds * 1000:.3f}, '
+            f'app;dur={total_seconds * 1000:.3f}')
+
+
+class QueryTimingMiddleware:
+    """Attaches database statement count and time of each request as Server-Timing header and histograms"""
+
+    def __init__(self, app: ASGIApp, warn_queries: int):
+        self.app = app
+        self._warn_queries = warn_queries
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        queries = RequestQueries()
+        token = current_queries.set(queries)
+        started = time.perf_counter()
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(queries, time.perf_counter() - started).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_queries.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                path = getattr(route, "path", scope["path"])
+                REQUEST_QUERIES.labels(scope["method"], path).observe(queries.count)
+                REQUEST_DB_SECONDS.labels(scope["method"], path).observe(queries.seconds)
+                if queries.count > self._warn_queries:
+                    logger.warning(f"{scope['method']} {path} executed {queries.count} queries, "
+                                   f"slowest {queries.slowest_seconds * 1000:.1f} ms: {queries.slowest_statement}")
+
+
+def prometheus_exposition() -> tuple[bytes, str]:
+    """Current metrics, merged over workers when PROMETHEUS_MULTIPROC_DIR is set"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def install_instrumentation(engine: AsyncEngine):
+    global slow_query_log
+    slow_query_log = slow_log = SlowQueryLog(
+        engine,
+        threshold_seconds=app_config.slow_query_ms / 1000,
+        explain=app_config.explain_slow_queries,
+        interval_seconds=app_config.slow_query_log_interval_seconds,
+    )
+    install_query_hooks(engine, slow_log)
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from collections.abc import Iterable
+from datetime import datetime
+
+from src.config import app_config
+from src.services.broker import MetricRecord, StreamKey, metric_broker
+
+
+class LatestValueCache:
+    """LRU cache of the newest (time, value) per (device_id, metric_type).
+
+    Kept up to date by the ingest path, older readings never replace newer ones.
+    """
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: OrderedDict[StreamKey, tuple[datetime, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: StreamKey) -> tuple[datetime, float] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def get_many(self, keys: Iterable[StreamKey]) -> tuple[dict[StreamKey, tuple[datetime, float]], list[StreamKey]]:
+        """Split keys to cached entries and the ones which has to be loaded from DB"""
+        found, missing = {}, []
+        for key in keys:
+            entry = self.get(key)
+            if entry is None:
+                missing.append(key)
+            else:
+                found[key] = entry
+        return found, missing
+
+    def update(self, records: Iterable[MetricRecord]):
+        entries = self._entries
+        for time, device_id, metric_type, value in records:
+            key = (device_id, metric_type)
+            current = entries.get(key)
+            if current is not None:
+                # same time conflicts are skipped by the insert, so the stored value stays
+                if current[0] >= time:
+                    continue
+                entries.move_to_end(key)
+            entries[key] = (time, value)
+
+        while len(entries) > self._max_entries:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_device(self, device_id):
+        for key in [key for key in self._entries if key[0] == device_id]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self._max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+        }
+
+
+latest_cache = LatestValueCache(max_entries=app_config.latest_cache_size)
+metric_broker.add_listener(latest_cache.update)
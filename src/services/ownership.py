@@ -0,0 +1,93 @@
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass, field
+
+from fastapi import Depends, HTTPException, status
+
+from src.config import app_config
+from src.db.database import RepositoryContainer, get_db
+from src.dependencies import UserClaims, decode_jwt_token
+
+OwnershipLoader = Callable[[uuid.UUID], Awaitable[list[tuple[uuid.UUID, uuid.UUID | None]]]]
+
+
+@dataclass
+class UserOwnership:
+    """Sites and devices of one user, every authorization decision is a set lookup"""
+    user_id: uuid.UUID
+    sites: set[uuid.UUID] = field(default_factory=set)
+    devices: dict[uuid.UUID, uuid.UUID] = field(default_factory=dict)  # device_id -> site_id
+    loaded_at: float = 0.0
+
+    def require_site(self, site_id: uuid.UUID):
+        if site_id not in self.sites:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"site with id: {site_id} was not found")
+
+    def require_device(self, device_id: uuid.UUID):
+        if device_id not in self.devices:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"device with id: {device_id} was not found")
+
+    def require_devices(self, device_ids: Iterable[uuid.UUID]):
+        invalid_device_ids = [device_id for device_id in device_ids if device_id not in self.devices]
+        if invalid_device_ids:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Didn't find valid device_id: {invalid_device_ids}")
+
+
+class OwnershipIndex:
+    """LRU of loaded user ownerships.
+
+    Local writes invalidate the owner right away, entries expire after ttl so writes done
+    by other workers are picked up too.
+    """
+
+    def __init__(self, ttl_seconds: int, max_users: int):
+        self._ttl_seconds = ttl_seconds
+        self._max_users = max_users
+        self._users: OrderedDict[uuid.UUID, UserOwnership] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, user_id: uuid.UUID, loader: OwnershipLoader) -> UserOwnership:
+        ownership = self._users.get(user_id)
+        if ownership is not None and time.monotonic() - ownership.loaded_at < self._ttl_seconds:
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return ownership
+
+        self.misses += 1
+        ownership = UserOwnership(user_id=user_id, loaded_at=time.monotonic())
+        for site_id, device_id in await loader(user_id):
+            ownership.sites.add(site_id)
+            if device_id is not None:
+                ownership.devices[device_id] = site_id
+
+        self._users[user_id] = ownership
+        self._users.move_to_end(user_id)
+        if len(self._users) > self._max_users:
+            self._users.popitem(last=False)
+        return ownership
+
+    def invalidate_user(self, user_id: uuid.UUID):
+        self._users.pop(user_id, None)
+
+    def clear(self):
+        self._users.clear()
+
+    def stats(self) -> dict:
+        return {"users": len(self._users), "hits": self.hits, "misses": self.misses}
+
+
+ownership_index = OwnershipIndex(ttl_seconds=app_config.ownership_ttl_seconds, max_users=app_config.ownership_max_users)
+
+
+async def load_ownership(user: UserClaims, db: RepositoryContainer) -> UserOwnership:
+    return await ownership_index.get(uuid.UUID(user.id), db.sites.get_user_ownership)
+
+
+async def get_ownership(
+        user: UserClaims = Depends(decode_jwt_token),
+        db: RepositoryContainer = Depends(get_db)
+) -> UserOwnership:
+    return await load_ownership(user, db)
@@ -0,0 +1,98 @@
+import asyncio
+import gc
+import time
+from contextlib import suppress
+
+from prometheus_client import Gauge, Histogram
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to the last byte of the response", ["method", "route", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being handled right now", multiprocess_mode="livesum",
+)
+LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds", "Delay of a timer callback behind its schedule, i.e. time the loop was blocked",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+GC_PAUSE_SECONDS = Histogram(
+    "python_gc_pause_seconds", "Duration of garbage collector runs", ["generation"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+
+
+class RequestMetricsMiddleware:
+    """Latency histogram per route and in-flight gauge, streamed responses are measured to their last chunk"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            # unmatched paths would blow up label cardinality
+            path = getattr(route, "path", "unmatched")
+            REQUEST_SECONDS.labels(scope["method"], path, str(status)).observe(time.perf_counter() - started)
+
+
+class LoopLagMonitor:
+    """Wakes up every interval and records how late it was"""
+
+    def __init__(self, interval_seconds: float):
+        self._interval_seconds = interval_seconds
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self._interval_seconds
+            await asyncio.sleep(self._interval_seconds)
+            LOOP_LAG_SECONDS.observe(max(loop.time() - scheduled, 0.0))
+
+
+_gc_started: float | None = None
+
+
+def _gc_callback(phase: str, info: dict):
+    global _gc_started
+    if phase == "start":
+        _gc_started = time.perf_counter()
+    elif _gc_started is not None:
+        GC_PAUSE_SECONDS.labels(str(info["generation"])).observe(time.perf_counter() - _gc_started)
+        _gc_started = None
+
+
+def install_gc_metrics():
+    if _gc_callback not in gc.callbacks:
+        gc.callbacks.append(_gc_callback)
@@ -0,0 +1,129 @@
+import asyncio
+import html
+import os
+import sys
+import threading
+import zlib
+from collections import Counter
+from types import FrameType
+
+# frames of the event loop waiting for IO are reported under this name
+IDLE_FRAME = "(idle)"
+IDLE_FUNCTIONS = {"select", "poll"}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)})"
+
+
+def _fold(frame: FrameType | None) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    if names and _is_idle(names[-1]):
+        names.append(IDLE_FRAME)
+    return ";".join(names)
+
+
+def _is_idle(name: str) -> bool:
+    return name.split(" ", 1)[0].rsplit(".", 1)[-1] in IDLE_FUNCTIONS
+
+
+class SamplingProfiler:
+    """Samples stack of the event loop thread from a helper thread.
+
+    Nothing runs between profiles, while profiling the cost is one stack walk per interval.
+    The sampler needs the GIL, so code blocking the loop for less than the interpreter switch
+    interval (5 ms) tends to be attributed to the following IO wait.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    async def profile(self, seconds: float, interval_seconds: float) -> Counter[str]:
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            stacks: Counter[str] = Counter()
+            stop = threading.Event()
+            sampler = threading.Thread(
+                target=self._sample, args=(threading.get_ident(), stacks, stop, interval_seconds),
+                name="sampling-profiler", daemon=True,
+            )
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                await asyncio.to_thread(sampler.join)
+            return stacks
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _sample(thread_id: int, stacks: Counter[str], stop: threading.Event, interval_seconds: float):
+        while not stop.wait(interval_seconds):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[_fold(frame)] += 1
+
+
+def folded(stacks: Counter[str]) -> str:
+    """Brendan Gregg's folded format, input of flamegraph.pl, speedscope and others"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def flamegraph_svg(stacks: Counter[str], title: str, width: int = 1200, frame_height: int = 16) -> str:
+    """Self-contained SVG flamegraph, hover shows function and share of samples"""
+    root: dict = {"count": 0, "children": {}}
+    for stack, count in stacks.items():
+        root["count"] += count
+        node = root
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"count": 0, "children": {}})
+            node["count"] += count
+
+    total = root["count"] or 1
+    frames: list[tuple[str, int, float, float, int]] = []
+
+    def layout(node: dict, x: float, depth: int):
+        for name, child in sorted(node["children"].items()):
+            child_width = child["count"] / total * width
+            # frames narrower than half a pixel are not drawn, nor their callees
+            if child_width >= 0.5:
+                frames.append((name, child["count"], x, child_width, depth))
+                layout(child, x, depth + 1)
+            x += child_width
+
+    layout(root, 0.0, 0)
+    depth_max = max((frame[4] for frame in frames), default=0)
+    height = (depth_max + 2) * frame_height
+
+    elements = []
+    for name, count, x, frame_width, depth in frames:
+        # root at the bottom like classic flamegraphs
+        y = (depth_max - depth) * frame_height
+        label = html.escape(name)
+        color = "hsl(0,0%,85%)" if name == IDLE_FRAME else f"hsl({10 + zlib.crc32(name.encode()) % 45},80%,60%)"
+        # nested svg clips the label to its frame
+        elements.append(
+            f'<svg x="{x:.1f}" y="{y}" width="{frame_width:.1f}" height="{frame_height - 1}">'
+            f'<title>{label} ({count} samples, {count / total * 100:.1f}%)</title>'
+            f'<rect width="100%" height="100%" fill="{color}"/>'
+            f'<text x="3" y="{frame_height - 5}" font-size="11">{label}</text></svg>'
+        )
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace">'
+        f'{"".join(elements)}'
+        f'<text x="3" y="{height - 4}" font-size="12">{html.escape(title)}, {total} samples</text></svg>'
+    )
+
+
+sampling_profiler = SamplingProfiler()
@@ -0,0 +1,146 @@
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass
+from typing import Any
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+from src.config import app_config
+
+# bumped when serialization of cached routes changes, so validators issued before stop matching
+REPRESENTATION_VERSION = 1
+# browsers and proxies may keep the body but have to revalidate it on every use
+CACHE_CONTROL = "private, no-cache"
+
+# (rows to serialize, ETag, extra headers such as pagination ones)
+Loaded = tuple[Any, str, dict[str, str]]
+ResponseKey = tuple[str, str, tuple[tuple[str, str], ...]]
+
+
+def entity_etag(rows: Iterable, *params: Any) -> str:
+    """Strong ETag of a representation made of rows, each row is versioned by its updated_at.
+
+    Params which shape the representation without being part of the rows (e.g. page size) are hashed too.
+    """
+    digest = hashlib.blake2b(repr((REPRESENTATION_VERSION, params)).encode(), digest_size=16)
+    for row in rows:
+        digest.update(row.id.bytes)
+        digest.update(str(row.updated_at).encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # If-None-Match uses weak comparison
+    return any(tag.strip().removeprefix("W/") in (etag, "*") for tag in header.split(","))
+
+
+def json_renderer(response_model: Any) -> Callable[[Any], bytes]:
+    """Serializes rows the same way FastAPI does for response_model"""
+    adapter = TypeAdapter(response_model)
+    return lambda rows: adapter.dump_json(adapter.validate_python(rows, from_attributes=True), by_alias=True)
+
+
+@dataclass
+class CachedResponse:
+    etag: str
+    headers: dict[str, str]
+    stored_at: float
+    rows: Any
+    render: Callable[[Any], bytes]
+    body: bytes | None = None
+
+    def content(self) -> bytes:
+        if self.body is None:
+            self.body = self.render(self.rows)
+            self.rows = None
+        return self.body
+
+
+class ResponseCache:
+    """LRU of GET responses per user and request URL, answers If-None-Match with 304.
+
+    Entries keep fetched rows and serialize them on the first request which needs the body, so
+    revalidations answered by 304 never pay for serialization. Writes of user's sites and devices
+    drop all entries of the user, entries expire after ttl so writes done by other workers are picked up too.
+    """
+
+    def __init__(self, enabled: bool, ttl_seconds: int, max_entries: int):
+        self._enabled = enabled
+        self._ttl_seconds = ttl_seconds
+        self._max_entries = max_entries
+        self._entries: OrderedDict[tuple[uuid.UUID, ResponseKey], CachedResponse] = OrderedDict()
+        self._user_keys: dict[uuid.UUID, set[ResponseKey]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    async def respond(self, request: Request, user_id: uuid.UUID, load: Callable[[], Awaitable[Loaded]],
+                      render: Callable[[Any], bytes]) -> Response:
+        key = (request.url.netloc, request.url.path, tuple(sorted(request.query_params.multi_items())))
+        entry = self._get(user_id, key)
+        if entry is None:
+            rows, etag, headers = await load()
+            entry = CachedResponse(etag=etag, headers=headers, stored_at=time.monotonic(), rows=rows, render=render)
+            if self._enabled:
+                self._put(user_id, key, entry)
+
+        headers = {"ETag": entry.etag, "Cache-Control": CACHE_CONTROL}
+        if etag_matches(request, entry.etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(entry.content(), media_type="application/json", headers={**entry.headers, **headers})
+
+    def _get(self, user_id: uuid.UUID, key: ResponseKey) -> CachedResponse | None:
+        entry = self._entries.get((user_id, key))
+        if entry is not None and time.monotonic() - entry.stored_at < self._ttl_seconds:
+            self._entries.move_to_end((user_id, key))
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def _put(self, user_id: uuid.UUID, key: ResponseKey, entry: CachedResponse):
+        self._entries[(user_id, key)] = entry
+        self._entries.move_to_end((user_id, key))
+        self._user_keys.setdefault(user_id, set()).add(key)
+        if len(self._entries) > self._max_entries:
+            (evicted_user, evicted_key), _ = self._entries.popitem(last=False)
+            self._discard_key(evicted_user, evicted_key)
+
+    def _discard_key(self, user_id: uuid.UUID, key: ResponseKey):
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+    def invalidate_user(self, user_id: uuid.UUID):
+        for key in self._user_keys.pop(user_id, ()):
+            self._entries.pop((user_id, key), None)
+
+    def clear(self):
+        self._entries.clear()
+        self._user_keys.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+response_cache = ResponseCache(
+    enabled=app_config.response_cache_enabled,
+    ttl_seconds=app_config.response_cache_ttl_seconds,
+    max_entries=app_config.response_cache_max_entries,
+)
@@ -0,0 +1,281 @@
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from src.config import app_config
+from src.db.repository import MetricsRepository
+from src.models import METRIC_TYPE_TO_UNIT, DeviceType
+from src.services.broker import MetricRecord, StreamKey, metric_broker
+
+MINUTE = 60
+HOUR = 3_600
+
+
+@dataclass(frozen=True)
+class SiteQuantity:
+    """Site level figure combined from one metric of given device types.
+
+    'sum' adds up mean of every device (e.g. power of all generators), 'avg' and 'max'
+    are taken over all readings of the window.
+    """
+    name: str
+    device_types: frozenset[DeviceType]
+    metric: METRIC_TYPE_TO_UNIT
+    combine: str
+
+    @property
+    def metric_type(self) -> str:
+        return self.metric.name.lower()
+
+    @property
+    def unit(self) -> str:
+        return self.metric.value
+
+
+SITE_QUANTITIES = (
+    SiteQuantity("production", frozenset({DeviceType.SOLAR_PANEL, DeviceType.WIND_TURBINES}),
+                 METRIC_TYPE_TO_UNIT.POWER_OUTPUT, "sum"),
+    SiteQuantity("battery_charge", frozenset({DeviceType.BATTERY}), METRIC_TYPE_TO_UNIT.CHARGE_LEVEL, "avg"),
+    SiteQuantity("inverter_temperature", frozenset({DeviceType.INVERTER}), METRIC_TYPE_TO_UNIT.TEMPERATURE, "max"),
+)
+# (device type as stored in devices.type, metric_type) -> quantity the series contributes to
+SERIES_QUANTITIES = {
+    (device_type.value, quantity.metric_type): quantity
+    for quantity in SITE_QUANTITIES
+    for device_type in quantity.device_types
+}
+ROLLUP_METRIC_TYPES = sorted({quantity.metric_type for quantity in SITE_QUANTITIES})
+
+
+@dataclass(frozen=True)
+class SummaryWindow:
+    """Trailing window made of whole buckets including the current one, seconds 0 means latest readings"""
+    name: str
+    seconds: int
+    bucket_seconds: int
+
+
+SUMMARY_WINDOWS = (
+    SummaryWindow("now", 0, 0),
+    SummaryWindow("15m", 15 * MINUTE, MINUTE),
+    SummaryWindow("1h", HOUR, MINUTE),
+    SummaryWindow("1d", 24 * HOUR, HOUR),
+)
+# bucket width -> how long its buckets are kept, i.e. the longest window built from them
+BUCKET_RETENTION = {
+    width: max(window.seconds for window in SUMMARY_WINDOWS if window.bucket_seconds == width)
+    for width in {window.bucket_seconds for window in SUMMARY_WINDOWS if window.seconds}
+}
+
+
+def _bucket_start(timestamp: float, width: int) -> int:
+    return int(timestamp // width) * width
+
+
+@dataclass(slots=True)
+class Bucket:
+    sum: float
+    count: int
+    max: float
+
+    def add(self, value: float):
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+
+class SeriesRollup:
+    """Buckets and latest reading of one (device_id, metric_type)"""
+
+    __slots__ = ("buckets", "latest")
+
+    def __init__(self):
+        self.buckets: dict[int, dict[int, Bucket]] = {width: {} for width in BUCKET_RETENTION}
+        self.latest: tuple[datetime, float] | None = None
+
+    def add(self, reading_time: datetime, value: float):
+        timestamp = reading_time.timestamp()
+        for width, retention in BUCKET_RETENTION.items():
+            buckets = self.buckets[width]
+            start = _bucket_start(timestamp, width)
+            bucket = buckets.get(start)
+            if bucket is not None:
+                bucket.add(value)
+                continue
+            # a new bucket is the moment to expire those which left the longest window
+            for expired in [expired for expired in buckets if expired <= start - retention]:
+                del buckets[expired]
+            buckets[start] = Bucket(value, 1, value)
+        if self.latest is None or self.latest[0] <= reading_time:
+            self.latest = (reading_time, value)
+
+    def merge(self, width: int, start: datetime, total: float, count: int, maximum: float):
+        """Bucket aggregated by the database"""
+        self.buckets[width][_bucket_start(start.timestamp(), width)] = Bucket(total, count, maximum)
+
+    def window(self, window: SummaryWindow, now: float) -> Bucket | None:
+        since = _bucket_start(now, window.bucket_seconds) - window.seconds + window.bucket_seconds
+        total = Bucket(0.0, 0, float("-inf"))
+        for start, bucket in self.buckets[window.bucket_seconds].items():
+            if start >= since:
+                total.sum += bucket.sum
+                total.count += bucket.count
+                total.max = max(total.max, bucket.max)
+        return total if total.count else None
+
+
+def _combine(quantity: SiteQuantity, values: list[float]) -> float | None:
+    if not values:
+        return None
+    if quantity.combine == "sum":
+        return sum(values)
+    if quantity.combine == "max":
+        return max(values)
+    return sum(values) / len(values)
+
+
+@dataclass
+class SiteRollup:
+    site_id: uuid.UUID
+    loaded_at: float
+    series: dict[StreamKey, SeriesRollup] = field(default_factory=dict)
+    quantities: dict[str, list[SeriesRollup]] = field(default_factory=dict)
+    # bumped by every ingested reading, summary is recomputed when it or the current minute changes
+    version: int = 0
+    _summary_key: tuple[int, int] | None = None
+    _summary: dict | None = None
+
+    def register(self, device_id: uuid.UUID, device_type: str, metric_type: str) -> SeriesRollup | None:
+        key = (device_id, metric_type)
+        series = self.series.get(key)
+        if series is None:
+            quantity = SERIES_QUANTITIES.get((device_type, metric_type))
+            if quantity is None:
+                return None
+            series = self.series[key] = SeriesRollup()
+            self.quantities.setdefault(quantity.name, []).append(series)
+        return series
+
+    def summary(self, now: float) -> dict:
+        key = (self.version, _bucket_start(now, MINUTE))
+        if key == self._summary_key:
+            return self._summary
+
+        windows = {}
+        for window in SUMMARY_WINDOWS:
+            windows[window.name] = {
+                quantity.name: self._quantity(quantity, window, now) for quantity in SITE_QUANTITIES
+            }
+        latest = [series.latest[0] for series in self.series.values() if series.latest is not None]
+        self._summary_key = key
+        self._summary = {"site_id": self.site_id, "updated_at": max(latest, default=None), "windows": windows}
+        return self._summary
+
+    def _quantity(self, quantity: SiteQuantity, window: SummaryWindow, now: float) -> dict:
+        series_list = self.quantities.get(quantity.name, [])
+        if not window.seconds:
+            values = [series.latest[1] for series in series_list if series.latest is not None]
+            return {"value": _combine(quantity, values), "unit": quantity.unit, "devices": len(values)}
+
+        buckets = [bucket for bucket in (series.window(window, now) for series in series_list) if bucket]
+        if not buckets:
+            value = None
+        elif quantity.combine == "sum":
+            value = sum(bucket.sum / bucket.count for bucket in buckets)
+        elif quantity.combine == "max":
+            value = max(bucket.max for bucket in buckets)
+        else:
+            value = sum(bucket.sum for bucket in buckets) / sum(bucket.count for bucket in buckets)
+        return {"value": value, "unit": quantity.unit, "devices": len(buckets)}
+
+
+class SiteRollups:
+    """Per-site production, battery and inverter figures over trailing windows.
+
+    A site is loaded from continuous aggregates on its first summary request, afterwards every
+    ingested reading updates its buckets through one dict lookup. Sites expire after ttl, so devices
+    added by other workers and readings missed meanwhile are picked up by the reload.
+    """
+
+    def __init__(self, ttl_seconds: int, max_sites: int):
+        self._ttl_seconds = ttl_seconds
+        self._max_sites = max_sites
+        self._sites: OrderedDict[uuid.UUID, SiteRollup] = OrderedDict()
+        self._series: dict[StreamKey, tuple[SiteRollup, SeriesRollup]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def summary(self, site_id: uuid.UUID, metrics: MetricsRepository) -> dict:
+        site = self._sites.get(site_id)
+        if site is not None and time.monotonic() - site.loaded_at < self._ttl_seconds:
+            self._sites.move_to_end(site_id)
+            self.hits += 1
+        else:
+            self.misses += 1
+            site = await self._load(site_id, metrics)
+            self._add(site)
+        return site.summary(time.time())
+
+    async def _load(self, site_id: uuid.UUID, metrics: MetricsRepository) -> SiteRollup:
+        site = SiteRollup(site_id=site_id, loaded_at=time.monotonic())
+        now = datetime.now(timezone.utc)
+        for width, retention in BUCKET_RETENTION.items():
+            start_time = datetime.fromtimestamp(_bucket_start(now.timestamp(), width) - retention + width, timezone.utc)
+            rows = await metrics.get_site_metric_buckets(
+                site_id=site_id, metric_types=ROLLUP_METRIC_TYPES,
+                bucket_width=timedelta(seconds=width), start_time=start_time,
+            )
+            for row in rows:
+                series = site.register(row["device_id"], row["device_type"], row["metric_type"])
+                if series is not None:
+                    series.merge(width, row["bucket"], row["sum"], row["count"], row["max"])
+
+        # devices silent for the whole longest window are left out, their latest reading is stale anyway
+        for metric in await metrics.get_site_latest_metrics(site_id=site_id, metric_types=ROLLUP_METRIC_TYPES):
+            series = site.series.get((metric.device_id, metric.metric_type))
+            if series is not None:
+                series.latest = (metric.time, metric.value)
+        return site
+
+    def _add(self, site: SiteRollup):
+        self.invalidate_site(site.site_id)
+        self._sites[site.site_id] = site
+        for key, series in site.series.items():
+            self._series[key] = (site, series)
+        if len(self._sites) > self._max_sites:
+            self.invalidate_site(next(iter(self._sites)))
+
+    def update(self, records: Iterable[MetricRecord]):
+        index = self._series
+        if not index:
+            return
+        for reading_time, device_id, metric_type, value in records:
+            entry = index.get((device_id, metric_type))
+            if entry is None:
+                continue
+            site, series = entry
+            series.add(reading_time, value)
+            site.version += 1
+
+    def invalidate_site(self, site_id: uuid.UUID):
+        site = self._sites.pop(site_id, None)
+        if site is None:
+            return
+        for key in site.series:
+            if self._series.get(key, (None,))[0] is site:
+                del self._series[key]
+
+    def clear(self):
+        self._sites.clear()
+        self._series.clear()
+
+    def stats(self) -> dict:
+        return {"sites": len(self._sites), "series": len(self._series), "hits": self.hits, "misses": self.misses}
+
+
+site_rollups = SiteRollups(ttl_seconds=app_config.site_rollup_ttl_seconds, max_sites=app_config.site_rollup_max_sites)
+metric_broker.add_listener(site_rollups.update)
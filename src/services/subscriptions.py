@@ -0,0 +1,84 @@
+import uuid
+from collections.abc import Iterable, Set
+
+from loguru import logger
+
+from src.db.database import AsyncSessionFactory
+from src.db.metrics_repository import SQLAlchemyMetrics
+from src.models import WILDCARD
+
+# (device_id, metric_type) of a subscription
+SubscriptionKey = tuple[uuid.UUID, str]
+_NONE: frozenset[uuid.UUID] = frozenset()
+
+
+class SubscriptionIndex:
+    """Inverted index (device_id, metric_type) -> subscription ids.
+
+    Wildcard subscriptions are indexed under (device_id, '*'), matching a reading costs two
+    dict lookups no matter how many subscriptions exist.
+    """
+
+    def __init__(self):
+        self._by_key: dict[SubscriptionKey, set[uuid.UUID]] = {}
+        self._keys: dict[uuid.UUID, SubscriptionKey] = {}
+
+    def load(self, rows: Iterable[tuple[uuid.UUID, uuid.UUID, str]]):
+        self._by_key, self._keys = {}, {}
+        self.add_many(rows)
+        logger.info(f"Loaded {len(self._keys)} subscriptions into index")
+
+    def add(self, subscription_id: uuid.UUID, device_id: uuid.UUID, metric_type: str):
+        key = (device_id, metric_type)
+        current = self._keys.get(subscription_id)
+        if current == key:
+            return
+        if current is not None:
+            self.remove(subscription_id)
+        self._keys[subscription_id] = key
+        self._by_key.setdefault(key, set()).add(subscription_id)
+
+    def add_many(self, rows: Iterable[tuple[uuid.UUID, uuid.UUID, str]]):
+        for subscription_id, device_id, metric_type in rows:
+            self.add(subscription_id, device_id, metric_type)
+
+    def remove(self, subscription_id: uuid.UUID):
+        key = self._keys.pop(subscription_id, None)
+        if key is None:
+            return
+        subscription_ids = self._by_key[key]
+        subscription_ids.discard(subscription_id)
+        if not subscription_ids:
+            del self._by_key[key]
+
+    def get(self, subscription_id: uuid.UUID) -> SubscriptionKey | None:
+        return self._keys.get(subscription_id)
+
+    def match(self, device_id: uuid.UUID, metric_type: str) -> Set[uuid.UUID]:
+        """Subscriptions receiving given reading, the returned set must not be modified"""
+        exact = self._by_key.get((device_id, metric_type), _NONE)
+        wildcard = self._by_key.get((device_id, WILDCARD), _NONE)
+        if not wildcard:
+            return exact
+        if not exact:
+            return wildcard
+        return exact | wildcard
+
+    def clear(self):
+        self._by_key.clear()
+        self._keys.clear()
+
+    def stats(self) -> dict:
+        return {
+            "subscriptions": len(self._keys),
+            "keys": len(self._by_key),
+            "wildcards": sum(1 for _, metric_type in self._by_key if metric_type == WILDCARD),
+        }
+
+
+subscription_index = SubscriptionIndex()
+
+
+async def load_subscription_index():
+    async with AsyncSessionFactory() as session:
+        subscription_index.load(await SQLAlchemyMetrics(session).get_subscription_keys())
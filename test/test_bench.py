@@ -0,0 +1,78 @@
+import json
+import random
+import struct
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from bench.context import BenchContext, BenchDevice, BenchUser
+from bench.report import compare, percentile, summarize
+from bench.scenarios import SCENARIOS
+from bench.serialization import SERIALIZERS, time_series_rows
+from src.db.migration import DEVICE_METRIC_TYPES, PG_EPOCH, metric_chunk
+from src.models import DeviceType
+
+
+def test_summary_percentiles_and_query_counts():
+    latencies = [i / 1000 for i in range(1, 101)]
+    summary = summarize(latencies, errors=0, statuses={200: 100}, wall_seconds=2.0,
+                        statements={"calls": 300, "exec_ms": 50.0, "rows": 100})
+    assert percentile(sorted(latencies), 99) == 0.099
+    assert summary["p50_ms"] == 50.0
+    assert summary["rps"] == 50.0
+    assert summary["queries_per_request"] == 3.0
+
+
+def test_compare_reports_regressions_over_threshold():
+    base = {"endpoints": {"GET /sites": {"p50_ms": 10.0, "p95_ms": 20.0, "p99_ms": 30.0, "rps": 100.0}}}
+    new = {"endpoints": {"GET /sites": {"p50_ms": 10.5, "p95_ms": 20.0, "p99_ms": 40.0, "rps": 80.0}}}
+    _, regressions = compare(base, new, threshold_percent=10)
+    assert regressions == ["GET /sites p99_ms +33.3%", "GET /sites rps -20.0%"]
+
+
+def test_serializers_produce_same_json():
+    rows = time_series_rows(100)
+    bodies = {name: serialize(rows) for name, serialize in SERIALIZERS.items()}
+    # orjson output is byte for byte the one of the response model
+    assert bodies["orjson_rows"] == bodies["response_model"]
+    assert json.loads(bodies["stdlib_json"]) == json.loads(bodies["orjson_rows"])
+
+
+def test_every_scenario_builds_request():
+    site_id = uuid.uuid4()
+    device = BenchDevice(uuid.uuid4(), site_id, "battery-000", "battery", ["voltage"])
+    users = [
+        BenchUser(uuid.uuid4(), access_level, "token", sites=[site_id], devices=[device], subscriptions=[uuid.uuid4()])
+        for access_level in ("technical", "normal")
+    ]
+    ctx = BenchContext(users=users, rng=random.Random(0), disposable_devices=[(users[0], uuid.uuid4())])
+    for scenario in SCENARIOS:
+        method, url, kwargs = scenario.build(ctx)
+        assert url.startswith("/") and "{" not in url, scenario.name
+        assert method == scenario.name.split()[0]
+
+
+def test_metric_chunk_is_valid_binary_copy():
+    pytest.importorskip("numpy")
+    device_ids = [uuid.uuid4(), uuid.uuid4()]
+    start = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    chunk = metric_chunk(DeviceType.SOLAR_PANEL, device_ids, start, 60, first_point=720, points=3, batch_seed=(0,))
+
+    rows, offset = [], 0
+    while offset < len(chunk):
+        (fields,) = struct.unpack_from(">h", chunk, offset)
+        offset += 2
+        values = []
+        for _ in range(fields):
+            (size,) = struct.unpack_from(">i", chunk, offset)
+            values.append(chunk[offset + 4:offset + 4 + size])
+            offset += 4 + size
+        rows.append((PG_EPOCH + timedelta(microseconds=struct.unpack(">q", values[0])[0]),
+                     uuid.UUID(bytes=values[1]), values[2].decode(), struct.unpack(">d", values[3])[0]))
+
+    assert len(rows) == 2 * 3 * len(DEVICE_METRIC_TYPES[DeviceType.SOLAR_PANEL])
+    assert rows[0][:3] == (start + timedelta(hours=12), device_ids[0], "power_output")
+    assert rows[3][:3] == (start + timedelta(hours=12), device_ids[1], "power_output")
+    # noon output of a panel
+    assert rows[0][3] > 1_000
@@ -1,15 +1,34 @@
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone, timedelta
+from types import SimpleNamespace
 from uuid import UUID
 
 import pytest
+from sqlalchemy import select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import object_mapper
+from sqlalchemy.pool import NullPool
 from asyncmock import AsyncMock
 from httpx import AsyncClient, ASGITransport
+from src.config import app_config
+from src.db.asyncpg_repository import AsyncpgSites
 from src.db.database import get_db
+from src.db.devices_repository import SQLAlchemyDevices
+from src.db.timescale import select_rollup
 from src.main import app
-from src.models import Sites, Devices, DeviceMetrics, METRIC_TYPE_TO_UNIT
+from src.models import AlertRule, Sites, Devices, DeviceMetrics, METRIC_TYPE_TO_UNIT, Subscription
 from src.dependencies import UserClaims, decode_jwt_token
-from src.routers.router_model import DeviceRequest
+from src.routers.pagination import decode_cursor
+from src.routers.router_model import DeviceRequest, SiteResponse
+from src.services.alerts import alert_engine
+from src.services import instrumentation
+from src.services.instrumentation import RequestQueries, current_queries, install_query_hooks, record_query, timed_statement
+from src.services.latest_cache import latest_cache
+from src.services.ownership import ownership_index
+from src.services.response_cache import response_cache
+from src.services.site_rollups import site_rollups
+from src.services.subscriptions import subscription_index
 
 site_id = UUID(int=3)
 device_id = UUID(int=4)
@@ -37,6 +56,7 @@ def test_client_with_repos():
     mock_session.sites = mocked_sites
     mock_session.devices = mocked_devices
     mock_session.metrics = mocked_metrics
+    mocked_sites.get_user_ownership.return_value = [(site_id, device_id)]
 
     async def _get_db():
         yield mock_session
@@ -51,6 +71,51 @@ def test_client_with_repos():
     yield client, mock_session
 
     app.dependency_overrides.clear()
+    latest_cache.clear()
+    ownership_index.clear()
+    response_cache.clear()
+    site_rollups.clear()
+    subscription_index.clear()
+
+
+class DeviceSession:
+    """Session of a single stored device under SQLAlchemyDevices, refuses what AsyncSession refuses"""
+
+    def __init__(self, device: Devices):
+        self.device = device
+        self.commits = 0
+
+    async def execute(self, stmt):
+        if stmt.is_delete:
+            deleted, self.device = self.device is not None, None
+            return SimpleNamespace(rowcount=int(deleted))
+        rows = [self.device] if self.device is not None else []
+        return SimpleNamespace(scalar_one_or_none=lambda: self.device, scalars=lambda: SimpleNamespace(all=lambda: rows))
+
+    async def commit(self):
+        self.commits += 1
+        if self.device is not None:
+            # onupdate of updated_at
+            self.device.updated_at = datetime.now(timezone.utc)
+
+    async def refresh(self, instance):
+        # raises for anything but a mapped instance, like AsyncSession.refresh
+        object_mapper(instance)
+
+
+def _device_session(mock_db_session) -> tuple[DeviceSession, list]:
+    """Wires real SQLAlchemyDevices over DeviceSession and records ownership loads"""
+    session = DeviceSession(Devices(id=device_id, name="Inverter", site_id=site_id, type="inverter",
+                                    updated_at=datetime(2025, 1, 1, tzinfo=timezone.utc)))
+    mock_db_session.devices = SQLAlchemyDevices(session)
+    loads = []
+
+    async def get_user_ownership(user_id):
+        loads.append(user_id)
+        return [(site_id, session.device.id)] if session.device is not None else [(site_id, None)]
+
+    mock_db_session.sites.get_user_ownership = get_user_ownership
+    return session, loads
 
 
 @pytest.mark.asyncio
@@ -85,6 +150,84 @@ async def test_list_sites(test_client_with_repos):
         assert sites[0].name == mock_site.name
 
 
+@pytest.mark.asyncio
+async def test_list_sites_next_cursor(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    first = Sites(id=uuid.uuid4(), name="A", user_id=technical_user.id)
+    second = Sites(id=uuid.uuid4(), name="B", user_id=technical_user.id)
+    mock_db_session.sites.get_all_user_sites.return_value = [first, second]
+
+    app.dependency_overrides[decode_jwt_token] = override_decode_jwt_token
+    async with client as c:
+        response = await c.get("/sites", params={"limit": 1})
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+        cursor = response.headers["X-Next-Cursor"]
+        assert decode_cursor(cursor, 2) == ["A", str(first.id)]
+        assert f"cursor={cursor}" in response.headers["Link"]
+
+        response = await c.get("/sites", params={"cursor": "not-a-cursor"})
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_list_devices_cursor_follows_site_name_id(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    first = Devices(id=uuid.uuid4(), name="A", site_id=site_id, type="battery")
+    second = Devices(id=uuid.uuid4(), name="B", site_id=site_id, type="battery")
+    calls = []
+
+    async def get_user_devices(user_id, after, limit):
+        calls.append(after)
+        return [first, second]
+
+    mock_db_session.devices.get_user_devices = get_user_devices
+    async with client as c:
+        response = await c.get("/devices", params={"limit": 1})
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+        assert decode_cursor(response.headers["X-Next-Cursor"], 3) == [str(site_id), "A", str(first.id)]
+
+        response = await c.get("/devices", params={"cursor": response.headers["X-Next-Cursor"]})
+        assert response.status_code == 200
+        assert calls == [None, (site_id, "A", first.id)]
+
+
+@pytest.mark.asyncio
+async def test_site_etag_and_response_cache(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    session, _ = _device_session(mock_db_session)
+
+    async with client as c:
+        response = await c.get(f"/sites/{site_id}/devices")
+        assert response.status_code == 200
+        assert response.json() == [{"id": str(device_id)[:8], "name": "Inverter", "site_id": str(site_id)[:8], "type": "inverter"}]
+        etag = response.headers["ETag"]
+        assert response.headers["Cache-Control"] == "private, no-cache"
+        devices_etag = (await c.get("/devices")).headers["ETag"]
+
+        # served from the cache, the body is not serialized for a matching ETag
+        stored, session.device = session.device, None
+        response = await c.get(f"/sites/{site_id}/devices", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+        session.device = stored
+
+        # a device write through the repository drops cached responses of the user, new version changes the ETag
+        response = await c.put(f"/devices/{device_id}", json={"name": "Renamed"})
+        assert response.status_code == 200
+        response = await c.get(f"/sites/{site_id}/devices", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json()[0]["name"] == "Renamed"
+        assert response.headers["ETag"] != etag
+
+        response = await c.delete(f"/devices/{device_id}")
+        assert response.status_code == 200
+        response = await c.get("/devices", headers={"If-None-Match": devices_etag})
+        assert response.status_code == 200
+        assert response.json() == []
+
 @pytest.mark.asyncio
 async def test_create_device_technical(test_client_with_repos):
     client, mock_db_session = test_client_with_repos
@@ -140,6 +283,25 @@ async def test_delete_device_technical(test_client_with_repos):
         assert value["msg"] == "Device was deleted"
 
 
+@pytest.mark.asyncio
+async def test_device_writes_commit_and_reload_ownership(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    session, loads = _device_session(mock_db_session)
+
+    async with client as c:
+        response = await c.put(f"/devices/{device_id}", json={"name": "Renamed", "site_id": str(site_id)})
+        assert response.status_code == 200
+        assert session.device.name == "Renamed"
+        response = await c.delete(f"/devices/{device_id}")
+        assert response.status_code == 200
+        # ownership was dropped by the delete, the device isn't owned anymore
+        response = await c.delete(f"/devices/{device_id}")
+        assert response.status_code == 404
+
+    assert session.commits == 2
+    assert len(loads) == 3
+
+
 # test R3 metrics
 
 @pytest.mark.asyncio
@@ -148,14 +310,401 @@ async def test_metric_last_value(test_client_with_repos):
     existing_metrics = DeviceMetrics(
         time=datetime.now(),
         device_id = device_id,
-        metric_type = str(METRIC_TYPE_TO_UNIT.CURRENT),
+        metric_type = METRIC_TYPE_TO_UNIT.CURRENT.name.lower(),
         value = 47.47
     )
-    mock_db_session.metrics.get_metric_last_values.return_value = existing_metrics
+    mock_db_session.metrics.get_latest_metrics.return_value = [existing_metrics]
 
 
     app.dependency_overrides[decode_jwt_token] = override_decode_jwt_token_technical
     payload = { "metric_type": "current"}
     async with client as c:
         response = await c.get(f"/devices/{device_id}/metrics/latest", params=payload)
-        assert response.status_code == 200
\ No newline at end of file
+        assert response.status_code == 200
+        value = response.json()
+        assert value["value"] == 47.47
+        assert value["unit"] == "A"
+
+# test R5 time-series
+
+@pytest.mark.asyncio
+async def test_time_series_aggregated(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    mock_db_session.metrics.get_subscription.return_value = Subscription(
+        id=subscription_id, device_id=device_id, metric_type="power_output"
+    )
+    mock_db_session.metrics.get_subscription_timeseries_data.return_value = [
+        {"time": datetime(2025, 1, 1, hour), "value": float(hour)} for hour in range(24)
+    ]
+
+    params = {"start_time": "2025-01-01T00:00:00", "end_time": "2025-01-02T00:00:00", "interval": "1h", "aggregation": "max"}
+    async with client as c:
+        response = await c.get(f"/subscriptions/{subscription_id}/time-series", params=params)
+        assert response.status_code == 200
+        value = response.json()
+        assert value["count"] == 24
+        assert value["aggregation"] == "max"
+
+
+@pytest.mark.asyncio
+async def test_time_series_takes_naive_bound_as_utc(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    mock_db_session.metrics.get_subscription.return_value = Subscription(
+        id=subscription_id, device_id=device_id, metric_type="power_output"
+    )
+    queries = []
+
+    async def get_subscription_timeseries_data(subscription_id, query):
+        queries.append(query)
+        return []
+
+    mock_db_session.metrics.get_subscription_timeseries_data = get_subscription_timeseries_data
+
+    params = {"start_time": "2025-01-01T00:00:00Z", "end_time": "2025-01-02T00:00:00", "interval": "1h"}
+    async with client as c:
+        response = await c.get(f"/subscriptions/{subscription_id}/time-series", params=params)
+        assert response.status_code == 200
+        assert queries[0].end_time == datetime(2025, 1, 2, tzinfo=timezone.utc)
+
+        params = {"start_time": "2025-01-02T00:00:00+01:00", "end_time": "2025-01-01T23:00:00"}
+        response = await c.get(f"/subscriptions/{subscription_id}/time-series", params=params)
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_time_series_rejects_too_many_points(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+
+    params = {"start_time": "2024-01-01T00:00:00", "end_time": "2025-01-01T00:00:00", "interval": "1s"}
+    async with client as c:
+        response = await c.get(f"/subscriptions/{subscription_id}/time-series", params=params)
+        assert response.status_code == 400
+
+
+# test metric ingestion
+
+@pytest.mark.asyncio
+async def test_ingest_metrics_batch_json(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    mock_db_session.metrics.insert_metrics.return_value = [
+        (datetime(2025, 1, 1, 0, minute, tzinfo=timezone.utc), device_id, "voltage", 230.0) for minute in range(2)
+    ]
+
+    payload = [
+        {"time": "2025-01-01T00:00:00Z", "device_id": str(device_id), "metric_type": "voltage", "value": 230.1},
+        {"time": "2025-01-01T00:01:00Z", "device_id": str(device_id), "metric_type": "VOLTAGE", "value": 229.8},
+        {"time": "2025-01-01T00:01:00Z", "device_id": str(device_id), "metric_type": "humidity", "value": 1.0},
+        {"time": "not a time", "device_id": str(device_id), "metric_type": "voltage", "value": 1.0},
+    ]
+    async with client as c:
+        response = await c.post("/metrics/batch", json=payload)
+        assert response.status_code == 200
+        value = response.json()
+        assert value["accepted"] == 2
+        assert value["rejected"] == 2
+
+
+@pytest.mark.asyncio
+async def test_ingest_metrics_batch_ndjson(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    mock_db_session.metrics.insert_metrics.return_value = [
+        (datetime(2025, 1, 1, tzinfo=timezone.utc), device_id, "current", 4.2)
+    ]
+
+    body = "\n".join([
+        f'{{"time": "2025-01-01T00:00:00Z", "device_id": "{device_id}", "metric_type": "current", "value": 4.2}}',
+        f'{{"time": "2025-01-01T00:00:00Z", "device_id": "{device_id}", "metric_type": "current", "value": 4.2}}',
+        "{broken",
+    ])
+    async with client as c:
+        response = await c.post("/metrics/batch", content=body, headers={"content-type": "application/x-ndjson"})
+        assert response.status_code == 200
+        value = response.json()
+        assert value["accepted"] == 1
+        assert value["rejected"] == 2
+
+
+@pytest.mark.asyncio
+async def test_site_latest_metrics(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    mock_db_session.sites.get_user_site.return_value = Sites(id=site_id, name="Test Site", user_id=technical_user.id)
+    mock_db_session.metrics.get_site_latest_metrics.return_value = [
+        DeviceMetrics(time=datetime.now(timezone.utc), device_id=device_id, metric_type="voltage", value=231.0),
+        DeviceMetrics(time=datetime.now(timezone.utc), device_id=UUID(int=6), metric_type="charge_level", value=80.0),
+    ]
+
+    async with client as c:
+        response = await c.get(f"/sites/{site_id}/metrics/latest")
+        assert response.status_code == 200
+        value = response.json()
+        assert [metric["unit"] for metric in value] == ["V", "%"]
+
+
+@pytest.mark.asyncio
+async def test_site_summary(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    now = datetime.now(timezone.utc)
+    mock_db_session.metrics.get_site_metric_buckets.return_value = [
+        {"bucket": now, "device_id": device_id, "device_type": "battery", "metric_type": "charge_level",
+         "sum": 150.0, "count": 2, "max": 80.0},
+    ]
+    mock_db_session.metrics.get_site_latest_metrics.return_value = [
+        DeviceMetrics(time=now, device_id=device_id, metric_type="charge_level", value=80.0),
+    ]
+
+    async with client as c:
+        response = await c.get(f"/sites/{site_id}/summary")
+        assert response.status_code == 200
+        windows = response.json()["windows"]
+        assert windows["now"]["battery_charge"] == {"value": 80.0, "unit": "%", "devices": 1}
+        assert windows["1h"]["battery_charge"]["value"] == 75.0
+        assert windows["1d"]["production"]["value"] is None
+
+        response = await c.get(f"/sites/{UUID(int=9)}/summary")
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_latest_metrics_batch(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    batch_device_id = UUID(int=7)
+    mock_db_session.sites.get_user_ownership.return_value = [(site_id, device_id), (site_id, batch_device_id)]
+    mock_db_session.metrics.get_latest_metrics.return_value = [
+        DeviceMetrics(time=datetime.now(timezone.utc), device_id=batch_device_id, metric_type="temperature", value=41.5),
+    ]
+
+    payload = {"device_ids": [str(batch_device_id), str(UUID(int=8))], "metric_types": ["temperature", "voltage"]}
+    async with client as c:
+        response = await c.post("/metrics/latest:batch", json=payload)
+        assert response.status_code == 200
+        value = response.json()
+        assert len(value) == 1
+        assert value[0]["unit"] == "C"
+
+
+@pytest.mark.asyncio
+async def test_alert_rule_lifecycle(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    rule_id = UUID(int=12)
+    mock_db_session.metrics.get_subscription.return_value = Subscription(id=subscription_id, device_id=device_id, metric_type="temperature")
+    mock_db_session.metrics.create_alert_rule.return_value = AlertRule(id=rule_id)
+    mock_db_session.metrics.delete_alert_rule.return_value = True
+
+    async with client as c:
+        response = await c.post(f"/subscriptions/{subscription_id}/alerts",
+                                json={"kind": "rate", "operator": "<", "threshold": -1.0})
+        assert response.status_code == 422
+
+        response = await c.post(f"/subscriptions/{subscription_id}/alerts",
+                                json={"kind": "threshold", "operator": ">", "threshold": 80.0, "duration_seconds": 300})
+        assert response.status_code == 201
+        assert response.json()["device_id"] == str(device_id)
+        assert alert_engine.stats()["rules"] == 1
+
+        response = await c.delete(f"/subscriptions/{subscription_id}/alerts/{rule_id}")
+        assert response.status_code == 200
+        assert alert_engine.stats()["rules"] == 0
+
+
+
+@pytest.mark.asyncio
+async def test_subscription_create_and_delete_update_index(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    subscription = Subscription(id=subscription_id, device_id=device_id, metric_type="*", created_at=datetime.utcnow())
+    mock_db_session.metrics.create_devices_subscriptions.return_value = [subscription]
+    mock_db_session.metrics.get_subscription.return_value = subscription
+    mock_db_session.metrics.delete_subscription.return_value = True
+
+    async with client as c:
+        response = await c.post("/subscriptions", json={"device_ids": [str(device_id)], "metric_types": ["*", "voltage"]})
+        assert response.status_code == 200
+        value = response.json()
+        assert [sub["id"] for sub in value["created"]] == [str(subscription_id)]
+        assert value["existing"] == [{"device_id": str(device_id), "metric_type": "voltage"}]
+        assert subscription_index.match(device_id, "voltage") == {subscription_id}
+
+        response = await c.post(f"/subscriptions/{subscription_id}/alerts",
+                                json={"kind": "threshold", "operator": ">", "threshold": 80.0})
+        assert response.status_code == 400
+        params = {"start_time": "2025-01-01T00:00:00", "end_time": "2025-01-02T00:00:00", "interval": "1h"}
+        response = await c.get(f"/subscriptions/{subscription_id}/time-series", params=params)
+        assert response.status_code == 400
+
+        response = await c.post("/subscriptions", json={"device_ids": [str(device_id)], "metric_types": ["voltgae"]})
+        assert response.status_code == 422
+
+        response = await c.delete(f"/subscriptions/{subscription_id}")
+        assert response.status_code == 200
+        assert not subscription_index.match(device_id, "voltage")
+
+
+
+def test_time_series_rollup_selection():
+    assert select_rollup(timedelta(seconds=30)) is None
+    assert select_rollup(timedelta(minutes=90)).view == "device_metrics_1m"
+    assert select_rollup(timedelta(hours=6)).view == "device_metrics_1h"
+    assert select_rollup(timedelta(days=1)).view == "device_metrics_1d"
+
+    # range has to start and end on rollup bucket edges, coarsest aligned rollup is used
+    day = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    assert select_rollup(timedelta(hours=1), day, day + timedelta(days=7)).view == "device_metrics_1h"
+    assert select_rollup(timedelta(hours=1), day + timedelta(minutes=30), day + timedelta(days=7)).view == "device_metrics_1m"
+    assert select_rollup(timedelta(hours=1), day, day + timedelta(days=7, seconds=5)) is None
+    assert select_rollup(timedelta(days=1), datetime(2025, 1, 1), None).view == "device_metrics_1d"
+
+
+@pytest.mark.asyncio
+async def test_storage_chunk_stats(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    chunk = {"range_start": "2025-01-01T00:00:00Z", "range_end": "2025-01-02T00:00:00Z", "before_compression_bytes": None,
+             "after_compression_bytes": None}
+    mock_db_session.metrics.get_chunk_stats.return_value = [
+        {**chunk, "chunk_name": "_hyper_1_1_chunk", "is_compressed": True, "total_bytes": 100,
+         "before_compression_bytes": 1200, "after_compression_bytes": 100},
+        {**chunk, "chunk_name": "_hyper_1_2_chunk", "is_compressed": False, "total_bytes": 900},
+    ]
+
+    async with client as c:
+        response = await c.get("/admin/storage/chunks")
+        assert response.status_code == 200
+        value = response.json()
+        assert value["total_bytes"] == 1000
+        assert value["compression_ratio"] == 12.0
+        assert value["chunks"][1]["compression_ratio"] is None
+
+
+@pytest.mark.asyncio
+async def test_asyncpg_repository_maps_records_to_rows():
+    connection = AsyncMock()
+    connection.fetchrow.return_value = (site_id, "Test Site", UUID(int=1), datetime(2025, 1, 1, tzinfo=timezone.utc))
+    driver = AsyncMock()
+    driver.get.return_value = connection
+
+    site = await AsyncpgSites(session=None, driver=driver).get_user_site(site_id)
+
+    assert site.user_id == UUID(int=1)
+    assert SiteResponse.model_validate(site).name == "Test Site"
+
+
+@pytest.mark.asyncio
+async def test_export_site_metrics_csv(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    mock_db_session.sites.get_user_site.return_value = Sites(id=site_id, name="Test Site", user_id=technical_user.id)
+
+    async def batches(**kwargs):
+        for value in range(3):
+            yield [(datetime(2025, 1, 1, tzinfo=timezone.utc), device_id, "voltage", float(value))]
+
+    mock_db_session.metrics.stream_site_metrics = batches
+
+    params = {"start_time": "2025-01-01T00:00:00Z", "end_time": "2025-01-02T00:00:00Z", "format": "csv"}
+    async with client as c:
+        response = await c.get(f"/sites/{site_id}/metrics/export", params=params)
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert lines[0] == "time,device_id,metric_type,value"
+        assert len(lines) == 4
+
+
+@pytest.mark.asyncio
+async def test_export_site_metrics_takes_naive_bound_as_utc(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    ranges = []
+
+    async def batches(site_id, start_time, end_time, batch_size):
+        ranges.append((start_time, end_time))
+        yield [(datetime(2025, 1, 1, tzinfo=timezone.utc), device_id, "voltage", 1.0)]
+
+    mock_db_session.metrics.stream_site_metrics = batches
+
+    params = {"start_time": "2025-01-01T00:00:00Z", "end_time": "2025-01-02T00:00:00", "format": "ndjson"}
+    async with client as c:
+        response = await c.get(f"/sites/{site_id}/metrics/export", params=params)
+        assert response.status_code == 200
+        assert ranges == [(datetime(2025, 1, 1, tzinfo=timezone.utc), datetime(2025, 1, 2, tzinfo=timezone.utc))]
+
+        params["start_time"] = "2025-01-02T01:00:00+01:00"
+        response = await c.get(f"/sites/{site_id}/metrics/export", params=params)
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_foreign_device_is_not_found(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    foreign_device_id = UUID(int=9)
+
+    async with client as c:
+        response = await c.delete(f"/devices/{foreign_device_id}")
+        assert response.status_code == 404
+        response = await c.get(f"/devices/{foreign_device_id}/metrics/latest", params={"metric_type": "current"})
+        assert response.status_code == 404
+        response = await c.get(f"/sites/{UUID(int=10)}")
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_request_db_timing_is_reported(test_client_with_repos):
+    client, mock_db_session = test_client_with_repos
+    mock_site = Sites(id=site_id, name="Test Site", user_id=technical_user.id)
+
+    async def get_user_site(site_id):
+        # what the engine hooks report for executed statements
+        record_query("SELECT sites.id, sites.name FROM sites WHERE sites.id = $1", (site_id,), 0.004, None)
+        return mock_site
+
+    mock_db_session.sites.get_user_site = get_user_site
+    async with client as c:
+        response = await c.get(f"/sites/{site_id}")
+        assert response.status_code == 200
+        assert 'db;dur=4.000;desc="1 queries"' in response.headers["Server-Timing"]
+
+        response = await c.get("/metrics")
+        assert response.status_code == 200
+        assert 'http_request_db_queries_count{method="GET",route="/sites/{site_id}"}' in response.text
+        assert 'http_request_duration_seconds_count{method="GET",route="/sites/{site_id}",status="200"}' in response.text
+
+
+def test_transaction_control_is_not_counted(monkeypatch):
+    monkeypatch.setattr(instrumentation, "slow_query_log", None)
+    queries = RequestQueries()
+    token = current_queries.set(queries)
+    try:
+        for statement in ("BEGIN;", "BEGIN ISOLATION LEVEL READ COMMITTED;", "SAVEPOINT sa_1", "RELEASE SAVEPOINT sa_1",
+                          "ROLLBACK TO SAVEPOINT sa_1", "COMMIT;", "rollback", "SELECT 1"):
+            record_query(statement, None, 0.001, None)
+        record_query("SELECT id FROM sites WHERE id = $1", (site_id,), 0.002, None)
+        # COPY is timed explicitly once instrumentation is installed
+        with timed_statement("COPY device_metrics_stage FROM STDIN"):
+            pass
+        assert queries.count == 1
+        monkeypatch.setattr(instrumentation, "slow_query_log", instrumentation.SlowQueryLog(None, 10, False, 60))
+        with timed_statement("COPY device_metrics_stage FROM STDIN"):
+            pass
+        assert queries.count == 2
+    finally:
+        current_queries.reset(token)
+
+
+@pytest.mark.asyncio
+async def test_orm_transaction_counts_only_its_statements():
+    engine = create_async_engine(app_config.dns, poolclass=NullPool)
+    try:
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+    except (OSError, SQLAlchemyError):
+        await engine.dispose()
+        pytest.skip("database is not reachable")
+
+    install_query_hooks(engine, None)
+    queries = RequestQueries()
+    token = current_queries.set(queries)
+    try:
+        async with AsyncSession(engine) as session:
+            async with session.begin():
+                await session.execute(select(Sites.id).limit(1))
+                await session.execute(select(Devices.id).limit(1))
+    finally:
+        current_queries.reset(token)
+        await engine.dispose()
+    # BEGIN and COMMIT sent through asyncpg are not statements of the request
+    assert queries.count == 2
@@ -0,0 +1,475 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from jwt.algorithms import RSAAlgorithm
+
+from src.dependencies import JWTVerifier
+
+from src.db.database import worker_pool_limits
+from src.services.alerts import AlertEngine
+from src.services.broker import MetricBroker, metric_broker
+from src.services.cluster import ClusterBridge, INVALIDATION_CHANNEL, MAX_PAYLOAD_BYTES, RESYNC_PAYLOAD, metric_payloads
+from src.services.ingest import IngestBuffer, IngestQueueFull, IngestUnavailable
+from src.services.latest_cache import LatestValueCache, latest_cache
+from src.services.ownership import OwnershipIndex
+from src.services.profiler import ProfilerBusy, SamplingProfiler, flamegraph_svg, folded
+from src.services.site_rollups import SiteRollups
+from src.services.subscriptions import WILDCARD, SubscriptionIndex
+
+device_id = uuid.UUID(int=4)
+metric_time = datetime(2025, 1, 1, tzinfo=timezone.utc)
+jwt_secret = "test-secret-long-enough-for-hs256-keys"
+
+
+@pytest.mark.asyncio
+async def test_broker_fans_out_to_matching_consumers():
+    index = SubscriptionIndex()
+    index.add_many([(uuid.UUID(int=1), device_id, "voltage"), (uuid.UUID(int=2), device_id, "current"),
+                    (uuid.UUID(int=3), device_id, WILDCARD)])
+    broker = MetricBroker(queue_size=10, max_drops=10, index=index)
+    voltage = broker.subscribe({uuid.UUID(int=1)})
+    current = broker.subscribe({uuid.UUID(int=2)})
+    everything = broker.subscribe({uuid.UUID(int=3)})
+
+    broker.publish([(metric_time, device_id, "voltage", 230.0)])
+
+    assert '"value": 230.0' in await voltage.get()
+    assert '"value": 230.0' in await everything.get()
+    assert current._queue.empty()
+
+    broker.close_subscription(uuid.UUID(int=2), "subscription deleted")
+    assert await current.get() is None
+    assert current.close_reason == "subscription deleted"
+
+    broker.unsubscribe(voltage)
+    broker.unsubscribe(current)
+    broker.unsubscribe(everything)
+    assert broker.consumers == 0
+
+
+def test_subscription_index_matches_exact_and_wildcard():
+    index = SubscriptionIndex()
+    exact, wildcard, other = uuid.UUID(int=1), uuid.UUID(int=2), uuid.UUID(int=3)
+    index.load([(exact, device_id, "voltage"), (wildcard, device_id, WILDCARD), (other, uuid.UUID(int=9), "voltage")])
+
+    assert index.match(device_id, "voltage") == {exact, wildcard}
+    assert index.match(device_id, "current") == {wildcard}
+    assert index.match(uuid.UUID(int=8), "voltage") == set()
+
+    index.add(exact, device_id, "current")
+    assert index.match(device_id, "voltage") == {wildcard}
+    index.remove(wildcard)
+    assert index.match(device_id, "current") == {exact}
+    assert index.stats() == {"subscriptions": 2, "keys": 2, "wildcards": 0}
+
+
+@pytest.mark.asyncio
+async def test_broker_disconnects_slow_consumer():
+    index = SubscriptionIndex()
+    index.add(uuid.UUID(int=1), device_id, "voltage")
+    broker = MetricBroker(queue_size=2, max_drops=3, index=index)
+    consumer = broker.subscribe({uuid.UUID(int=1)})
+
+    broker.publish([(metric_time, device_id, "voltage", float(value)) for value in range(4)])
+    assert not consumer.closed
+    assert consumer.dropped == 2
+    assert '"value": 2.0' in await consumer.get()
+
+    broker.publish([(metric_time, device_id, "voltage", float(value)) for value in range(4)])
+    assert consumer.closed
+    assert await consumer.get() is None
+
+
+def test_latest_cache_keeps_newest_and_evicts_lru():
+    cache = LatestValueCache(max_entries=2)
+    other_device = uuid.UUID(int=5)
+
+    cache.update([(metric_time, device_id, "voltage", 230.0)])
+    cache.update([(metric_time.replace(year=2024), device_id, "voltage", 1.0)])
+    cache.update([(metric_time, device_id, "voltage", 2.0)])
+    assert cache.get((device_id, "voltage")) == (metric_time, 230.0)
+
+    cache.update([(metric_time, device_id, "current", 5.0), (metric_time, other_device, "current", 6.0)])
+    assert cache.get((device_id, "voltage")) is None
+    assert cache.get((other_device, "current")) == (metric_time, 6.0)
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+
+
+def _verifier(**kwargs) -> JWTVerifier:
+    options = dict(algorithms=["HS256", "RS256"], secret=jwt_secret, public_key_file=None, jwks_file=None,
+                   jwks_reload_seconds=0, cache_size=10, cache_ttl_seconds=300)
+    options.update(kwargs)
+    return JWTVerifier(**options)
+
+
+def test_jwt_verifier_caches_verified_claims():
+    verifier = _verifier()
+    token = jwt.encode({"user_id": str(device_id), "access_level": "technical", "exp": time.time() + 60}, jwt_secret)
+
+    assert verifier.verify(token).access_level == "technical"
+    assert verifier.verify(token).id == str(device_id)
+    assert verifier.stats()["hits"] == 1
+    assert verifier.stats()["misses"] == 1
+
+    with pytest.raises(HTTPException):
+        verifier.verify(jwt.encode({"user_id": str(device_id), "access_level": "technical"}, "other secret long enough for hs256 keys"))
+    # subjects which aren't uuids are refused here instead of failing in routes
+    for subject in ["x", 42]:
+        with pytest.raises(HTTPException) as e:
+            verifier.verify(jwt.encode({"user_id": subject, "access_level": "technical"}, jwt_secret))
+        assert e.value.status_code == 401
+
+
+def test_jwt_verifier_respects_exp_of_cached_token(monkeypatch):
+    verifier = _verifier()
+    now = time.time()
+    token = jwt.encode({"user_id": str(device_id), "access_level": "viewer", "exp": now + 5}, jwt_secret)
+    verifier.verify(token)
+
+    # cached claims can't outlive the token
+    monkeypatch.setattr(time, "time", lambda: now + 10)
+    verifier.verify(token)
+    assert verifier.stats()["hits"] == 0
+    assert verifier.stats()["misses"] == 2
+
+
+def test_jwt_verifier_picks_rotated_key_from_jwks(tmp_path):
+    jwks_file = tmp_path / "jwks.json"
+    old_key, new_key = rsa.generate_private_key(65537, 2048), rsa.generate_private_key(65537, 2048)
+
+    def write_jwks(*keys):
+        jwks = [json.loads(RSAAlgorithm.to_jwk(key.public_key())) | {"kid": kid} for kid, key in keys]
+        jwks_file.write_text(json.dumps({"keys": jwks}))
+
+    write_jwks(("old", old_key))
+    verifier = _verifier(jwks_file=str(jwks_file))
+    claims = {"user_id": str(device_id), "access_level": "viewer"}
+    assert verifier.verify(jwt.encode(claims, old_key, algorithm="RS256", headers={"kid": "old"})).id == str(device_id)
+
+    write_jwks(("old", old_key), ("new", new_key))
+    os.utime(jwks_file, (time.time() + 10, time.time() + 10))
+    assert verifier.verify(jwt.encode(claims, new_key, algorithm="RS256", headers={"kid": "new"})).id == str(device_id)
+
+    with pytest.raises(HTTPException):
+        verifier.verify(jwt.encode(claims, jwt_secret + jwt_secret, algorithm="HS512"))
+
+
+def test_jwt_verifier_keeps_jwks_when_file_is_unreadable(tmp_path, monkeypatch):
+    jwks_file = tmp_path / "jwks.json"
+    key = rsa.generate_private_key(65537, 2048)
+    jwks_file.write_text(json.dumps({"keys": [json.loads(RSAAlgorithm.to_jwk(key.public_key())) | {"kid": "k"}]}))
+    verifier = _verifier(jwks_file=str(jwks_file))
+    claims = {"user_id": str(device_id), "access_level": "viewer"}
+    assert verifier.verify(jwt.encode(claims, key, algorithm="RS256", headers={"kid": "k"})).id == str(device_id)
+
+    # half-written during rotation, then missing
+    jwks_file.write_text('{"keys": [')
+    os.utime(jwks_file, (time.time() + 10, time.time() + 10))
+    assert verifier.verify(jwt.encode(claims | {"n": 1}, key, algorithm="RS256", headers={"kid": "k"})).id == str(device_id)
+    jwks_file.unlink()
+    assert verifier.verify(jwt.encode(claims | {"n": 2}, key, algorithm="RS256", headers={"kid": "k"})).id == str(device_id)
+
+    # unknown kids are rejected with 401 and force at most one reload per interval
+    stats = []
+    real_stat = os.stat
+    monkeypatch.setattr(os, "stat", lambda path, *args, **kwargs: stats.append(path) or real_stat(path, *args, **kwargs))
+    verifier = _verifier(jwks_file=str(tmp_path / "missing.json"), jwks_reload_seconds=60)
+    for n in range(5):
+        with pytest.raises(HTTPException) as e:
+            verifier.verify(jwt.encode(claims | {"n": n}, key, algorithm="RS256", headers={"kid": "bogus"}))
+        assert e.value.status_code == 401
+    assert len(stats) == 2
+
+
+@pytest.mark.asyncio
+async def test_ownership_index_reloads_after_invalidation():
+    index = OwnershipIndex(ttl_seconds=60, max_users=10)
+    user_id, site_id = uuid.UUID(int=1), uuid.UUID(int=2)
+    loads = []
+
+    async def loader(user):
+        loads.append(user)
+        return [(site_id, device_id), (uuid.UUID(int=3), None)]
+
+    ownership = await index.get(user_id, loader)
+    assert ownership.devices == {device_id: site_id}
+    assert len(ownership.sites) == 2
+
+    await index.get(user_id, loader)
+    index.invalidate_user(user_id)
+    await index.get(user_id, loader)
+    assert loads == [user_id, user_id]
+
+
+@pytest.mark.asyncio
+async def test_ingest_buffer_batches_by_size_and_age():
+    batches = []
+
+    async def writer(records):
+        batches.append(list(records))
+        return records
+
+    buffer = IngestBuffer(writer, max_rows=100, batch_size=3, max_delay=0.02, retries=0)
+    buffer.start()
+    buffer.submit([(metric_time, device_id, "voltage", float(value)) for value in range(4)])
+    await asyncio.sleep(0.05)
+    assert [len(batch) for batch in batches] == [3, 1]
+
+    with pytest.raises(IngestQueueFull):
+        buffer.submit([(metric_time, device_id, "voltage", 0.0)] * 101)
+
+    buffer.submit([(metric_time, device_id, "current", 1.0)])
+    await buffer.stop(timeout=1)
+    assert [len(batch) for batch in batches] == [3, 1, 1]
+    assert buffer.stats()["written_rows"] == 5
+    assert not buffer.running
+
+
+@pytest.mark.asyncio
+async def test_ingest_buffer_keeps_age_of_rows_left_by_a_batch():
+    started = []
+
+    async def writer(records):
+        started.append(time.monotonic())
+        if len(started) == 1:
+            await asyncio.sleep(0.4)
+        return records
+
+    buffer = IngestBuffer(writer, max_rows=100, batch_size=3, max_delay=0.3, retries=0)
+    buffer.start()
+    buffer.submit([(metric_time + timedelta(seconds=value), device_id, "voltage", 0.0) for value in range(3)])
+    await asyncio.sleep(0.01)
+    # submitted while the first batch is written, the row left by the second batch is overdue already
+    buffer.submit([(metric_time + timedelta(seconds=value), device_id, "current", 0.0) for value in range(4)])
+    await asyncio.sleep(0.5)
+    assert len(started) == 3
+    assert started[2] - started[1] < 0.1
+    await buffer.stop(timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_ingest_buffer_publishes_inserted_rows_only():
+    stored = set()
+
+    async def writer(records):
+        inserted = [record for record in records if record[:3] not in stored]
+        stored.update(record[:3] for record in inserted)
+        return inserted
+
+    published = []
+    metric_broker.add_listener(published.extend)
+    try:
+        buffer = IngestBuffer(writer, max_rows=100, batch_size=10, max_delay=0.01, retries=0)
+        buffer.start()
+        records = [(metric_time + timedelta(seconds=value), device_id, "voltage", float(value)) for value in range(2)]
+        buffer.submit(records)
+        await asyncio.sleep(0.03)
+        # retried batch, the first reading was stored already
+        buffer.submit([records[0], (metric_time, device_id, "current", 1.0)])
+        await buffer.stop(timeout=1)
+    finally:
+        metric_broker._listeners.remove(published.extend)
+
+    assert published == [*records, (metric_time, device_id, "current", 1.0)]
+    assert buffer.stats()["written_rows"] == 3
+
+
+@pytest.mark.asyncio
+async def test_ingest_buffer_rejects_when_not_running():
+    async def writer(records):
+        return records
+
+    buffer = IngestBuffer(writer, max_rows=10, batch_size=5, max_delay=0.01, retries=0)
+    with pytest.raises(IngestUnavailable):
+        buffer.submit([(metric_time, device_id, "voltage", 0.0)])
+
+
+def test_worker_pool_limits_fit_server_connections():
+    assert worker_pool_limits(20, 10, max_connections=200, reserved=10, workers=1, dedicated=1) == (20, 10)
+    pool_size, max_overflow = worker_pool_limits(20, 10, max_connections=200, reserved=10, workers=8, dedicated=1)
+    assert (pool_size, max_overflow) == (20, 2)
+    pool_size, max_overflow = worker_pool_limits(20, 10, max_connections=200, reserved=10, workers=16, dedicated=1)
+    assert 16 * (pool_size + max_overflow + 1) <= 190
+
+
+def test_cluster_bridge_relays_metrics_of_other_workers():
+    records = [(metric_time, device_id, "voltage", float(value)) for value in range(500)]
+    payloads = list(metric_payloads(records))
+    assert len(payloads) > 1
+    assert all(len(payload) < MAX_PAYLOAD_BYTES + 100 for payload in payloads)
+
+    received = []
+    metric_broker.add_listener(received.extend)
+    try:
+        bridge = ClusterBridge("postgresql://localhost/stats", queue_size=10)
+        bridge._server_pid = 1
+        bridge._on_metrics(None, 1, "device_metrics", payloads[0])
+        assert received == []
+        for payload in payloads:
+            bridge._on_metrics(None, 2, "device_metrics", payload)
+        assert received == records
+    finally:
+        metric_broker._listeners.remove(received.extend)
+
+
+class NotifyConnection:
+    def __init__(self, fail: bool):
+        self.fail = fail
+        self.closed = False
+        self.sent = []
+
+    def is_closed(self):
+        return self.closed
+
+    async def execute(self, query, channels, payloads):
+        if self.fail:
+            raise OSError("connection lost")
+        self.sent.extend(zip(channels, payloads))
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_cluster_bridge_keeps_invalidations_and_resyncs_after_dropped_metrics():
+    bridge = ClusterBridge("postgresql://localhost/stats", queue_size=1)
+    # pretend the LISTEN task runs, the send loop is driven by hand
+    bridge._task = asyncio.Future()
+    records = [(metric_time, device_id, "voltage", float(value)) for value in range(500)]
+    bridge._forward_metrics(records)
+    assert bridge.dropped > 0
+    for user in range(3):
+        bridge.invalidate_ownership(uuid.UUID(int=user))
+
+    # failed round trip loses readings but not invalidations
+    with pytest.raises(OSError):
+        await bridge._send_loop(NotifyConnection(fail=True))
+    connection = NotifyConnection(fail=False)
+    await bridge._send_loop(connection)
+    invalidations = [payload for channel, payload in connection.sent if channel == INVALIDATION_CHANNEL]
+    assert invalidations == [RESYNC_PAYLOAD] + [json.dumps({"user_id": str(uuid.UUID(int=user))}) for user in range(3)]
+
+    # receiving worker drops caches built from readings it may have missed
+    latest_cache.update(records[:1])
+    bridge._server_pid = 1
+    bridge._on_invalidation(None, 2, INVALIDATION_CHANNEL, RESYNC_PAYLOAD)
+    assert latest_cache.get((device_id, "voltage")) is None
+
+
+@pytest.mark.asyncio
+async def test_site_rollups_load_once_and_follow_ingest():
+    rollups = SiteRollups(ttl_seconds=60, max_sites=10)
+    site_id, pv_id, wind_id, battery_id = (uuid.UUID(int=value) for value in (10, 11, 12, 13))
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    loads = []
+
+    class Metrics:
+        async def get_site_metric_buckets(self, site_id, metric_types, bucket_width, start_time):
+            loads.append(bucket_width)
+            if bucket_width == timedelta(hours=1):
+                # ten hours ago, only in the 1d window
+                return [{"bucket": now - timedelta(hours=10), "device_id": pv_id, "device_type": "pv_panel",
+                         "metric_type": "power_output", "sum": 9000.0, "count": 3, "max": 4000.0}]
+            return [
+                {"bucket": now - timedelta(minutes=30), "device_id": wind_id, "device_type": "wind_turbines",
+                 "metric_type": "power_output", "sum": 2000.0, "count": 2, "max": 1500.0},
+                # not a quantity of any device type, ignored
+                {"bucket": now, "device_id": battery_id, "device_type": "battery",
+                 "metric_type": "power_output", "sum": 1.0, "count": 1, "max": 1.0},
+            ]
+
+        async def get_site_latest_metrics(self, site_id, metric_types):
+            return [SimpleNamespace(time=now - timedelta(minutes=30), device_id=wind_id,
+                                    metric_type="power_output", value=1500.0)]
+
+    summary = await rollups.summary(site_id, Metrics())
+    windows = summary["windows"]
+    assert windows["now"]["production"] == {"value": 1500.0, "unit": "W", "devices": 1}
+    assert windows["15m"]["production"]["value"] is None
+    assert windows["1h"]["production"]["value"] == 1000.0
+    assert windows["1d"]["production"]["value"] == 3000.0
+
+    rollups.update([(now, wind_id, "power_output", 500.0), (now, uuid.UUID(int=99), "power_output", 1.0)])
+    summary = await rollups.summary(site_id, Metrics())
+    windows = summary["windows"]
+    assert windows["now"]["production"]["value"] == 500.0
+    assert windows["15m"]["production"]["value"] == 500.0
+    assert windows["1h"]["production"]["value"] == 2500.0 / 3
+    assert summary["updated_at"] == now
+    assert len(loads) == 2
+
+    rollups.invalidate_site(site_id)
+    rollups.update([(now, wind_id, "power_output", 100.0)])
+    assert rollups.stats()["series"] == 0
+    await rollups.summary(site_id, Metrics())
+    assert len(loads) == 4
+
+
+@pytest.mark.asyncio
+async def test_alert_engine_fires_after_duration_and_on_rate():
+    engine = AlertEngine()
+    battery_id = uuid.UUID(int=20)
+    rule = {"subscription_id": uuid.UUID(int=21), "device_id": device_id, "metric_type": "temperature"}
+    engine.load([
+        {**rule, "id": uuid.UUID(int=22), "kind": "threshold", "operator": ">", "threshold": 80.0, "duration_seconds": 300},
+        {**rule, "id": uuid.UUID(int=23), "device_id": battery_id, "metric_type": "charge_level",
+         "kind": "rate", "operator": "<", "threshold": -2.0, "duration_seconds": 120},
+    ])
+    consumer = metric_broker.subscribe({rule["subscription_id"]})
+    try:
+        minute = timedelta(minutes=1)
+        engine.evaluate([(metric_time + minute * i, device_id, "temperature", 85.0) for i in range(5)])
+        assert not engine.is_firing(uuid.UUID(int=22))
+        engine.evaluate([(metric_time + minute * 5, device_id, "temperature", 86.0)])
+        assert engine.is_firing(uuid.UUID(int=22))
+        event = json.loads(await consumer.get())
+        assert (event["event"], event["state"], event["observed"]) == ("alert", "firing", 86.0)
+
+        engine.evaluate([(metric_time + minute * 6, device_id, "temperature", 70.0)])
+        assert json.loads(await consumer.get())["state"] == "resolved"
+    finally:
+        metric_broker.unsubscribe(consumer)
+
+    # 90 -> 88 -> 83 %, the last minute drops 5 %/min over the 2 minute window
+    engine.evaluate([(metric_time + timedelta(minutes=i), battery_id, "charge_level", value)
+                     for i, value in enumerate((90.0, 88.0, 83.0))])
+    assert engine.is_firing(uuid.UUID(int=23))
+    assert engine.stats()["fired"] == 2
+
+    engine.remove_rule(uuid.UUID(int=23))
+    assert engine.stats()["series"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sampling_profiler_sees_busy_coroutine():
+    profiler = SamplingProfiler()
+
+    def serialize():
+        # blocks the loop for longer than the interpreter switch interval
+        deadline = time.perf_counter() + 0.02
+        while time.perf_counter() < deadline:
+            pass
+
+    async def busy_handler():
+        for _ in range(10):
+            serialize()
+            await asyncio.sleep(0)
+
+    stacks, _ = await asyncio.gather(profiler.profile(0.2, interval_seconds=0.002), busy_handler())
+    assert any("busy_handler" in stack and "serialize" in stack for stack in stacks)
+    assert "busy_handler" in folded(stacks)
+    assert flamegraph_svg(stacks, title="test").startswith("<svg")
+
+    with pytest.raises(ProfilerBusy):
+        await asyncio.gather(profiler.profile(0.05, 0.01), profiler.profile(0.05, 0.01))